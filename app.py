@@ -4,21 +4,33 @@ from flask import (
     request,
     redirect,
     url_for,
-    logging,
     session,
     g,
     Response,
+    stream_with_context,
+    make_response,
 ) 
 # import sqlite3
 import json
+import csv
+import io
 from markupsafe import escape
 import secrets
+import hashlib
 import os
 import datetime, calendar
-from db import (DB, BadRequest, KeyNotFound, UsernameAlreadyExists)
-import psycopg2
-
-# Configure application
+from db import (DB, BadRequest, KeyNotFound, UsernameAlreadyExists, CSV_TABLES, PAGE_SIZE, parse_date, from_cents)
+from pool import (get_pool, PoolExhausted)
+from migrate import stamp
+from hashing import HashingBusy
+from cache import page_cache
+from recurrence import add_months, parse_repeat
+from assets import Assets
+import instrument
+import logs
+
+# Configure application, logging first so app.logger goes through its queue
+logs.setup_logging()
 app = Flask(__name__)
 app.config.update(SESSION_COOKIE_SAMESITE="None", SESSION_COOKIE_SECURE=True)
 
@@ -39,13 +51,17 @@ def login():
         if request.form['username'] and request.form['password']:
             db = DB(get_db())
             try:
-                if db.validate_user(request):
+                user_id = db.validate_user(request)
+                if user_id:
                     session['username'] = request.form['username']
+                    session['user_id'] = user_id
                 else:
                     error = 'Invalid Credentials. Please try again.'
                     return render_template('login.html', newuser=False, error=error)
+            except HashingBusy:
+                raise
             except Exception as e:
-                app.logger.error(e)
+                app.logger.error("%s", e)
                 error = 'Invalid Credentials. Please try again.'
                 return render_template('login.html', newuser=False, error=error)
             return redirect(url_for('myexpenses'))
@@ -59,22 +75,33 @@ def createuser():
     if request.method == 'POST':
         db = DB(get_db())
         try:
-            db.add_user(request)
+            user_id = db.add_user(request)
             session['username'] = request.form['username']
+            session['user_id'] = user_id
         except UsernameAlreadyExists as e:
-            app.logger.error(e.message)
+            app.logger.error("%s", e.message)
             error = "Username already exists. Try a different one."
             return render_template('login.html', newuser=True, error=error)
+        except HashingBusy:
+            raise
         except Exception as e:
-            app.logger.error(e)
+            app.logger.error("%s", e)
             return render_template('login.html', newuser=True, error=e)
         return redirect(url_for('myexpenses'))
     return render_template('login.html', newuser=True, error=error)
 
+# too many passwords are being hashed already, ask the client to back off
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    app.logger.error("%s", e.message)
+    newuser = request.endpoint == 'createuser'
+    return render_template('login.html', newuser=newuser, error=e.message), 429, {'Retry-After': '1'}
+
 @app.route('/logout')
 def logout():
     # remove the username from the session if it's there
     session.pop('username', None)
+    session.pop('user_id', None)
     return redirect(url_for('login'))
 
 
@@ -89,9 +116,16 @@ def addexpense():
     db = DB(get_db())
     message = "Expense added successfully"
     try:
-        db.addexpense(session['username'], request)
+        # date and repeat are optional, the DB layer defaults them to today and onetime
+        day = form_day(request.form.get('date', ''))
+        db.addexpense(current_user_id(), session['username'], request.form)
+        # a repeating expense shows up in every month
+        if parse_repeat(request.form.get('repeat'))[0] != 'onetime':
+            invalidate_pages()
+        elif day:
+            invalidate_pages(day)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Add expense failed. Make user form input is correct"
     return redirect(url_for('myexpenses'))
 
@@ -100,10 +134,8 @@ def addexpense():
 @app.route('/myexpenses/<target_date>', methods=['Get'])
 def myexpenses(target_date = None):
     if not check_logged_in():
-        print("hiiiii")
         return redirect(url_for('login'))
-    db = DB(get_db())
-    message = None
+    message = request.args.get('message')
     myexpenses = None
     etot = None
     stot = None
@@ -111,14 +143,20 @@ def myexpenses(target_date = None):
         target_date = datetime.date.today()
     else:
         target_date = datetime.datetime.strptime(target_date, "%Y-%m-%d").date()
+    month = target_date.replace(day=1)
+    if message is None:
+        (etag, page) = cached_month_view('myexpenses', month)
+        if page is not None:
+            return page_response(page, etag)
+    db = DB(get_db())
     try:
-        (myexpenses,etot,stot) = db.myexpenses(session['username'], target_date)
+        (myexpenses,etot,stot) = db.myexpenses(current_user_id(), target_date, with_spending=False)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
     except Exception as e:
         return redirect(url_for('login'))
-    return render_template(
+    page = render_template(
         "myexpenses.html", 
         rows=myexpenses,
         etotal=etot,
@@ -128,7 +166,12 @@ def myexpenses(target_date = None):
         table="expenses",
         message=message,
         username=session['username']
-    ) 
+    )
+    # pages showing an error or a one-off message are never cached
+    if message is None:
+        page_cache.set(current_user_id(), 'myexpenses', month, (etag, page))
+        return page_response(page, etag)
+    return page
 
 ########################################
 ## Spending endpoints                 ##
@@ -141,9 +184,12 @@ def addspending():
     db = DB(get_db())
     message = "Spending added successfully"
     try:
-        db.addspending(session['username'], request)
+        day = form_day(request.form.get('date', ''))
+        db.addspending(current_user_id(), session['username'], request.form)
+        if day:
+            invalidate_pages(day)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Add spending failed. Make user form input is correct"
     return redirect(url_for('myspending'))
 
@@ -152,28 +198,41 @@ def addspending():
 def myspending(target_date = None):
     if not check_logged_in():
         return redirect(url_for('login'))
-    db = DB(get_db())
-    message = None
+    message = request.args.get('message')
     myspending = None
+    total = None
+    next_page = None
     if not target_date:
         target_date = datetime.date.today()
     else:
         target_date = datetime.datetime.strptime(target_date, "%Y-%m-%d").date()
+    month = target_date.replace(day=1)
+    if message is None:
+        (etag, page) = cached_month_view('myspending', month)
+        if page is not None:
+            return page_response(page, etag)
+    db = DB(get_db())
     try:
-        (myspending, total) = db.myspending(session['username'], target_date)
+        (myspending, total, next_page) = db.myspending(current_user_id(), target_date)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
-    return render_template(
+    page = render_template(
         "myspending.html", 
         rows=myspending, 
         total=total, 
+        next_page=next_page,
         month=calendar.month_name[target_date.month],
         year=target_date.year,
         table="spending", 
         message=message, 
         username=session['username']
-    ) 
+    )
+    # pages showing an error or a one-off message are never cached
+    if message is None:
+        page_cache.set(current_user_id(), 'myspending', month, (etag, page))
+        return page_response(page, etag)
+    return page
 
 
 ########################################
@@ -187,9 +246,9 @@ def addgoal():
     db = DB(get_db())
     message = "goal added successfully"
     try:
-        db.addgoal(session['username'], request)
+        db.addgoal(current_user_id(), session['username'], request.form)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Add goal failed. Make user form input is correct"
     return redirect(url_for('mygoals'))
 
@@ -198,12 +257,13 @@ def mygoals():
     if not check_logged_in():
         return redirect(url_for('login'))
     db = DB(get_db())
-    message = None
+    message = request.args.get('message')
     mygoals = None
+    total = None
     try:
-        (mygoals, total) = db.mygoals(session['username'])
+        (mygoals, total) = db.mygoals(current_user_id())
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
     return render_template(
         "mygoals.html", 
@@ -226,9 +286,9 @@ def adddebt():
     db = DB(get_db())
     message = "Debt added successfully"
     try:
-        db.adddebt(session['username'], request)
+        db.adddebt(current_user_id(), session['username'], request.form)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Add Debt failed. Make user form input is correct"
     return redirect(url_for('mydebt'))
 
@@ -237,12 +297,13 @@ def mydebt():
     if not check_logged_in():
         return redirect(url_for('login'))
     db = DB(get_db())
-    message = None
+    message = request.args.get('message')
     mydebt = None
+    total = None
     try:
-        (mydebt, total) = db.mydebt(session['username'])
+        (mydebt, total) = db.mydebt(current_user_id())
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
     return render_template(
         "mydebt.html",
@@ -265,9 +326,12 @@ def addincome():
     db = DB(get_db())
     message = "Income added successfully"
     try:
-        db.addincome(session['username'], request)
+        day = form_day(request.form.get('date', ''))
+        db.addincome(current_user_id(), session['username'], request.form)
+        if day:
+            invalidate_pages(day)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Add income failed. Make user form input is correct"
     return redirect(url_for('myincome'))
 
@@ -276,28 +340,140 @@ def addincome():
 def myincome(target_date = None):
     if not check_logged_in():
         return redirect(url_for('login'))
-    db = DB(get_db())
-    message = None
+    message = request.args.get('message')
     myincome = None
+    total = None
+    next_page = None
     if not target_date:
         target_date = datetime.date.today()
     else:
         target_date = datetime.datetime.strptime(target_date, "%Y-%m-%d").date()
+    month = target_date.replace(day=1)
+    if message is None:
+        (etag, page) = cached_month_view('myincome', month)
+        if page is not None:
+            return page_response(page, etag)
+    db = DB(get_db())
     try:
-        (myincome, total) = db.myincome(session['username'], target_date)
+        (myincome, total, next_page) = db.myincome(current_user_id(), target_date)
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
-    return render_template(
+    page = render_template(
         "myincome.html",
         rows=myincome,
         total=total, 
+        next_page=next_page,
         month=calendar.month_name[target_date.month],
         year=target_date.year,
         table="income",
         message=message,
         username=session['username']
-    ) 
+    )
+    # pages showing an error or a one-off message are never cached
+    if message is None:
+        page_cache.set(current_user_id(), 'myincome', month, (etag, page))
+        return page_response(page, etag)
+    return page
+
+
+########################################
+## Dashboard endpoints                ##
+########################################
+
+# income, spending, expected expenses and spending per category for every month
+# from ?from= to ?to= (YYYY-MM, inclusive), the last 12 months by default.
+# ?format=json answers with the numbers alone, for charting
+@app.route('/dashboard', methods=['GET'])
+def dashboard():
+    if not check_logged_in():
+        return redirect(url_for('login'))
+    fmt = request.args.get('format', 'html')
+    try:
+        last = parse_month(request.args.get('to')) or datetime.date.today().replace(day=1)
+        first = parse_month(request.args.get('from')) or add_months(last.year, last.month, -11, 1)
+        end = add_months(last.year, last.month, 1, 1)
+        if fmt not in ('html', 'json'):
+            raise BadRequest("format must be html or json")
+    except (BadRequest, ValueError) as e:
+        return Response(getattr(e, 'message', str(e)), status=400)
+
+    # cached like the month views, the etag changes with every write
+    view = "dashboard-{}-{}".format(fmt, end.isoformat())
+    (etag, page) = cached_month_view(view, first)
+    if page is None:
+        try:
+            data = DB(get_db()).dashboard(current_user_id(), first, end)
+        except BadRequest as e:
+            app.logger.error("%s", e.message)
+            if fmt == 'json':
+                return api_response({"message": str(e.message)}, 400)
+            return render_template("dashboard.html", data=None, scale=1, first=first.strftime("%Y-%m"), last=last.strftime("%Y-%m"),
+                table="dashboard", message=str(e.message), username=session['username'])
+        if fmt == 'json':
+            page = json.dumps(data)
+        else:
+            page = render_template(
+                "dashboard.html",
+                data=data,
+                # the largest amount of any month, bars are drawn relative to it
+                scale=max([max(m["income"], m["spending"], m["expected"]) for m in data["months"]] + [1]),
+                first=first.strftime("%Y-%m"),
+                last=last.strftime("%Y-%m"),
+                table="dashboard",
+                message=None,
+                username=session['username']
+            )
+        page_cache.set(current_user_id(), view, first, (etag, page))
+    response = page_response(page, etag)
+    if fmt == 'json':
+        response.mimetype = 'application/json'
+    return response
+
+
+########################################
+## Search endpoints                   ##
+########################################
+
+# the user's records matching every word of ?q= (as prefixes), best match
+# first, ?table= limits it to one table and ?page= (from 1) pages through.
+# ?format=json answers with the rows alone
+@app.route('/search', methods=['GET'])
+def search():
+    if not check_logged_in():
+        return redirect(url_for('login'))
+    fmt = request.args.get('format', 'html')
+    q = request.args.get('q', '')
+    tablename = request.args.get('table') or None
+    results = []
+    more = False
+    message = None
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        (results, more) = DB(get_db()).search(current_user_id(), q, tablename, page)
+    except ValueError:
+        return Response("page must be a number", status=400)
+    except BadRequest as e:
+        app.logger.error("%s", e.message)
+        if fmt == 'json':
+            return api_response({"message": str(e.message)}, 400)
+        message = "Something went wrong. Please try again"
+    if fmt == 'json':
+        return api_response({
+            "rows": [dict(api_row(t, row), table=t, rank=rank) for (t, row, rank) in results],
+            "next": page + 1 if more else None,
+        })
+    return render_template(
+        "search.html",
+        results=results,
+        q=q,
+        search_table=tablename,
+        page=page,
+        more=more,
+        table="search",
+        message=message,
+        username=session['username']
+    )
 
 
 ########################################
@@ -312,9 +488,10 @@ def deleterow():
     message = "row deleted successfully"
     try:
         data = json.loads(request.data.decode())
-        db.delete_record(session['username'], data['tablename'], data['rid'])
+        db.delete_record(current_user_id(), data['tablename'], data['rid'])
+        invalidate_pages()
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
     return redirect(url_for("my{}".format(data['tablename']), message=message))
 
@@ -328,56 +505,395 @@ def importcsv():
         return redirect(url_for('login'))
     db = DB(get_db())
     message = None
+    tablename = request.form['tablename']
     try:
-        db.import_csvdata(session['username'], request.files['csvfile'], request.form['tablename'])
+        summary = db.import_csvdata(current_user_id(), request.files['csvfile'], tablename)
+        invalidate_pages()
+        if request.accept_mimetypes.best == 'application/json':
+            return Response(json.dumps(summary), mimetype='application/json')
+        message = "Imported {} rows".format(summary['accepted'])
+        if summary['rejected']:
+            message += ", {} rejected ({})".format(
+                summary['rejected'],
+                "; ".join("line {}: {}".format(e['line'], e['error']) for e in summary['errors'][:3])
+            )
     except BadRequest as e:
-        app.logger.error(f"{e}")
+        app.logger.error("%s", e.message)
         message = "Something went wrong. Please try again"
-    return redirect(url_for("my{}".format(request.form['tablename']), message=message))
+    if tablename not in CSV_TABLES:
+        tablename = "expenses"
+    return redirect(url_for("my{}".format(tablename), message=message))
+
+
+########################################
+## JSON API                           ##
+########################################
+
+# names of the fields in the rows the API returns, in ROW_COLUMNS order
+API_FIELDS = {
+    "spending": ["id", "date", "name", "amount", "expense_name", "category", "owner"],
+    "expenses": ["id", "date", "name", "expected", "repeat_type", "owner"],
+    "goals": ["id", "date", "name", "target", "amount", "owner"],
+    "debt": ["id", "date", "name", "amount", "owner"],
+    "income": ["id", "date", "name", "amount", "type", "owner"],
+}
+
+API_READS = {
+    "goals": lambda db, user_id, day: db.mygoals(user_id)[0],
+    "debt": lambda db, user_id, day: db.mydebt(user_id)[0],
+}
+API_PAGED_READS = {
+    "spending": "myspending",
+    "income": "myincome",
+}
+
+API_WRITES = {
+    "spending": "addspending",
+    "expenses": "addexpense",
+    "goals": "addgoal",
+    "debt": "adddebt",
+    "income": "addincome",
+}
+
+def api_row(tablename, row):
+    return dict(zip(API_FIELDS[tablename], row))
+
+def api_response(data, status=200):
+    return Response(json.dumps(data, default=str), status=status, mimetype='application/json')
+
+# a json body read like the fields of the html forms: numbers as their text
+# and null as a field left out. Anything else is refused
+def api_form(body):
+    if not isinstance(body, dict):
+        raise BadRequest("the body must be a json object")
+    form = {}
+    for (field, value) in body.items():
+        if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+            raise BadRequest("{} must be a string".format(field))
+        if value is not None:
+            form[field] = str(value)
+    return form
+
+# the month the client is looking at, ?month=YYYY-MM, this month by default
+def api_month():
+    month = request.args.get('month')
+    if not month:
+        return datetime.date.today().replace(day=1)
+    return datetime.datetime.strptime(month, "%Y-%m").date()
+
+# GET lists a table for ?month=, spending and income a page at a time
+# (?after= is the "next" of the previous page), POST adds a record from a json body or form
+# fields named like the html forms, DELETE removes ?id=. Every call answers
+# with only the rows it touched and the table's totals for ?month=
+@app.route('/api/<tablename>', methods=['GET', 'POST', 'DELETE'])
+def api(tablename):
+    if not check_logged_in():
+        return api_response({"message": "not logged in"}, 401)
+    if tablename not in API_FIELDS:
+        return api_response({"message": "unknown table {}".format(tablename)}, 404)
+    db = DB(get_db())
+    user_id = current_user_id()
+    status = 200
+    try:
+        day = api_month()
+        if request.method == 'GET':
+            if tablename == 'expenses':
+                data = {"rows": [
+                    dict(api_row('expenses', e), spent=spent, spending=[api_row('spending', row) for row in linked])
+                    for (e, spent, linked) in db.myexpenses(user_id, day)[0]
+                ]}
+            elif tablename == 'spending' and request.args.get('expense'):
+                # the rows shown under one expense on the expenses page
+                data = {"rows": [api_row('spending', row) for row in db.linked_spending(user_id, request.args['expense'], day)]}
+            elif tablename in API_PAGED_READS:
+                after = request.args.get('after')
+                if after:
+                    try:
+                        (after_date, after_id) = after.split(',')
+                        after = (parse_date(after_date), int(after_id))
+                    except ValueError:
+                        raise BadRequest("after must be the next of an earlier page")
+                try:
+                    limit = max(1, min(int(request.args.get('limit', PAGE_SIZE)), PAGE_SIZE))
+                except ValueError:
+                    raise BadRequest("limit must be a whole number")
+                (rows, _, next_page) = getattr(db, API_PAGED_READS[tablename])(user_id, day, after, limit)
+                data = {
+                    "rows": [api_row(tablename, row) for row in rows],
+                    "next": "{},{}".format(*next_page) if next_page else None,
+                }
+            else:
+                data = {"rows": [api_row(tablename, row) for row in API_READS[tablename](db, user_id, day)]}
+        elif request.method == 'POST':
+            body = request.get_json(silent=True)
+            form = request.form if body is None else api_form(body)
+            rid = getattr(db, API_WRITES[tablename])(user_id, session['username'], form)
+            invalidate_pages()
+            data = {"rows": [api_row(tablename, db.get_record(user_id, tablename, rid))]}
+            status = 201
+        else:
+            rid = request.args.get('id') or (request.get_json(silent=True) or {}).get('id')
+            if not rid:
+                raise BadRequest("id is required")
+            if not str(rid).isdigit():
+                raise BadRequest("id must be a record id")
+            if not db.delete_record(user_id, tablename, rid):
+                raise KeyNotFound("no {} record {}".format(tablename, rid))
+            invalidate_pages()
+            data = {"deleted": [rid]}
+        data["totals"] = db.totals(user_id, tablename, day)
+    except (BadRequest, KeyNotFound) as e:
+        app.logger.error("%s", e.message)
+        return api_response({"message": str(e.message)}, 404 if isinstance(e, KeyNotFound) else 400)
+    except (KeyError, ValueError) as e:
+        return api_response({"message": "missing or invalid field {}".format(e)}, 400)
+    return api_response(data, status)
+
+# many records at once, in one transaction. The json body picks them with
+# "ids": [...] or "filter": {"from": date, "to": date, field: value} and PATCH
+# sets "set": {field: value} on them, e.g. to recategorize spending or link it
+# to an expense. Answers with the ids touched and the table's totals for ?month=
+@app.route('/api/<tablename>/bulk', methods=['PATCH', 'DELETE'])
+def api_bulk(tablename):
+    if not check_logged_in():
+        return api_response({"message": "not logged in"}, 401)
+    if tablename not in API_FIELDS:
+        return api_response({"message": "unknown table {}".format(tablename)}, 404)
+    db = DB(get_db())
+    user_id = current_user_id()
+    body = request.get_json(silent=True) or {}
+    try:
+        if not isinstance(body, dict):
+            raise BadRequest("the body must be a json object")
+        day = api_month()
+        if request.method == 'PATCH':
+            rids = db.update_records(user_id, tablename, body.get('set'), body.get('ids'), body.get('filter'))
+            data = {"updated": rids}
+        else:
+            rids = db.delete_records(user_id, tablename, body.get('ids'), body.get('filter'))
+            data = {"deleted": rids}
+        if rids:
+            invalidate_pages()
+        data["totals"] = db.totals(user_id, tablename, day)
+    except BadRequest as e:
+        app.logger.error("%s", e.message)
+        return api_response({"message": str(e.message)}, 400)
+    except ValueError as e:
+        return api_response({"message": "invalid month {}".format(e)}, 400)
+    return api_response(data)
+
+# quick entry of many spending, income and expense records at once. The json body is
+# {"records": [{"table": "spending", "name": ..., "amount": ..., "date": ...}, ...]}
+# with fields named like the csv columns. Either every record is added, in one
+# transaction, or none is and the answer says what was wrong with each of them.
+# Answers with one result per record and the totals for ?month= of each table added to
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    if not check_logged_in():
+        return api_response({"message": "not logged in"}, 401)
+    db = DB(get_db())
+    user_id = current_user_id()
+    body = request.get_json(silent=True) or {}
+    try:
+        day = api_month()
+        results = db.add_records(user_id, session['username'], body.get('records'))
+        if any("error" in result for result in results):
+            return api_response({"message": "no records were added", "results": results}, 400)
+        invalidate_pages()
+        tables = sorted({result["table"] for result in results})
+        data = {"results": results, "totals": {t: db.totals(user_id, t, day) for t in tables}}
+    except BadRequest as e:
+        app.logger.error("%s", e.message)
+        return api_response({"message": str(e.message)}, 400)
+    except ValueError as e:
+        return api_response({"message": "invalid month {}".format(e)}, 400)
+    return api_response(data, 201)
+
+
+########################################
+## Export endpoints                   ##
+########################################
+
+# streams every row of a table, optionally between ?from= and ?to= (YYYY-MM-DD,
+# inclusive), as csv in the layout /importcsv reads or as ?format=ndjson
+@app.route('/export/<tablename>', methods=['GET'])
+def export(tablename):
+    if not check_logged_in():
+        return redirect(url_for('login'))
+    fmt = request.args.get('format', 'csv')
+    try:
+        start = parse_date(request.args.get('from', ''), required=False)
+        end = parse_date(request.args.get('to', ''), required=False)
+        if fmt not in ('csv', 'ndjson'):
+            raise BadRequest("format must be csv or ndjson")
+        db = DB(get_db())
+        (columns, rows) = db.export_rows(current_user_id(), tablename, start, end)
+    except (BadRequest, ValueError) as e:
+        return Response(getattr(e, 'message', str(e)), status=400)
+
+    def generate():
+        buf = io.StringIO()
+        if fmt == 'csv':
+            out = csv.writer(buf)
+            out.writerow(columns)
+        for i, row in enumerate(rows, 1):
+            if fmt == 'csv':
+                out.writerow(['' if v is None else str(v) for v in row])
+            else:
+                buf.write(json.dumps(dict(zip(columns, [None if v is None else str(v) for v in row]))) + "\n")
+            if i % 500 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': 'attachment; filename={}.{}'.format(tablename, fmt)},
+    )
+
+
+########################################
+## Stats endpoints                    ##
+########################################
+
+@app.route('/poolstats', methods=['GET'])
+def poolstats():
+    return Response(json.dumps(get_pool().stats()), mimetype='application/json')
+
+@app.errorhandler(PoolExhausted)
+def pool_exhausted(e):
+    app.logger.error("%s", e.message)
+    return Response(e.message, status=503)
+
+
+@app.route('/cachestats', methods=['GET'])
+def cachestats():
+    return Response(json.dumps(page_cache.stats()), mimetype='application/json')
+
+# pool and page cache numbers for /metrics, next to the request and query totals
+STATS_COUNTERS = {"created", "discarded", "waits", "wait_time", "hits", "misses", "evictions"}
+
+def pool_and_cache_metrics():
+    lines = []
+    for (prefix, stats) in (("mft_pool", get_pool().stats()), ("mft_page_cache", page_cache.stats())):
+        for (name, value) in sorted(stats.items()):
+            if isinstance(value, (int, float)) and name != "pid":
+                kind = "counter" if name in STATS_COUNTERS else "gauge"
+                lines += ["# TYPE {}_{} {}".format(prefix, name, kind), "{}_{} {}".format(prefix, name, value)]
+    lines += ["# TYPE mft_log_records_dropped counter", "mft_log_records_dropped {}".format(logs.dropped())]
+    return lines
+
+instrument.init_app(app, pool_and_cache_metrics)
+
+# styles and scripts under content hashed urls, see assets.py
+static_assets = Assets(app)
 
 
 ########################################
 ## Utility functions                  ##
 ########################################
 
+# changes whenever a template or a static asset does, so new markup or
+# asset urls are never answered with a 304
+TEMPLATE_VERSION = hashlib.sha1(b"".join(
+    open(os.path.join(app.root_path, app.template_folder, name), 'rb').read()
+    for name in sorted(os.listdir(os.path.join(app.root_path, app.template_folder)))
+) + static_assets.version.encode()).hexdigest()[:8]
+
+def month_view_etag(view, month):
+    user_id = current_user_id()
+    version = DB(get_db()).data_version(user_id)
+    return "{}-{}-{}-{}-{}".format(TEMPLATE_VERSION, user_id, view, month.isoformat(), version)
+
+# the etag of a month view and the page to answer with if nothing changed:
+# an empty body when the browser already has it (page_response turns that
+# into a 304), the cached page when it is current, otherwise None
+def cached_month_view(view, month):
+    etag = month_view_etag(view, month)
+    if etag in request.if_none_match:
+        return (etag, '')
+    cached = page_cache.get(current_user_id(), view, month)
+    if cached is not None and cached[0] == etag:
+        return cached
+    return (etag, None)
+
+# browsers keep the page but check back every time it is shown
+def page_response(page, etag):
+    response = make_response(page)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+# amounts are integer cents everywhere but here, 123456 -> "$1,234.56"
+@app.template_filter('money')
+def money(cents):
+    if cents is None:
+        return ""
+    return "{}${:,.2f}".format("-" if cents < 0 else "", from_cents(abs(cents)))
+
+# the first day of a YYYY-MM month, None when value is empty
+def parse_month(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, "%Y-%m").date()
+
+# the day a form's date field refers to, today when it was left empty and
+# None when it is not a date
+def form_day(value):
+    try:
+        return parse_date(value, required=False) or datetime.date.today()
+    except ValueError:
+        return None
+
+# drop the current user's cached pages for the month of day, or all of them
+def invalidate_pages(day=None):
+    page_cache.invalidate(current_user_id(), day.replace(day=1) if day else None)
+
 def check_logged_in():
-    print(session)
     if 'username' in session:
-        print("you are logged in! " + session['username'])
+        # sessions created before user_id was stored resolve it once through the cache
+        if 'user_id' not in session:
+            try:
+                session['user_id'] = DB(get_db()).get_user_id(session['username'])
+            except KeyNotFound:
+                session.pop('username', None)
+                return False
         return True
-    print("go log in")
     return False
 
-# connect to db
+# the user_id is stored in the session at login, so DB calls never have to look it up
+def current_user_id():
+    return session['user_id']
+
+# check a connection out of this process's pool for the current request,
+# wrapped for query timing when instrumentation is on
 def get_db():
-    db = getattr(g, '_database', None)
+    db = getattr(g, '_db', None)
     if db is None:
-        # db = g._database = sqlite3.connect(DATABASE)
-        #establishing the connection
-        db = g._database = psycopg2.connect(
-            database="d6coe2acjtc5c2",
-            user='hivembvhcpxsdb',
-            password='1321404f100002f28266e3b26d0b79106cd73fb9e58d7ad4127d759d8482b649',
-            port='5432',
-            host='ec2-52-21-153-207.compute-1.amazonaws.com',
-        )
-        db.autocommit = True
+        g._database = get_pool().getconn()
+        db = g._db = instrument.instrumented(g._database)
     return db
 
-# close connectiong to db
+# return the connection to the pool
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    g.pop('_db', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        get_pool().putconn(db)
 
 # Create Database
 def init_db():
     with app.app_context():
         db = get_db()
-        with app.open_resource('./static/schema.sql', mode='r') as f:
+        with open(get_pool().backend.schema_file, mode='r') as f:
             db.cursor().execute(f.read())
         db.commit()
+        # schema.sql is already the latest schema, no migration needs to run
+        stamp(db)
     
 
 if __name__ == "__main__":
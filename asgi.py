@@ -0,0 +1,153 @@
+"""
+The async server mode, an ASGI application for uvicorn or hypercorn:
+
+    uvicorn asgi:app --workers 4
+
+Flask 1.1 views are plain functions, so every request still goes through the
+Flask app, on a thread from a bounded pool (ASGI_THREADS), while the worker's
+event loop keeps accepting connections and moving bytes. One worker process
+serves many requests that are waiting on the database at once instead of one
+per sync gunicorn worker, and the fan-out (asyncdb.py) runs each page's
+independent queries at the same time. Request bodies are read before the view
+runs, large ones into a temporary file, and responses are sent as the app
+produces them, so exports still stream. Only HTTP is served, no websockets.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import asyncdb
+from logs import setup_logging
+from pool import get_pool, reset_pool
+from app import app as flask_app
+
+# requests running in the Flask app at once in each worker, each holds a pooled
+# connection while it does, so DB_POOL_MAX should be at least this
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 16))
+# request bodies larger than this are kept in a temporary file
+MAX_MEMORY_BODY = 1024 * 1024
+
+asyncdb.enable()
+
+_executor = None
+_lock = threading.Lock()
+
+
+# the request threads of the current process, started in each worker
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None or _executor.pid != os.getpid():
+            _executor = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix="request")
+            _executor.pid = os.getpid()
+        return _executor
+
+async def _read_body(receive):
+    body = tempfile.SpooledTemporaryFile(max_size=MAX_MEMORY_BODY)
+    more = True
+    while more:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.write(message.get("body", b""))
+        more = message.get("more_body", False)
+    length = body.tell()
+    body.seek(0)
+    return (body, length)
+
+# the WSGI environ of an ASGI http scope, see PEP 3333 and the ASGI spec
+def _environ(scope, body, length):
+    (server_name, server_port) = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for (name, value) in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+# run the Flask app for one request on a request thread. send(message) blocks
+# until the event loop has passed the message on, which keeps a slow client
+# from piling a whole export up in memory
+def _serve(environ, send):
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started and started[0]:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started[:] = [False, status, headers]
+        return write
+
+    def write(data):
+        if not started[0]:
+            send({
+                "type": "http.response.start",
+                "status": int(started[1].split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for (name, value) in started[2]],
+            })
+            started[0] = True
+        if data:
+            send({"type": "http.response.body", "body": data, "more_body": True})
+
+    result = flask_app(environ, start_response)
+    try:
+        for chunk in result:
+            write(chunk)
+        write(b"")
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    send({"type": "http.response.body", "body": b"", "more_body": False})
+
+# every worker process starts with its own connections and log writer, the way
+# gunicorn.conf.py sets up a sync worker after it is forked
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            setup_logging()
+            reset_pool()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            get_pool().closeall()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        raise ValueError("only http is served, not {}".format(scope["type"]))
+    loop = asyncio.get_running_loop()
+    (body, length) = await _read_body(receive)
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    try:
+        await loop.run_in_executor(_get_executor(), _serve, _environ(scope, body, length), send_from_thread)
+    finally:
+        body.close()
@@ -0,0 +1,134 @@
+"""
+Fingerprinted static assets. `python assets.py build` copies every file in
+ASSETS from static/ to static/dist/ under a name holding a hash of its
+contents (main.js -> main.3f2a9c1b04de.js). It writes gzip copies next to
+them, and brotli copies when the brotli package is installed, plus
+static/dist/manifest.json mapping each file to its hashed name.
+
+Templates link to asset_url('main.js'). The url changes whenever the file
+does, so /assets/ answers can be kept by browsers for a year without ever
+being checked again, and come precompressed when the browser accepts it.
+Without a build, or for files changed since the last one, the hashes are
+worked out when the app starts and the file in static/ is served as it is.
+"""
+import os
+import sys
+import json
+import gzip
+import hashlib
+import logging
+import mimetypes
+from flask import request, send_file, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST = os.path.join(DIST_DIR, "manifest.json")
+# the files the templates link to
+ASSETS = ["styles.css", "jquery.min.js", "main.js"]
+# hashed urls never change their contents
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# precompressed copies a build writes, the preferred one first, as (Content-Encoding, suffix)
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+log = logging.getLogger(__name__)
+
+
+# main.js -> main.3f2a9c1b04de.js, from the file's contents
+def hashed_name(name, data):
+    (root, ext) = os.path.splitext(name)
+    return "{}.{}{}".format(root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+# write the hashed and compressed copies and the manifest, and clear out
+# the files of earlier builds. returns the manifest
+def build():
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = {}
+    keep = {"manifest.json"}
+    for name in ASSETS:
+        data = _read(os.path.join(STATIC_DIR, name))
+        hashed = manifest[name] = hashed_name(name, data)
+        _write(os.path.join(DIST_DIR, hashed), data)
+        # mtime=0 keeps the gzip bytes the same from one build to the next
+        _write(os.path.join(DIST_DIR, hashed + ".gz"), gzip.compress(data, 9, mtime=0))
+        keep.update((hashed, hashed + ".gz"))
+        if brotli is not None:
+            _write(os.path.join(DIST_DIR, hashed + ".br"), brotli.compress(data, quality=11))
+            keep.add(hashed + ".br")
+    for name in os.listdir(DIST_DIR):
+        if name not in keep:
+            os.remove(os.path.join(DIST_DIR, name))
+    _write(MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+# {hashed name: (path, mimetype, encodings)} for every asset, from the build
+# when it is current, otherwise from static/
+def load():
+    manifest = {}
+    if os.path.exists(MANIFEST):
+        manifest = json.loads(_read(MANIFEST))
+    files = {}
+    for name in ASSETS:
+        path = os.path.join(STATIC_DIR, name)
+        hashed = hashed_name(name, _read(path))
+        encodings = []
+        if manifest.get(name) == hashed:
+            path = os.path.join(DIST_DIR, hashed)
+            encodings = [(encoding, suffix) for (encoding, suffix) in ENCODINGS if os.path.exists(path + suffix)]
+        elif manifest:
+            log.warning("%s changed since the last asset build, serving it uncompressed", name)
+        files[hashed] = (name, path, mimetypes.guess_type(name)[0], encodings)
+    return files
+
+
+"""
+Serves the fingerprinted assets of one app at /assets/ and gives its
+templates asset_url(). version changes with any asset, page ETags include it
+so a page is never answered with a 304 while it links to stale urls.
+"""
+class Assets:
+    def __init__(self, app):
+        self.files = load()
+        self.urls = {name: "/assets/" + hashed for (hashed, (name, _, _, _)) in self.files.items()}
+        self.version = hashlib.sha1("".join(sorted(self.files)).encode()).hexdigest()[:8]
+        app.add_url_rule("/assets/<filename>", "assets", self.serve)
+        app.add_template_global(self.url, "asset_url")
+
+    def url(self, name):
+        return self.urls[name]
+
+    def serve(self, filename):
+        if filename not in self.files:
+            abort(404)
+        (_, path, mimetype, encodings) = self.files[filename]
+        encoding = None
+        for (accepted, suffix) in encodings:
+            if request.accept_encodings[accepted]:
+                (encoding, path) = (accepted, path + suffix)
+                break
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        if encodings:
+            response.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["build"]:
+        sys.exit("usage: python assets.py build")
+    for (name, hashed) in build().items():
+        print("{} -> dist/{}".format(name, hashed))
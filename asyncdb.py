@@ -0,0 +1,82 @@
+"""
+Concurrent reads, turned on with ASYNC_DB=1 and always on in the async server
+mode (asgi.py). A page's independent queries, a month's total, its rows and
+the like, normally run one after another on the request's connection. With
+the fan-out on, DB.gather hands all but the first to a thread pool, each on a
+connection of its own from the process's pool, so a page waits for its
+slowest query instead of the sum of them. psycopg2 lets go of the GIL while it
+waits for the server, so the round trips overlap.
+
+Reads only fan out to connections that are free right away. A read that finds
+the pool empty runs on the request's own connection after the first one, so a
+busy worker falls back to running them in turn and never waits on itself.
+Every read sees its own snapshot, which pages can live with: they are drawn
+again after the next write. Writes and reads inside a transaction never fan out.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import instrument
+from pool import get_pool
+
+ENABLED = os.environ.get("ASYNC_DB", "0").lower() in ("1", "true", "yes", "on")
+# threads running fanned out reads in each process, more than the pool has connections is no use
+ASYNC_DB_THREADS = int(os.environ.get("ASYNC_DB_THREADS", os.environ.get("DB_POOL_MAX", 5)))
+
+_executor = None
+_lock = threading.Lock()
+
+
+# turn the fan-out on for this process, asgi.py does this on start up
+def enable():
+    global ENABLED
+    ENABLED = True
+
+# the read threads of the current process. Like the pool, threads are not
+# inherited across fork() and every worker starts its own
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None or _executor.pid != os.getpid():
+            _executor = ThreadPoolExecutor(ASYNC_DB_THREADS, thread_name_prefix="db-read")
+            _executor.pid = os.getpid()
+        return _executor
+
+# run read(cursor) on a connection checked out for it and give the connection
+# back. Its queries are counted in tally, the request's g is not reachable here
+def _run(pool, conn, read, tally):
+    c = instrument.instrumented(conn, tally).cursor()
+    try:
+        return read(c)
+    finally:
+        c.close()
+        pool.putconn(conn)
+
+# run reads, each a function of a cursor, at the same time and return their
+# results in order. cursor belongs to the request's connection, the first
+# read and those no free connection was found for run on it
+def fanout(cursor, reads):
+    pool = get_pool()
+    executor = _get_executor()
+    results = [None] * len(reads)
+    futures = []
+    inline = [0]
+    for i in range(1, len(reads)):
+        conn = pool.getconn(wait=False)
+        if conn is None:
+            inline.append(i)
+        else:
+            tally = instrument.Tally()
+            futures.append((i, tally, executor.submit(_run, pool, conn, reads[i], tally)))
+    try:
+        for i in inline:
+            results[i] = reads[i](cursor)
+    finally:
+        # the connections go back to the pool even when a read failed, and the
+        # request's Server-Timing and slow log count the queries of every thread
+        for (i, tally, future) in futures:
+            try:
+                results[i] = future.result()
+            finally:
+                tally.merge()
+    return results
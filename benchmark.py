@@ -0,0 +1,332 @@
+"""
+Repeatable benchmarks for the DB layer and the Flask routes.
+
+Builds a database of synthetic users, then times the DB methods and the page
+and API routes (through Flask's test client) and reports p50/p95/p99 latency,
+queries per call and peak Python memory per call. Results are written as JSON
+so runs can be compared. Usage:
+
+    python benchmark.py [options]                      run and save results
+    python benchmark.py --compare old.json [options]   also diff against a previous run
+
+By default everything runs on a throwaway SQLite file. --database takes a
+DATABASE_URL instead; that database is WIPED and refilled. See --help for the
+data size options.
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the DB layer and the Flask routes.")
+    parser.add_argument("--database", help="DATABASE_URL to benchmark against, it is wiped (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=3, help="synthetic users (default 3)")
+    parser.add_argument("--months", type=int, default=12, help="months of history per user (default 12)")
+    parser.add_argument("--expenses", type=int, default=10, help="expenses per user per month (default 10)")
+    parser.add_argument("--spending", type=int, default=200, help="spending rows per user per month (default 200)")
+    parser.add_argument("--income", type=int, default=4, help="income rows per user per month (default 4)")
+    parser.add_argument("--import-rows", type=int, default=1000, help="rows in each csv import (default 1000)")
+    parser.add_argument("--iterations", type=int, default=30, help="timed calls per benchmark (default 30)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the generated data (default 1)")
+    parser.add_argument("--page-cache", action="store_true", help="leave the rendered page cache on")
+    parser.add_argument("--output", help="where to write the results (default benchmark-<time>.json)")
+    parser.add_argument("--compare", help="a previous results file to compare against")
+    return parser.parse_args(argv)
+
+
+########################################
+## Measuring                          ##
+########################################
+
+"""
+Hands out connections that record every statement, so each benchmark can
+report how many queries one call made.
+"""
+class QueryCounter:
+    def __init__(self, connect):
+        self._connect = connect
+        self.connections = []
+
+    def connect(self):
+        from migrate import RecordingConnection
+        conn = RecordingConnection(self._connect())
+        self.connections.append(conn)
+        return conn
+
+    def count(self):
+        return sum(len(conn.statements) for conn in self.connections)
+
+# nearest rank percentile of an already sorted list
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def measure(name, run, iterations, counter, setup=None):
+    '''
+        call run() iterations times and summarize latency and queries per call,
+        then once more under tracemalloc for the peak memory of a call.
+        setup(), when given, runs untimed before every call
+    '''
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        if setup:
+            setup()
+        before = counter.count()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+        queries += counter.count() - before
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    result = {
+        "calls": iterations,
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "queries": round(queries / iterations, 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+    print("{:<36} p50 {:>9.3f}ms  p95 {:>9.3f}ms  p99 {:>9.3f}ms  {:>6} queries  {:>9.1f}KB".format(
+        name, result["p50_ms"], result["p95_ms"], result["p99_ms"], result["queries"], result["peak_kb"]), file=sys.stderr)
+    return result
+
+
+########################################
+## Synthetic data                     ##
+########################################
+
+def month_starts(count):
+    today = date.today()
+    (year, month) = (today.year, today.month)
+    months = []
+    for _ in range(count):
+        months.append(date(year, month, 1))
+        (year, month) = (year, month - 1) if month > 1 else (year - 1, 12)
+    return sorted(months)
+
+def generate(db, args, rng, password_hash):
+    '''
+        fill the database with args.users users and their history.
+        returns [(user_id, username, [expense names of the latest month])]
+    '''
+    from backends import execute_values
+    from recurrence import FOREVER
+    users = []
+    months = month_starts(args.months)
+    with db.transaction() as c:
+        for u in range(args.users):
+            username = "bench{}".format(u)
+            c.execute("insert into users (username,password) values (%s,%s) returning user_id", (username, password_hash))
+            user_id = c.fetchone()[0]
+            expenses, spending, income = [], [], []
+            for month in months:
+                # expense names are unique across the whole table
+                names = ["Expense {}-{}-{}".format(u, month.strftime("%Y%m"), i) for i in range(args.expenses)]
+                expenses += [(name, rng.randint(1000, 200000), due, "onetime", 1, due, username, user_id)
+                    for (name, due) in ((name, month.replace(day=rng.randint(1, 28))) for name in names)]
+                for i in range(args.spending):
+                    linked = rng.choice(names) if names and rng.random() < 0.3 else None
+                    spending.append(("Spending {}".format(i), rng.randint(100, 50000), month.replace(day=rng.randint(1, 28)),
+                        rng.choice(["food", "fun", "bills", "travel"]), username, linked, user_id))
+                income += [("Income {}".format(i), rng.randint(100000, 500000), month.replace(day=rng.randint(1, 28)), "paycheck", username, user_id)
+                    for i in range(args.income)]
+            # a few bills repeating from the first month on, every month view expands them
+            expenses += [("Recurring {}-{}".format(u, repeat_type), rng.randint(1000, 200000), months[0].replace(day=rng.randint(1, 28)),
+                repeat_type, interval, FOREVER, username, user_id) for (repeat_type, interval) in (("monthly", 1), ("weekly", 2), ("yearly", 1))]
+            execute_values(c, "insert into expenses (name,expected,due_date,repeat_type,repeat_interval,last_due,owner,user_id) values %s", expenses, page_size=1000)
+            execute_values(c, "insert into spending (name,amount,date,category,owner,expense_name,user_id) values %s", spending, page_size=1000)
+            execute_values(c, "insert into income (name,amount,date,type,owner,user_id) values %s", income, page_size=1000)
+            execute_values(c, "insert into goals (name,target,amount,target_date,owner,user_id) values %s",
+                [("Goal {}".format(i), rng.randint(100000, 5000000), 0, rng.choice(months), username, user_id) for i in range(5)])
+            execute_values(c, "insert into debt (name,amount,target_date,owner,user_id) values %s",
+                [("Debt {}".format(i), rng.randint(100000, 5000000), rng.choice(months), username, user_id) for i in range(5)])
+            users.append((user_id, username, names))
+    db.rebuild_rollups()
+    return users
+
+def import_file(rows, month, rng, expense_names):
+    from werkzeug.datastructures import FileStorage
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    out.writerow(["name", "amount", "date", "category", "owner", "expense_name"])
+    for i in range(rows):
+        linked = rng.choice(expense_names) if expense_names and rng.random() < 0.3 else ""
+        out.writerow(["Imported {}".format(i), "{:.2f}".format(rng.randint(100, 50000) / 100),
+            month.replace(day=rng.randint(1, 28)).isoformat(), "food", "", linked])
+    return FileStorage(stream=io.BytesIO(buf.getvalue().encode("utf-8")), filename="import.csv")
+
+
+########################################
+## Benchmarks                         ##
+########################################
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = None
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix="mft-bench-")
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    if not args.page_cache:
+        os.environ["PAGE_CACHE_SIZE"] = "0"
+    # the web workers' hashing pool is sized for logins, not for this loop
+    os.environ.setdefault("HASH_QUEUE_DEPTH", "64")
+
+    import pool
+    from backends import backend_from_url
+    from migrate import stamp
+    from hashing import hash_password
+    from db import DB
+    from app import app
+
+    backend = backend_from_url(os.environ["DATABASE_URL"])
+    counter = QueryCounter(backend.connect)
+    # one counted connection serves both the DB benchmarks and the routes
+    pool._pool = pool.ConnectionPool(counter.connect, minconn=0, maxconn=1, backend=backend)
+    conn = pool.get_pool().getconn()
+    db = DB(conn)
+
+    print("generating data", file=sys.stderr)
+    started = time.perf_counter()
+    with open(backend.schema_file) as f:
+        conn.cursor().execute(f.read())
+    conn.commit()
+    stamp(conn)
+    password = "benchmark"
+    users = generate(db, args, rng, hash_password(password))
+    generate_seconds = time.perf_counter() - started
+    pool.get_pool().putconn(conn)
+
+    (user_id, username, expense_names) = users[0]
+    month = month_starts(1)[0]
+    old_month = month_starts(args.months)[0]
+    results = {}
+
+    # DB methods, each on a checked out connection like a request would
+    conn = pool.get_pool().getconn()
+    db = DB(conn)
+    results["db.myexpenses"] = measure("db.myexpenses", lambda: db.myexpenses(user_id, month), args.iterations, counter)
+    results["db.myexpenses (no spending)"] = measure("db.myexpenses (no spending)",
+        lambda: db.myexpenses(user_id, month, with_spending=False), args.iterations, counter)
+    results["db.myspending"] = measure("db.myspending", lambda: db.myspending(user_id, month), args.iterations, counter)
+    results["db.myspending (oldest month)"] = measure("db.myspending (oldest month)",
+        lambda: db.myspending(user_id, old_month), args.iterations, counter)
+    results["db.myincome"] = measure("db.myincome", lambda: db.myincome(user_id, month), args.iterations, counter)
+    # every generated month at once
+    results["db.search"] = measure("db.search", lambda: db.search(user_id, "spending 1 food"), args.iterations, counter)
+    results["db.dashboard"] = measure("db.dashboard",
+        lambda: db.dashboard(user_id, old_month, (month + timedelta(days=32)).replace(day=1)), args.iterations, counter)
+
+    upload = {}
+    def new_upload():
+        upload["file"] = import_file(args.import_rows, month, rng, expense_names)
+    results["db.import_csvdata"] = measure("db.import_csvdata",
+        lambda: db.import_csvdata(user_id, upload["file"], "spending"), max(1, args.iterations // 5), counter, setup=new_upload)
+
+    doomed = []
+    def pick_row():
+        c = conn.cursor()
+        c.execute("select spending_id from spending where user_id = %s order by spending_id desc limit 1", (user_id,))
+        doomed[:] = [c.fetchone()[0]]
+        c.close()
+    results["db.delete_record"] = measure("db.delete_record",
+        lambda: db.delete_record(user_id, "spending", doomed[0]), args.iterations, counter, setup=pick_row)
+    pool.get_pool().putconn(conn)
+
+    # routes through the test client, logged in as the same user
+    client = app.test_client()
+    day = month.isoformat()
+    routes = [
+        ("GET /myexpenses", "/myexpenses/{}".format(day)),
+        ("GET /myspending", "/myspending/{}".format(day)),
+        ("GET /myincome", "/myincome/{}".format(day)),
+        ("GET /mygoals", "/mygoals/"),
+        ("GET /mydebt", "/mydebt/"),
+        ("GET /search", "/search?q=spend+fun"),
+        ("GET /dashboard", "/dashboard?from={}&to={}".format(old_month.strftime("%Y-%m"), month.strftime("%Y-%m"))),
+        ("GET /api/spending", "/api/spending?month={}".format(month.strftime("%Y-%m"))),
+        ("GET /api/expenses", "/api/expenses?month={}".format(month.strftime("%Y-%m"))),
+        ("GET /export/spending", "/export/spending"),
+    ]
+    results["POST /login"] = measure("POST /login",
+        lambda: client.post("/login", data={"username": username, "password": password}),
+        max(1, args.iterations // 5), counter)
+    for (name, url) in routes:
+        def get(url=url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError("{} answered {}".format(url, response.status_code))
+            response.get_data()
+        results[name] = measure(name, get, args.iterations, counter)
+    results["POST /api/spending"] = measure("POST /api/spending",
+        lambda: client.post("/api/spending?month={}".format(month.strftime("%Y-%m")),
+            json={"name": "bench", "amount": "12.34", "date": day}),
+        args.iterations, counter)
+
+    pool.get_pool().closeall()
+    if workdir:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for (key, value) in vars(args).items() if key not in ("output", "compare")},
+        "environment": {
+            "backend": backend.name,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "generate_seconds": round(generate_seconds, 3),
+        "results": results,
+    }
+
+# print how each benchmark moved against a previous run, slower p50/p95 first
+def compare(report, previous):
+    print("\nchange against {}:".format(previous.get("started_at")), file=sys.stderr)
+    if previous.get("config") != report["config"]:
+        print("  (the runs used different options, the numbers are not directly comparable)", file=sys.stderr)
+    for name, result in report["results"].items():
+        old = previous.get("results", {}).get(name)
+        if not old:
+            print("  {:<36} new".format(name), file=sys.stderr)
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "queries", "peak_kb"):
+            if old.get(key):
+                changes.append("{} {:+.0%}".format(key, result[key] / old[key] - 1))
+        print("  {:<36} {}".format(name, "  ".join(changes)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    report = run(args)
+    output = args.output or "benchmark-{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S"))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to {}".format(output), file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,113 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+"""
+Interface every page cache backend implements. Keys are (user_id, view, month)
+tuples, so a backend shared between processes only needs to support lookups
+by key and dropping every key of one user, or of one user and month.
+"""
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    # drop every entry of user_id, or only those for month when it is given
+    def invalidate(self, user_id, month=None):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+"""
+In-process backend: a dict in least recently used order, bounded to maxsize
+entries, with a per user index so invalidation never scans the whole cache.
+"""
+class LocalLRUBackend(CacheBackend):
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._by_user.setdefault(key[0], set()).add(key)
+            while len(self._data) > self.maxsize:
+                (old, _) = self._data.popitem(last=False)
+                self._forget(old)
+                self.evictions += 1
+
+    def invalidate(self, user_id, month=None):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                if month is None or key[2] == month:
+                    del self._data[key]
+                    self._forget(key)
+
+    def _forget(self, key):
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def __len__(self):
+        return len(self._data)
+
+
+"""
+Cache of rendered month views keyed by (user, view, month), with hit and miss
+counters. Writes invalidate the user's entries for the month they touch.
+"""
+class PageCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # the counters are shared by every request thread, backends only
+        # lock their own entries
+        self._lock = threading.Lock()
+
+    def get(self, user_id, view, month):
+        value = self.backend.get((user_id, view, month))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, user_id, view, month, value):
+        self.backend.set((user_id, view, month), value)
+
+    def invalidate(self, user_id, month=None):
+        self.backend.invalidate(user_id, month)
+
+    def stats(self):
+        with self._lock:
+            stats = {"hits": self.hits, "misses": self.misses}
+        stats["entries"] = len(self.backend)
+        if hasattr(self.backend, "evictions"):
+            stats["evictions"] = self.backend.evictions
+        return stats
+
+
+# PAGE_CACHE_SIZE=0 turns caching off
+page_cache = PageCache(LocalLRUBackend(int(os.environ.get("PAGE_CACHE_SIZE", 256))))
@@ -1,10 +1,21 @@
 import sqlite3
 import csv
-import hashlib
 import os
+import re
 from flask.cli import with_appcontext
 from datetime import date, timedelta, datetime
 import calendar
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from hashing import (hash_password, verify_password, HashingBusy)
+from backends import (execute_values, backend_for)
+from recurrence import (parse_repeat, last_due, occurrences, repeat_label)
+import asyncdb
+
+log = logging.getLogger(__name__)
 
 # helper function that converts query result to json, after cursor has executed query
 def to_json(cursor):
@@ -12,6 +23,187 @@ def to_json(cursor):
     headers = [d[0] for d in cursor.description]
     return [dict(zip(headers, row)) for row in results]
 
+# parse a dollar amount from a form or csv field into integer cents,
+# "$1,234.56" is accepted. Amounts are stored and returned as cents
+def parse_amount(value, required=True):
+    value = str(value).strip().replace("$", "").replace(",", "")
+    if not value:
+        if required:
+            raise ValueError("amount is required")
+        return 0
+    try:
+        return int(Decimal(value).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+    except InvalidOperation:
+        raise ValueError("invalid amount {!r}".format(value))
+
+# cents back to a dollar Decimal, 1250 -> Decimal("12.50")
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+# parse a YYYY-MM-DD date from a form or csv field
+def parse_date(value, required=True):
+    value = value.strip()
+    if not value:
+        if required:
+            raise ValueError("date is required")
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+def parse_name(value):
+    value = value.strip().capitalize()
+    if not value:
+        raise ValueError("name is required")
+    return value
+
+# an expenses csv row as insert values, repeat_interval and last_due are optional columns
+def expense_values(row, user_id):
+    due_date = parse_date(row['due_date'])
+    (unit, interval) = parse_repeat(row['repeat_type'], row.get('repeat_interval'))
+    until = parse_date(row.get('last_due') or '', required=False)
+    return (parse_name(row['name']),parse_amount(row['expected']),due_date,unit,interval,last_due(due_date, unit, until),row['owner'].strip().capitalize(), user_id)
+
+
+########################################
+## CSV import                         ##
+########################################
+
+IMPORT_BATCH_SIZE = 1000
+# an import reports at most this many rejected lines, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# each table maps to the insert statement used with execute_values and a
+# function that turns one csv row (a dict keyed by the header) into its values
+CSV_TABLES = {
+    "spending": (
+        "insert into spending (name,amount,date,category,owner,expense_name,user_id) values %s returning spending_id",
+        lambda row, user_id: (parse_name(row['name']),parse_amount(row['amount']),parse_date(row['date']),row['category'].strip().lower(),row['owner'].strip().capitalize(),row['expense_name'].strip().capitalize() or None, user_id),
+    ),
+    "expenses": (
+        "insert into expenses (name,expected,due_date,repeat_type,repeat_interval,last_due,owner,user_id) values %s returning expense_id",
+        expense_values,
+    ),
+    "goals": (
+        "insert into goals (name,target,amount,target_date,owner,user_id) values %s returning goal_id",
+        lambda row, user_id: (parse_name(row['name']),parse_amount(row['target']),parse_amount(row['amount'], required=False),parse_date(row['target_date'], required=False),row['owner'].strip().capitalize(), user_id),
+    ),
+    "debt": (
+        "insert into debt (name,amount,target_date,owner,user_id) values %s returning debt_id",
+        lambda row, user_id: (parse_name(row['name']),parse_amount(row['amount']),parse_date(row['target_date'], required=False),row['owner'].strip().capitalize(), user_id),
+    ),
+    "income": (
+        "insert into income (name,amount,date,type,owner,user_id) values %s returning income_id",
+        lambda row, user_id: (parse_name(row['name']),parse_amount(row['amount']),parse_date(row['date']),row['type'].strip(),row['owner'].strip().capitalize(), user_id),
+    ),
+}
+
+
+########################################
+## CSV export                         ##
+########################################
+
+# rows are pulled from the server side cursor this many at a time
+EXPORT_FETCH_SIZE = 2000
+
+# columns written for each table, in the same layout import_csvdata reads,
+# and the date column the from/to filters apply to
+EXPORT_COLUMNS = {
+    "spending": (["name", "amount", "date", "expense_name", "category", "owner"], "date"),
+    "expenses": (["name", "expected", "due_date", "repeat_type", "repeat_interval", "last_due", "owner"], "due_date"),
+    "goals": (["name", "target", "amount", "target_date", "owner"], "target_date"),
+    "debt": (["name", "amount", "target_date", "owner"], "target_date"),
+    "income": (["name", "amount", "date", "type", "owner"], "date"),
+}
+# columns holding integer cents
+MONEY_COLUMNS = {"amount", "expected", "target"}
+
+# rows per page of the spending and income lists
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 100))
+# the longest range the dashboard covers, in months
+DASHBOARD_MAX_MONTHS = int(os.environ.get("DASHBOARD_MAX_MONTHS", 120))
+
+# the columns each page lists for a row, in the order the templates show them
+ROW_COLUMNS = {
+    "spending": "spending_id,to_char(date, 'MM/DD/YY'),name,amount,expense_name,category,owner",
+    "expenses": "expense_id,to_char(due_date, 'MM/DD/YYYY'),name,expected,repeat_type,owner",
+    "goals": "goal_id,to_char(target_date, 'MM/DD/YY'),name,target,amount,owner",
+    "debt": "debt_id,to_char(target_date, 'MM/DD/YY'),name,amount,owner",
+    "income": "income_id,to_char(date, 'MM/DD/YY'),name,amount,type,owner",
+}
+ID_COLUMNS = {"spending": "spending_id", "expenses": "expense_id", "goals": "goal_id", "debt": "debt_id", "income": "income_id"}
+
+# the columns a search matches in each table, income's type is its category.
+# The search indexes are built on these, see migrations/0007_record_search.sql
+SEARCH_COLUMNS = {
+    "spending": ["name", "category", "expense_name", "owner", "notes"],
+    "income": ["name", "type", "owner", "notes"],
+    "expenses": ["name", "owner", "notes"],
+    "goals": ["name", "owner", "notes"],
+    "debt": ["name", "owner", "notes"],
+}
+# words of a search beyond this many are ignored
+MAX_SEARCH_WORDS = 8
+
+# the fields a bulk edit can set and a bulk filter can match in each table,
+# with how a value is cleaned up, the same way the add forms do it
+BULK_FIELDS = {
+    "spending": {
+        "category": lambda value: value.strip().lower(),
+        "expense_name": lambda value: value.strip().capitalize() or None,
+        "owner": lambda value: value.strip(),
+    },
+    "income": {"type": lambda value: value.strip().lower(), "owner": lambda value: value.strip()},
+    "expenses": {"owner": lambda value: value.strip()},
+    "goals": {"owner": lambda value: value.strip()},
+    "debt": {"owner": lambda value: value.strip()},
+}
+
+# a value given for one of the BULK_FIELDS, cleaned up. Only text is taken
+def bulk_value(tablename, field, value):
+    if not isinstance(value, str):
+        raise BadRequest("{} must be a string".format(field))
+    return BULK_FIELDS[tablename][field](value)
+
+# rows one bulk delete or edit may touch
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", 10000))
+
+# the tables a batch entry can add to, with the fields a record may leave out
+# and what they default to. "owner" defaults to the user's name and the date
+# to today, the other fields are named like the csv columns of the table
+BATCH_DEFAULTS = {
+    "spending": {"category": "", "expense_name": ""},
+    "income": {"type": ""},
+    "expenses": {"repeat_type": "onetime", "repeat_interval": "", "last_due": ""},
+}
+# records one batch entry may hold
+BATCH_MAX_RECORDS = int(os.environ.get("BATCH_MAX_RECORDS", 500))
+
+
+########################################
+## Monthly totals                     ##
+########################################
+
+# how each table feeds the monthly_totals rollup:
+# (id column, amount column, date column, name the total is kept under)
+ROLLUPS = {
+    "spending": ("spending_id", "amount", "date", "coalesce(expense_name, '')"),
+    "expenses": ("expense_id", "expected", "due_date", "''"),
+    "income": ("income_id", "amount", "date", "''"),
+    "goals": ("goal_id", "target", "target_date", "''"),
+    "debt": ("debt_id", "amount", "target_date", "''"),
+}
+
+# grouped totals of tablename rows matching where, in monthly_totals' column order.
+# goals and debt without a target date are kept under 1900-01-01
+def rollup_select(tablename, where):
+    (_, amount, datecol, name) = ROLLUPS[tablename]
+    return '''
+        select user_id, '{table}' as table_name,
+            date_trunc('month', coalesce({date}, date '1900-01-01'))::date as month, {name} as name,
+            sum({amount}) as total, count(*) as row_count
+        from {table} where {where}
+        group by 1, 2, 3, 4
+    '''.format(table=tablename, amount=amount, date=datecol, name=name, where=where)
+
 
 # Error class for when a key is not found
 class KeyNotFound(Exception):
@@ -57,12 +249,31 @@ class BadRequest(Exception):
         rv["message"] = self.message
         return rv
 
-# hash the password and return the salt and key
-def hash_password(password, salt = None):
-    if not salt:
-        salt = os.urandom(32) # A new salt for this user
-    key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    return (salt, key)
+"""
+Bounded LRU map of username -> user_id shared by every request in this process.
+A user_id never changes once assigned, so entries only leave when the cache is full.
+"""
+class UserIdCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            user_id = self._data.get(username)
+            if user_id is not None:
+                self._data.move_to_end(username)
+            return user_id
+
+    def put(self, username, user_id):
+        with self._lock:
+            self._data[username] = user_id
+            self._data.move_to_end(username)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+user_ids = UserIdCache(int(os.environ.get("USER_ID_CACHE_SIZE", 1024)))
 
 """
 Wraps a single connection to the database with higher-level functionality.
@@ -71,6 +282,7 @@ Holds the DB connection
 class DB:
     def __init__(self, connection):
         self.conn = connection
+        self._tx_depth = 0
 
     # Simple example of how to execute a query against the DB.
     # Again never do this, you should only execute parameterized query
@@ -80,92 +292,291 @@ class DB:
     # And this is the named style:
     # cur.execute("select * from people where name_last=:who and age=:age", {"who": who, "age": age})
     def run_query(self, query):
-        c = self.conn.cursor()
-        c.execute(query)
-        res = to_json(c)
-        self.conn.commit()
+        with self.transaction() as c:
+            c.execute(query)
+            res = to_json(c)
         return res
 
     # Run script that drops and creates all tables
     def create_db(self, create_file):
-        print("Running SQL script file %s" % create_file)
+        log.info("running SQL script file %s", create_file)
         with open(create_file, "r") as f:
             self.conn.executescript(f.read())
         return '{"message":"created"}'
 
-    def import_csvdata(self, username, file, tablename):
+    # run a block of writes as one transaction and commit once at the end.
+    # Nested calls share the outer transaction
+    @contextmanager
+    def transaction(self):
         c = self.conn.cursor()
-        c.execute("select user_id from users where username = %s", (username,))
-        user_id = c.fetchone()[0]
+        if self._tx_depth:
+            self._tx_depth += 1
+            try:
+                yield c
+            finally:
+                self._tx_depth -= 1
+                c.close()
+            return
+        autocommit = self.conn.autocommit
+        self.conn.autocommit = False
+        self._tx_depth = 1
+        try:
+            yield c
+            self.conn.commit()
+        except BaseException:
+            # also covers generators closed part way through a transaction
+            self.conn.rollback()
+            raise
+        finally:
+            self._tx_depth = 0
+            c.close()
+            self.conn.autocommit = autocommit
 
+    # run independent reads, each a function of a cursor, and return their results
+    # in order. They take turns on this connection, or run at the same time on
+    # pooled connections when the fan-out is on, see asyncdb.py
+    def gather(self, *reads):
+        c = self.conn.cursor()
         try:
-            # csv.DictReader uses first line in file for column headings by default
-            rows = csv.DictReader(file.read().decode().splitlines()) # comma is default delimiter
-            to_db = None
-            print("table", tablename)
-            if tablename == "spending":
-                to_db = [(row['name'].strip().capitalize(),row['amount'].strip(),row['date'].strip(),row['category'].strip().lower(),row['owner'].strip().capitalize(),row['expense_name'].strip().capitalize(), user_id) for row in rows]
-            elif tablename == "expenses":
-                to_db = [(row['name'].strip().capitalize(),row['expected'].strip(),row['due_date'].strip(),row['repeat_type'].strip().lower(),row['owner'].strip().capitalize(), user_id) for row in rows]
-            elif tablename == "goals":
-                to_db = [(row['name'].strip().capitalize(),row['target'].strip(),row['amount'].strip(),row['target_date'].strip(),row['owner'].strip().capitalize(), user_id) for row in rows]
-            elif tablename == "debt":
-                to_db = [(row['name'].strip().capitalize(),row['amount'].strip(),row['target_date'].strip(),row['owner'].strip().capitalize(), user_id) for row in rows]
-            elif tablename == "income":
-                to_db = [(row['name'].strip().capitalize(),row['amount'].strip(),row['date'].strip(),row['type'].strip(),row['owner'].strip().capitalize(), user_id) for row in rows]
-            else:
-                raise Exception("need a valid tablename")
-        except Exception as e:
-            print("csv import failed: {}".format(e))
-            return BadRequest(e)
+            if asyncdb.ENABLED and len(reads) > 1 and not self._tx_depth:
+                return asyncdb.fanout(c, reads)
+            return [read(c) for read in reads]
+        finally:
+            c.close()
 
-        print(to_db)
-        whichtable = {
-            "spending":"insert into spending (name,amount,date,category,owner,expense_name,user_id) values (%s,%s,%s,%s,%s,%s,%s)",
-            "expenses":"insert into expenses (name,expected,due_date,repeat_type,owner,user_id) values (%s,%s,%s,%s,%s,%s)",
-            "goals":"insert into goals (name,target,amount,target_date,owner,user_id) values (%s,%s,%s,%s,%s,%s)",
-            "debt":"insert into debt (name,amount,target_date,owner,user_id) values (%s,%s,%s,%s,%s)",
-            "income":"insert into income (name,amount,date,type,owner,user_id) values (%s,%s,%s,%s,%s,%s)"
-        }
+    # add (sign=1) or remove (sign=-1) the given rows of tablename to/from
+    # monthly_totals. Must run in the same transaction as the write itself
+    def _rollup(self, c, tablename, ids, sign=1):
+        if not ids:
+            return
+        (idcol, _, _, _) = ROLLUPS[tablename]
+        c.execute(
+            '''
+            insert into monthly_totals (user_id, table_name, month, name, total, row_count)
+            select user_id, table_name, month, name, %s * total, %s * row_count from ({rows}) r
+            where true
+            on conflict (user_id, table_name, month, name) do update
+            set total = monthly_totals.total + excluded.total, row_count = monthly_totals.row_count + excluded.row_count
+            '''.format(rows=rollup_select(tablename, "{} = any(%s)".format(idcol))),
+            (sign, sign, list(ids))
+        )
+
+    # bump the user's data version, every write transaction does this so
+    # pages can tell whether anything changed since they were last rendered
+    def _touch(self, c, user_id):
+        c.execute("update users set data_version = data_version + 1 where user_id = %s", (user_id,))
+
+    def data_version(self, user_id):
+        c = self.conn.cursor()
+        c.execute("select data_version from users where user_id = %s", (user_id,))
+        record = c.fetchone()
+        c.close()
+        return record[0] if record else None
+
+    # a table's total for one month (or all months) from monthly_totals, 0 when it has none.
+    # linked=True only counts spending that is linked to an expense
+    def _total(self, c, user_id, tablename, month=None, linked=False):
+        query = "select coalesce(sum(total), 0)::bigint from monthly_totals where user_id = %s and table_name = %s"
+        params = [user_id, tablename]
+        if month:
+            query += " and month = %s"
+            params.append(month)
+        if linked:
+            query += " and name != ''"
+        c.execute(query, params)
+        return c.fetchone()[0]
+
+    def _fetchall(self, c, query, params):
+        c.execute(query, params)
+        return c.fetchall()
+
+    # recompute monthly_totals from the raw rows, for one user or everyone
+    def rebuild_rollups(self, user_id=None):
+        (where, params) = ("true", []) if user_id is None else ("user_id = %s", [user_id])
+        with self.transaction() as c:
+            # writers wait until the rebuilt totals are committed
+            c.execute("lock table monthly_totals in exclusive mode")
+            c.execute("delete from monthly_totals where " + where, params)
+            for tablename in ROLLUPS:
+                c.execute(
+                    "insert into monthly_totals (user_id, table_name, month, name, total, row_count) " + rollup_select(tablename, where),
+                    params
+                )
+
+    def check_rollups(self, user_id=None):
+        '''
+            compare monthly_totals with sums over the raw rows.
+            returns a list of (user_id, table_name, month, name, rollup total,
+            actual total, rollup count, actual count), one per mismatch
+        '''
+        (where, params) = ("true", []) if user_id is None else ("user_id = %s", [user_id])
+        actual = " union all ".join(rollup_select(tablename, where) for tablename in ROLLUPS)
+        c = self.conn.cursor()
+        c.execute(
+            '''
+            with actual(user_id, table_name, month, name, total, row_count) as ({actual}),
+            rollup as (select * from monthly_totals where {where} and row_count != 0)
+            select coalesce(r.user_id, a.user_id), coalesce(r.table_name, a.table_name),
+                coalesce(r.month, a.month), coalesce(r.name, a.name), r.total, a.total, r.row_count, a.row_count
+            from rollup r full outer join actual a
+                on r.user_id = a.user_id and r.table_name = a.table_name and r.month = a.month and r.name = a.name
+            where r.total is distinct from a.total or r.row_count is distinct from a.row_count
+            order by 1, 2, 3, 4
+            '''.format(actual=actual, where=where),
+            params * (len(ROLLUPS) + 1)
+        )
+        mismatches = c.fetchall()
+        c.close()
+        return mismatches
+
+    def import_csvdata(self, user_id, file, tablename):
+        '''
+            stream a csv upload into tablename. The file is read line by line and
+            inserted in batches of IMPORT_BATCH_SIZE rows inside one transaction.
+            Rows that fail to parse or to insert are skipped and reported.
+            returns {"accepted": n, "rejected": n, "errors": [{"line": n, "error": msg}]}
+        '''
+        if tablename not in CSV_TABLES:
+            raise BadRequest("need a valid tablename")
+        insert, convert = CSV_TABLES[tablename]
+        summary = {"accepted": 0, "rejected": 0, "errors": []}
+
+        def reject(line, error):
+            summary["rejected"] += 1
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append({"line": line, "error": str(error)})
+
+        # csv.DictReader uses first line in file for column headings by default
+        lines = (line.decode("utf-8-sig") for line in file.stream)
+        rows = csv.DictReader(lines) # comma is default delimiter
         try:
-            c.executemany(whichtable[tablename], to_db)
-        except Exception as e:
-            print("csv import failed: {}".format(e))
+            with self.transaction() as c:
+                self._touch(c, user_id)
+                batch = []
+                for row in rows:
+                    try:
+                        batch.append((rows.line_num, convert(row, user_id)))
+                    except KeyError as e:
+                        reject(rows.line_num, "missing column {}".format(e))
+                    except Exception as e:
+                        reject(rows.line_num, e)
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        ids = self._insert_batch(c, insert, batch, reject)
+                        self._rollup(c, tablename, ids)
+                        summary["accepted"] += len(ids)
+                        batch = []
+                if batch:
+                    ids = self._insert_batch(c, insert, batch, reject)
+                    self._rollup(c, tablename, ids)
+                    summary["accepted"] += len(ids)
+        except (csv.Error, UnicodeDecodeError) as e:
+            log.warning("csv import failed: %s", e)
             raise BadRequest("make sure the data is formated correctly")
-        c.close()
-        self.conn.commit()
-        return '{"message":"data imported successfully"}'
+        return summary
+
+    # insert one batch with a single multi-row statement and return the new ids.
+    # If the database rejects it, the batch is retried row by row to find the bad lines
+    def _insert_batch(self, c, insert, batch, reject):
+        c.execute("savepoint import_batch")
+        try:
+            ids = execute_values(c, insert, [values for _, values in batch], page_size=len(batch), fetch=True)
+            c.execute("release savepoint import_batch")
+            return [row[0] for row in ids]
+        except Exception:
+            c.execute("rollback to savepoint import_batch")
+        ids = []
+        for line, values in batch:
+            try:
+                ids += [row[0] for row in execute_values(c, insert, [values], fetch=True)]
+                c.execute("release savepoint import_batch")
+                c.execute("savepoint import_batch")
+            except Exception as e:
+                c.execute("rollback to savepoint import_batch")
+                reject(line, e)
+        c.execute("release savepoint import_batch")
+        return ids
+
+
+    def export_rows(self, user_id, tablename, start=None, end=None):
+        '''
+            rows of tablename for a user, optionally limited to start <= date <= end.
+            returns (columns, rows) where rows is a generator reading from a
+            server side cursor, so the table is never held in memory at once
+        '''
+        if tablename not in EXPORT_COLUMNS:
+            raise BadRequest("need a valid tablename")
+        columns, datecol = EXPORT_COLUMNS[tablename]
+        query = "select {} from {} where user_id = %s".format(",".join(columns), tablename)
+        params = [user_id]
+        if start:
+            query += " and {} >= %s".format(datecol)
+            params.append(start)
+        if end:
+            query += " and {} <= %s".format(datecol)
+            params.append(end)
+        query += " order by {}, {}".format(datecol, ID_COLUMNS[tablename])
+        # amounts are written in dollars, the way import_csvdata reads them
+        money = [i for (i, col) in enumerate(columns) if col in MONEY_COLUMNS]
+        rows = (
+            tuple(from_cents(v) if i in money and v is not None else v for (i, v) in enumerate(row))
+            for row in self._stream(query, params)
+        )
+        return (columns, rows)
+
+    def _stream(self, query, params):
+        with self.transaction():
+            c = self.conn.cursor(name="export")
+            c.itersize = EXPORT_FETCH_SIZE
+            try:
+                c.execute(query, params)
+                for row in c:
+                    yield row
+            finally:
+                c.close()
 
 
     ########################################
     ## User management                    ##
     ########################################
 
+    # resolve a username to its user_id, only hitting the database on a cache miss
+    def get_user_id(self, username):
+        user_id = user_ids.get(username)
+        if user_id is None:
+            c = self.conn.cursor()
+            c.execute("select user_id from users where username = %s", (username,))
+            record = c.fetchone()
+            c.close()
+            if not record:
+                raise KeyNotFound("no user with username {}".format(username))
+            user_id = record[0]
+            user_ids.put(username, user_id)
+        return user_id
+
     def add_user(self, request):
         username = request.form['username']
         password = request.form['password']
-        # encrypt password
+        # encrypt password, the hashing parameters are stored with the hash
         # https://nitratine.net/blog/post/how-to-hash-passwords-in-python/#why-you-need-to-hash-passwords
-        (salt, key) = hash_password(password)
-        c = self.conn.cursor()
+        hashed_password = hash_password(password)
+        with self.transaction() as c:
+            # enforce unique usernames
+            c.execute(f"select * from users where username = %s", (username,))
+            record = c.fetchone()
+            if record:
+                log.info("username %s already exists", username)
+                raise UsernameAlreadyExists("username already exists")
+            try:
+                c.execute("insert into users (username,password) values (%s,%s) returning user_id", (username, hashed_password))
+                user_id = c.fetchone()[0]
+            except Exception as e:
+                log.error("failed to add new user: %s", e)
+                raise BadRequest(e)
 
-        # enforce unique usernames
-        c.execute(f"select * from users where username = %s", (username,))
-        record = c.fetchone()
-        if record:
-            print("The username {} already exists".format(username))
-            raise UsernameAlreadyExists("username already exists")
-        try:
-            print((salt+key), (salt+key).hex())
-            c.execute("insert into users (username,password) values (%s,%s)", (username, (salt+key).hex()))
-        except UsernameAlreadyExists as e:
-            print("Failed to add new user: {}".format(e))
-            raise BadRequest(e)
-        
-        c.close()
-        self.conn.commit()
-        return '{"message":"new user inserted"}'
+        user_ids.put(username, user_id)
+        return user_id
 
+    # returns the user_id when the password matches, False otherwise
     def validate_user(self, request):
         username = request.form['username']
         password = request.form['password']
@@ -177,35 +588,34 @@ class DB:
             c.execute("select * from users where username = %s", (username,))
             record = c.fetchone()
             if not record:
-                print("No user with username {} exists".format(username))
+                log.info("login for unknown username %s", username)
                 return False
         except Exception as e:
-            print("sql error: {}".format(e))
+            log.error("looking up user failed: %s", e)
             return False
 
-        c.close()
-        print(f"found user with that username: {record}")
-        print(record[2])
-        hashed_password = bytes.fromhex(record[2])
-        print(hashed_password)
-        salt = hashed_password[:32] 
-        key = hashed_password[32:]
-        if (hash_password(password, salt)[1] != key):
-            print("wrong password for user {}".format(username))
+        (matches, needs_rehash) = verify_password(password, record[2])
+        if not matches:
+            log.info("wrong password for user %s", username)
+            c.close()
             return False
-        
-        return True
+        # upgrade hashes made with old parameters now that we have the password
+        if needs_rehash:
+            try:
+                with self.transaction() as tx:
+                    tx.execute("update users set password = %s where user_id = %s", (hash_password(password), record[0]))
+            except HashingBusy:
+                pass # try again on the next login
+        c.close()
+
+        user_ids.put(username, record[0])
+        return record[0]
 
 
     ########################################
     ## All Tables                         ##
     ########################################
-    def delete_record(self, username, tablename, rid):
-        c = self.conn.cursor()
-        # get active user
-        c.execute("select user_id from users where username = %s", (username,))
-        user_id = c.fetchone()[0]
-        
+    def delete_record(self, user_id, tablename, rid):
         # users can only delete records they created
         whichtable = {
             "spending":"delete from spending where spending_id = %s and user_id = %s",
@@ -215,15 +625,263 @@ class DB:
             "income":"delete from income where income_id = %s and user_id = %s",
         }
         try:
-            c.execute(whichtable[tablename], (rid,user_id))
+            with self.transaction() as c:
+                # the row leaves the monthly totals before it is deleted
+                c.execute("select {0} from {1} where {0} = %s and user_id = %s for update".format(ROLLUPS[tablename][0], tablename), (rid, user_id))
+                self._rollup(c, tablename, [row[0] for row in c.fetchall()], -1)
+                self._touch(c, user_id)
+                c.execute(whichtable[tablename], (rid,user_id))
+                # 0 when the user has no such record
+                deleted = c.rowcount
+        except Exception as e:
+            log.error("failed to delete record: %s", e)
+            raise BadRequest(e)
+
+        return deleted
+
+    def _bulk_where(self, user_id, tablename, ids=None, filters=None):
+        '''
+            the where clause and params that pick the user's rows in tablename, either
+            by ids or by filters: {"from": date, "to": date} (inclusive, on the
+            table's date column) and any BULK_FIELDS of the table, matched exactly
+            (null matches a missing value). Checks every value before any sql runs
+        '''
+        if tablename not in BULK_FIELDS:
+            raise BadRequest("need a valid tablename")
+        where = ["user_id = %s"]
+        params = [user_id]
+        if ids is not None:
+            if not isinstance(ids, list) or not ids or not all(isinstance(rid, (int, str)) for rid in ids):
+                raise BadRequest("ids must be a list of record ids")
+            if len(ids) > BULK_MAX_ROWS:
+                raise BadRequest("at most {} records can be changed at once".format(BULK_MAX_ROWS))
+            try:
+                params.append([int(rid) for rid in ids])
+            except ValueError:
+                raise BadRequest("ids must be a list of record ids")
+            where.append("{} = any(%s)".format(ID_COLUMNS[tablename]))
+        elif filters:
+            if not isinstance(filters, dict):
+                raise BadRequest("filter must be an object of fields and values")
+            datecol = EXPORT_COLUMNS[tablename][1]
+            for (field, value) in filters.items():
+                if field in ("from", "to"):
+                    try:
+                        params.append(parse_date(value))
+                    except (AttributeError, ValueError):
+                        raise BadRequest("{} must be a date as YYYY-MM-DD".format(field))
+                    where.append("{} {} %s".format(datecol, ">=" if field == "from" else "<="))
+                elif field not in BULK_FIELDS[tablename]:
+                    raise BadRequest("can not filter {} by {}".format(tablename, field))
+                else:
+                    # cleaned up first, an empty expense_name is stored as null
+                    value = None if value is None else bulk_value(tablename, field, value)
+                    if value is None:
+                        where.append("{} is null".format(field))
+                    else:
+                        where.append("{} = %s".format(field))
+                        params.append(value)
+        else:
+            raise BadRequest("give the ids or a filter of the records to change")
+        return (where, params)
+
+    def _bulk_rows(self, c, tablename, where, params):
+        '''
+            lock and return the ids of the rows a _bulk_where picks
+        '''
+        idcol = ID_COLUMNS[tablename]
+        c.execute(
+            "select {} from {} where {} order by {} limit %s for update".format(idcol, tablename, " and ".join(where), idcol),
+            params + [BULK_MAX_ROWS + 1]
+        )
+        rids = [row[0] for row in c.fetchall()]
+        if len(rids) > BULK_MAX_ROWS:
+            raise BadRequest("more than {} records match, narrow the filter".format(BULK_MAX_ROWS))
+        return rids
+
+    def delete_records(self, user_id, tablename, ids=None, filters=None):
+        '''
+            delete many of the user's records in one transaction, picked by ids or
+            filters as in _bulk_where. returns the ids deleted
+        '''
+        (where, params) = self._bulk_where(user_id, tablename, ids, filters)
+        try:
+            with self.transaction() as c:
+                rids = self._bulk_rows(c, tablename, where, params)
+                if rids:
+                    self._rollup(c, tablename, rids, -1)
+                    self._touch(c, user_id)
+                    c.execute("delete from {} where {} = any(%s)".format(tablename, ID_COLUMNS[tablename]), (rids,))
+        except BadRequest:
+            raise
         except Exception as e:
-            print("Failed to delete record: {}".format(e))
+            log.error("failed to delete records: %s", e)
             raise BadRequest(e)
+        return rids
+
+    def update_records(self, user_id, tablename, changes, ids=None, filters=None):
+        '''
+            set the fields in changes ({field: value}, BULK_FIELDS only) on many of
+            the user's records in one statement, picked by ids or filters as in
+            _bulk_where. returns the ids updated
+        '''
+        if tablename not in BULK_FIELDS:
+            raise BadRequest("need a valid tablename")
+        fields = BULK_FIELDS[tablename]
+        if not isinstance(changes, dict) or not changes or any(field not in fields for field in changes):
+            raise BadRequest("{} can only set {}".format(tablename, ", ".join(sorted(fields))))
+        values = [bulk_value(tablename, field, value) for (field, value) in changes.items()]
+        (where, params) = self._bulk_where(user_id, tablename, ids, filters)
+        try:
+            with self.transaction() as c:
+                rids = self._bulk_rows(c, tablename, where, params)
+                if rids:
+                    # the rows leave the monthly totals and come back under their new values
+                    self._rollup(c, tablename, rids, -1)
+                    c.execute(
+                        "update {} set {} where {} = any(%s)".format(
+                            tablename, ", ".join("{} = %s".format(field) for field in changes), ID_COLUMNS[tablename]),
+                        values + [rids]
+                    )
+                    self._rollup(c, tablename, rids)
+                    self._touch(c, user_id)
+        except BadRequest:
+            raise
+        except Exception as e:
+            log.error("failed to update records: %s", e)
+            raise BadRequest(e)
+        return rids
+
+    def add_records(self, user_id, username, records):
+        '''
+            add many spending, income and expense records in one transaction with
+            one multi-row insert per table. Each record is a dict of "table" and
+            that table's csv columns, see BATCH_DEFAULTS for the optional ones.
+            Every record is validated first and nothing is added unless all of
+            them are valid. returns one result per record, in order:
+            {"index": n, "table": name, "id": new id} or {"index": n, "error": msg}
+        '''
+        if not isinstance(records, list) or not records:
+            raise BadRequest("records must be a list of records")
+        if len(records) > BATCH_MAX_RECORDS:
+            raise BadRequest("at most {} records can be added at once".format(BATCH_MAX_RECORDS))
+        today = date.today().strftime("%Y-%m-%d")
+        results = []
+        batches = {}
+        for (i, record) in enumerate(records):
+            try:
+                if not isinstance(record, dict) or record.get("table") not in BATCH_DEFAULTS:
+                    raise ValueError("table must be one of {}".format(", ".join(BATCH_DEFAULTS)))
+                tablename = record["table"]
+                row = dict(BATCH_DEFAULTS[tablename], owner=username)
+                row[EXPORT_COLUMNS[tablename][1]] = today
+                # empty fields get their defaults, json numbers are read like csv text
+                row.update((field, str(value)) for (field, value) in record.items() if value not in (None, ""))
+                batches.setdefault(tablename, []).append((i, CSV_TABLES[tablename][1](row, user_id)))
+                results.append({"index": i, "table": tablename})
+            except KeyError as e:
+                results.append({"index": i, "error": "missing field {}".format(e)})
+            except Exception as e:
+                results.append({"index": i, "error": str(e)})
+        try:
+            with self.transaction() as c:
+                self._unique_expenses(c, batches.get("expenses", []), results)
+                if any("error" in result for result in results):
+                    return results
+                for (tablename, batch) in batches.items():
+                    ids = execute_values(c, CSV_TABLES[tablename][0], [values for _, values in batch], page_size=len(batch), fetch=True)
+                    for ((i, _), row) in zip(batch, ids):
+                        results[i]["id"] = row[0]
+                    self._rollup(c, tablename, [row[0] for row in ids])
+                self._touch(c, user_id)
+        except Exception as e:
+            log.error("failed to add records: %s", e)
+            raise BadRequest(e)
+        return results
+
+    # marks the batch's expenses that clash with each other or with saved ones,
+    # the same rule as insert_expense: an expense name can only be used once in
+    # the whole table, by an existing expense or by an earlier record of the batch
+    def _unique_expenses(self, c, batch, results):
+        if not batch:
+            return
+        c.execute("select name from expenses where name = any(%s)", (list({values[0] for _, values in batch}),))
+        taken = {row[0] for row in c.fetchall()}
+        for (i, values) in batch:
+            if values[0] in taken:
+                results[i] = {"index": i, "error": "Expense name already exists"}
+            taken.add(values[0])
+
 
+    # keyset pagination over (date, id) descending, which the (user_id, date, id)
+    # indexes serve directly no matter how deep the page is
+    def _page(self, c, tablename, datecol, user_id, start, end, after=None, limit=None):
+        idcol = ID_COLUMNS[tablename]
+        limit = limit or PAGE_SIZE
+        query = "select {}, {} from {} where user_id = %s and {} >= %s and {} < %s".format(
+            ROW_COLUMNS[tablename], datecol, tablename, datecol, datecol)
+        params = [user_id, start, end]
+        if after:
+            query += " and ({}, {}) < (%s, %s)".format(datecol, idcol)
+            params += list(after)
+        query += " order by {} desc, {} desc limit %s".format(datecol, idcol)
+        # one row more than asked for tells us whether another page follows
+        params.append(limit + 1)
+        c.execute(query, params)
+        rows = c.fetchall()
+        next_page = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_page = (rows[-1][-1], rows[-1][0])
+        return ([row[:-1] for row in rows], next_page)
+
+    # the spending linked to one expense in the month of target_date
+    def linked_spending(self, user_id, expense_name, target_date):
+        target_month = date(target_date.year, target_date.month, 1)
+        next_month = date(target_month.year + target_month.month // 12, target_month.month % 12 + 1, 1)
+        c = self.conn.cursor()
+        c.execute(
+            '''
+            select {} from spending
+            where user_id = %s and expense_name = %s and date >= %s and date < %s
+            order by date desc, name;
+            '''.format(ROW_COLUMNS["spending"]), (user_id, expense_name, target_month, next_month)
+        )
+        result = c.fetchall()
         c.close()
-        self.conn.commit()
-        return '{"message":"record deleted"}'
-        
+        return result
+
+    # a single row of tablename, in the same shape the my* methods list rows
+    def get_record(self, user_id, tablename, rid):
+        if tablename not in ROW_COLUMNS:
+            raise BadRequest("need a valid tablename")
+        c = self.conn.cursor()
+        c.execute(
+            "select {} from {} where {} = %s and user_id = %s".format(ROW_COLUMNS[tablename], tablename, ID_COLUMNS[tablename]),
+            (rid, user_id)
+        )
+        record = c.fetchone()
+        c.close()
+        if not record:
+            raise KeyNotFound()
+        return record
+
+    # the totals a table's page shows for the month of target_date
+    def totals(self, user_id, tablename, target_date):
+        target_month = date(target_date.year, target_date.month, 1)
+        if tablename == "expenses":
+            next_month = (target_month + timedelta(days=32)).replace(day=1)
+            (expenses, spent) = self.gather(
+                lambda c: self._expenses_due(c, user_id, target_month, next_month),
+                lambda c: self._total(c, user_id, "spending", target_month, linked=True),
+            )
+            return {"expected": sum(e[3] for e in expenses), "spent": spent}
+        if tablename in ("goals", "debt"):
+            return {"total": self.gather(lambda c: self._total(c, user_id, tablename))[0]}
+        if tablename in ("spending", "income"):
+            return {"total": self.gather(lambda c: self._total(c, user_id, tablename, target_month))[0]}
+        raise BadRequest("need a valid tablename")
+
 
     ########################################
     ## Expense management                 ##
@@ -233,123 +891,132 @@ class DB:
         '''
             insert an expense given a tuple of values.
             assumes that validation has been done
-            record format: (name, expected, due_date, repeat_type, owner, user_id)
+            record format: (name, expected in cents, due_date, repeat_type, repeat_interval, last_due, owner, user_id)
         '''
-        # get active user
-        c = self.conn.cursor()
+        # expense names are unique across the whole table, see unique(name) in schema.sql
+        with self.transaction() as c:
+            c.execute("select name from expenses where name = %s", (record[0],))
+            res = c.fetchone()
+            if res:
+                log.info("expense name %s already exists", res[0])
+                raise UsernameAlreadyExists("Expense name already exists")
+            try:
+                log.debug("insert expense %s", record)
+                c.execute("insert into expenses (name,expected,due_date,repeat_type,repeat_interval,last_due,owner,user_id) values (%s,%s,%s,%s,%s,%s,%s,%s) returning expense_id", record)
+                eid = c.fetchone()
+                self._rollup(c, "expenses", [eid[0]])
+                self._touch(c, record[7])
+            except Exception as e:
+                log.error("failed to add expense: %s", e)
+                raise BadRequest(e)
 
-        # enforce unique names per month
-        duedate = datetime.strptime(record[2], "%Y-%m-%d").date()
-        target_month = date(duedate.year, duedate.month, 1).strftime("%Y-%m-%d")
-        if duedate.month == 12:
-            next_month = date(duedate.year+1, 1, 1).strftime("%Y-%m-%d")
-        else: 
-            next_month = date(duedate.year, duedate.month+1, 1).strftime("%Y-%m-%d")
-        c.execute("select name from expenses where user_id = %s and name = %s and due_date > %s and due_date < %s", (record[5], record[0], target_month, next_month))
-        res = c.fetchone()
-        if res:
-            print("The expense name {} already exists".format(res[0]))
-            raise UsernameAlreadyExists("Expense name already exists")
-        try:
-            print("insert record", record)
-            c.execute("insert into expenses (name,expected,due_date,repeat_type,owner,user_id) values (%s,%s,%s,%s,%s,%s)", record)
-            c.execute("select expense_id from expenses where user_id = %s and name = %s", (record[5], record[0]))
-        except Exception as e:
-            print("Failed to add expense: {}".format(e))
-            raise BadRequest(e)
-            
-        eid = c.fetchone()
-        c.close()
-        self.conn.commit()
         return eid
 
-    def addexpense(self, username, request):
+    def addexpense(self, user_id, username, form):
         # validate that all required info is here
-        name = request.form['name'].capitalize()
-        expected = request.form['expected']
-        repeat_type = request.form['repeat']
-        owner = request.form['owner'].capitalize()
+        name = form['name'].capitalize()
+        expected = form['expected']
+        owner = form.get('owner', '').capitalize()
         if not owner:
             owner = username
-        edate = request.form['date']
-        if not edate:
-            edate = date.today().strftime("%Y-%m-%d")
         
-        # get active user
-        c = self.conn.cursor()
-        c.execute("select user_id from users where username = %s", (username,))
-        user_id = c.fetchone()[0]
-
         try:
-            self.insert_expense((name,expected,edate,repeat_type,owner,user_id))
+            edate = parse_date(form.get('date', ''), required=False) or date.today()
+            # repeat is onetime, daily, weekly, biweekly, monthly, quarterly or yearly,
+            # interval multiplies it and until is the last day it can fall on
+            (repeat_type, interval) = parse_repeat(form.get('repeat'), form.get('interval'))
+            until = parse_date(form.get('until', ''), required=False)
+            last = last_due(edate, repeat_type, until)
+            eid = self.insert_expense((name,parse_amount(expected),edate,repeat_type,interval,last,owner,user_id))
+        except UsernameAlreadyExists as e:
+            raise BadRequest(e.message)
         except Exception as e:
-            print("addexpense error: {}".format(e))
+            log.warning("addexpense failed: %s", e)
             raise BadRequest(e)
             
-        c.close()
-        self.conn.commit()
-        return '{"message":"new expense inserted"}'
+        return eid[0]
 
-    def myexpenses(self, username, target_date):
-        # get active user
-        c = self.conn.cursor()
+    def _expenses_due(self, c, user_id, start, end):
+        '''
+            the expenses falling between start and end (exclusive), in ROW_COLUMNS
+            order, dated on their first occurrence in the range and expecting the
+            amount of every occurrence in it. Only the rows still repeating in the
+            range are read, see recurrence.py
+        '''
+        c.execute(
+            '''
+            select {}, due_date, repeat_interval, last_due from expenses
+            where user_id = %s and last_due >= %s and due_date < %s;
+            '''.format(ROW_COLUMNS["expenses"]), (user_id, start, end)
+        )
+        (start, end) = (parse_date(str(start)), parse_date(str(end)))
+        due = []
+        for e in c.fetchall():
+            (due_date, interval, last) = e[6:]
+            dates = occurrences(due_date, e[4], interval, last, start, end)
+            if dates:
+                due.append((dates[0], e[2], (e[0], dates[0].strftime("%m/%d/%Y"), e[2], e[3] * len(dates), repeat_label(e[4], interval), e[5])))
+        return [e for (_, _, e) in sorted(due, key=lambda d: d[:2])]
+
+    # every linked spending row in the month, grouped by expense name
+    def _linked_by_expense(self, c, user_id, target_month, next_month):
+        c.execute(
+            '''
+            select {} from spending
+            where user_id = %s and expense_name != '' and date >= %s and date < %s
+            order by date desc, name;
+            '''.format(ROW_COLUMNS["spending"]), (user_id, target_month, next_month)
+        )
+        linked = {}
+        for s in c.fetchall():
+            linked.setdefault(s[4], []).append(s)
+        return linked
+
+    def myexpenses(self, user_id, target_date, with_spending=True):
+        '''
+            the month's expenses as (expense, spent, linked spending rows) and the
+            expected and spent totals. With with_spending=False the linked rows
+            are not loaded and come back as None, see linked_spending
+        '''
         target_month = date(target_date.year, target_date.month, 1).strftime("%Y-%m-%d")
         if target_date.month == 12:
             next_month = date(target_date.year+1, 1, 1).strftime("%Y-%m-%d")
         else: 
             next_month = date(target_date.year, target_date.month+1, 1).strftime("%Y-%m-%d")
 
-        try: 
-            c.execute("select user_id from users where username = %s", (username,))
-            user_id = c.fetchone()[0]
-        except Exception as e:
-            raise Exception("no user_id")
         try:
-            # totals per month
-            c.execute("select sum(expected) from expenses where user_id = %s and due_date >= %s and due_date < %s", (user_id, target_month, next_month))
-            etotal = c.fetchone()[0]
-            if not etotal:
-                etotal = 0
-            c.execute("select sum(amount) from spending where user_id = %s and expense_name != '' and date >= %s and date < %s", (user_id, target_month, next_month))
-            stotal = c.fetchone()[0]
+            # the month's totals, its expenses, spent per expense and the linked
+            # spending rows are independent of each other. Spent and linked rows
+            # are fetched once for the whole month and grouped here instead of
+            # once per expense
+            reads = [
+                lambda c: self._total(c, user_id, "spending", target_month, linked=True),
+                lambda c: self._expenses_due(c, user_id, target_month, next_month),
+                lambda c: dict(self._fetchall(c,
+                    '''
+                    select name, total from monthly_totals
+                    where user_id = %s and table_name = 'spending' and month = %s and name != '';
+                    ''', (user_id, target_month)
+                )),
+            ]
+            if with_spending:
+                reads.append(lambda c: self._linked_by_expense(c, user_id, target_month, next_month))
+            (stotal, expenses, spent, *linked) = self.gather(*reads)
+            linked = linked[0] if linked else None
             if not stotal:
                 stotal = 0
+            etotal = sum(e[3] for e in expenses)
 
-            c.execute(
-                '''
-                select expense_id,to_char(due_date, 'MM/DD/YYYY'),name,expected,repeat_type,owner from expenses 
-                where user_id = %s and due_date >= %s and due_date < %s or repeat_type = 'monthly'
-                order by due_date asc, name;
-                ''', (user_id,target_month, next_month,)
-            )
-            expenses = c.fetchall()
             result = []
             for e in expenses:
-                c.execute("select sum(amount) from spending where user_id = %s and expense_name = %s and date >= %s and date < %s", (user_id,e[2],target_month, next_month))
-                tot = c.fetchone()[0]
+                tot = spent.get(e[2])
                 if not tot:
                     tot = 0
-                c.execute(
-                    '''
-                    select spending_id,to_char(date, 'MM/DD/YY'),name,amount,expense_name,category,owner from spending 
-                    where user_id = %s and expense_name = %s and date >= %s and date < %s
-                    order by date desc, name;
-                    ''', (user_id, e[2], target_month, next_month)
-                )
-                if e[4] == "monthly":
-                    dt = datetime.strptime(e[1], "%m/%d/%Y")
-                    if dt.month == 12:
-                        ad = date(dt.year + 1, 1, dt.day).strftime("%m/%d/%Y")
-                    else:
-                        ad = date(dt.year, target_date.month, dt.day).strftime("%m/%d/%Y")
-                    e = (e[0], ad, e[2], e[3],e[4],e[5])
-                result += [(e, tot, c.fetchall())]
+                result += [(e, tot, linked.get(e[2], []) if linked is not None else None)]
         except Exception as e:
-            print("Failed to get expenses: {}".format(e))
+            log.error("failed to get expenses: %s", e)
             raise BadRequest(e)
 
-        c.close()
-        self.conn.commit()
         return (result, etotal, stotal)
 
 
@@ -357,126 +1024,100 @@ class DB:
     ## Spending management                ##
     ########################################
 
-    def addspending(self, username, request):
+    def addspending(self, user_id, username, form):
         # validate that all required info is here
-        name = request.form['name'].capitalize()
-        amount = request.form['amount']
-        expensename = request.form['linkedExpense'].capitalize()
+        name = form['name'].capitalize()
+        amount = form['amount']
+        expensename = form.get('linkedExpense', '').capitalize()
         if expensename == "":
             expensename = None
-        category = request.form['category'].lower()
-        owner = request.form['owner']
+        category = form.get('category', '').lower()
+        owner = form.get('owner', '')
         if not owner:
             owner = username
-        sdate = request.form['date']
-        if not sdate:
-            sdate = date.today().strftime("%Y-%m-%d")
         
-        c = self.conn.cursor()
-        # get active user
-        c.execute("select user_id from users where username = %s", (username,))
-        user_id = c.fetchone()[0]
-
         try:
-            c.execute("insert into spending (name,amount,date,category,owner,expense_name,user_id) values (%s,%s,%s,%s,%s,%s,%s)", (name,amount,sdate,category,owner,expensename,user_id))
+            sdate = parse_date(form.get('date', ''), required=False) or date.today()
+            amount = parse_amount(amount)
+            with self.transaction() as c:
+                c.execute("insert into spending (name,amount,date,category,owner,expense_name,user_id) values (%s,%s,%s,%s,%s,%s,%s) returning spending_id", (name,amount,sdate,category,owner,expensename,user_id))
+                rid = c.fetchone()[0]
+                self._rollup(c, "spending", [rid])
+                self._touch(c, user_id)
         except Exception as e:
-            print("Failed to add spending: {}".format(e))
+            log.warning("failed to add spending: %s", e)
             raise BadRequest(e)
             
-        c.close()
-        self.conn.commit()
-        return '{"message":"new spending inserted"}'
+        return rid
 
-    def myspending(self, username, target_date):
-        # get active user
-        c = self.conn.cursor()
+    def myspending(self, user_id, target_date, after=None, limit=None):
+        '''
+            one page of a month's spending, newest first, and the month's total.
+            after is the (date, spending_id) the previous page ended on.
+            returns (rows, total, next) where next is the after for the following
+            page, or None when this was the last one
+        '''
         target_month = date(target_date.year, target_date.month, 1).strftime("%Y-%m-%d")
         if target_date.month == 12:
             next_month = date(target_date.year+1, 1, 1).strftime("%Y-%m-%d")
         else: 
             next_month = date(target_date.year, target_date.month+1, 1).strftime("%Y-%m-%d")
 
-        total = None
-        try: 
-            c.execute("select user_id from users where username = %s", (username,))
-            user_id = c.fetchone()[0]
-        except Exception as e:
-            raise Exception("no user_id")
         try:
-            c.execute("select sum(amount) from spending where user_id = %s and date >= %s and date < %s", (user_id,target_month,next_month))
-            total = c.fetchone()[0]
-            c.execute(
-                '''
-                select spending_id,to_char(date, 'MM/DD/YY'),name,amount,expense_name,category,owner from spending 
-                where user_id = %s and date >= %s and date < %s
-                order by date desc, name;
-                ''', (user_id,target_month,next_month) 
+            (total, (result, next_page)) = self.gather(
+                lambda c: self._total(c, user_id, "spending", target_month),
+                lambda c: self._page(c, "spending", "date", user_id, target_month, next_month, after, limit),
             )
         except Exception as e:
-            print("Failed to get spending: {}".format(e))
+            log.error("failed to get spending: %s", e)
             raise BadRequest(e)
             
-        result = c.fetchall()
-        c.close()
-        self.conn.commit()
-        return (result, total)
+        return (result, total, next_page)
 
 
     ########################################
     ## Goal management                    ##
     ########################################
 
-    def addgoal(self, username, request):
+    def addgoal(self, user_id, username, form):
         # validate that all required info is here
-        name = request.form['name']
-        target = request.form['target']
-        amount = request.form['amount']
-        owner = request.form['owner']
+        name = form['name']
+        target = form['target']
+        amount = form.get('amount', '')
+        owner = form.get('owner', '')
         if not owner:
             owner = username
-        gdate = request.form['date']
         
-        # get active user
-        c = self.conn.cursor()
-        c.execute("select user_id from users where username = %s", (username,))
-        user_id = c.fetchone()[0]
-
         try:
-            c.execute("insert into goals (name,target,amount,target_date,owner,user_id) values (%s,%s,%s,%s,%s,%s)", (name,target,amount,gdate,owner,user_id))
+            gdate = parse_date(form.get('date', ''), required=False)
+            (target, amount) = (parse_amount(target), parse_amount(amount, required=False))
+            with self.transaction() as c:
+                c.execute("insert into goals (name,target,amount,target_date,owner,user_id) values (%s,%s,%s,%s,%s,%s) returning goal_id", (name,target,amount,gdate,owner,user_id))
+                rid = c.fetchone()[0]
+                self._rollup(c, "goals", [rid])
+                self._touch(c, user_id)
         except Exception as e:
-            print("Failed to add goal: {}".format(e))
+            log.warning("failed to add goal: %s", e)
             raise BadRequest(e)
             
-        c.close()
-        self.conn.commit()
-        return '{"message":"new goal inserted"}'
+        return rid
 
-    def mygoals(self, username):
-        # get active user
-        c = self.conn.cursor()
-
-        try: 
-            c.execute("select user_id from users where username = %s", (username,))
-            user_id = c.fetchone()[0]
-        except Exception as e:
-            raise Exception("no user_id")
+    def mygoals(self, user_id):
         try:
-            c.execute("select sum(target) from goals where user_id = %s", (user_id,))
-            total = c.fetchone()[0]
-            c.execute(
-                '''
-                select goal_id,to_char(target_date, 'MM/DD/YY'),name,target,amount,owner from goals 
-                where user_id = %s 
-                order by target_date desc, name;
-                ''', (user_id,)
+            (total, result) = self.gather(
+                lambda c: self._total(c, user_id, "goals"),
+                lambda c: self._fetchall(c,
+                    '''
+                    select {} from goals 
+                    where user_id = %s 
+                    order by target_date desc, name;
+                    '''.format(ROW_COLUMNS["goals"]), (user_id,)
+                ),
             )
         except Exception as e:
-            print("Failed to get goals: {}".format(e))
+            log.error("failed to get goals: %s", e)
             raise BadRequest(e)
             
-        result = c.fetchall()
-        c.close()
-        self.conn.commit()
         return (result, total)
 
 
@@ -484,116 +1125,213 @@ class DB:
     ## Debt management                    ##
     ########################################
 
-    def adddebt(self, username, request):
+    def adddebt(self, user_id, username, form):
         # validate that all required info is here
-        name = request.form['name'].capitalize()
-        amount = request.form['amount']
-        owner = request.form['owner']
+        name = form['name'].capitalize()
+        amount = form['amount']
+        owner = form.get('owner', '')
         if not owner:
             owner = username
-        ddate = request.form['date']
         
-        # get active user
-        c = self.conn.cursor()
-
         try:
-            user_id = c.execute("select user_id from users where username = %s", (username,)).fetchone()[0]
-            c.execute("insert into debt (name,amount,target_date,owner,user_id) values (%s,%s,%s,%s,%s)", (name,amount,ddate,owner,user_id))
+            ddate = parse_date(form.get('date', ''), required=False)
+            amount = parse_amount(amount)
+            with self.transaction() as c:
+                c.execute("insert into debt (name,amount,target_date,owner,user_id) values (%s,%s,%s,%s,%s) returning debt_id", (name,amount,ddate,owner,user_id))
+                rid = c.fetchone()[0]
+                self._rollup(c, "debt", [rid])
+                self._touch(c, user_id)
         except Exception as e:
-            print("Failed to add debt: {}".format(e))
+            log.warning("failed to add debt: %s", e)
             raise BadRequest(e)
             
-        c.close()
-        self.conn.commit()
-        return '{"message":"new debt inserted"}'
+        return rid
     
-    def mydebt(self, username):
-        # get active user
-        c = self.conn.cursor()
-
-        try: 
-            c.execute("select user_id from users where username = %s", (username,))
-            user_id = c.fetchone()[0]
-        except Exception as e:
-            raise Exception("no user_id")
+    def mydebt(self, user_id):
         try:
-            total = c.fetchone()[0]
-            c.execute(
-                '''
-                select debt_id,to_char(target_date, 'MM/DD/YY'),name,amount,owner from debt 
-                where user_id = %s 
-                order by target_date desc, name;
-                ''', (user_id,)
+            (total, result) = self.gather(
+                lambda c: self._total(c, user_id, "debt"),
+                lambda c: self._fetchall(c,
+                    '''
+                    select {} from debt 
+                    where user_id = %s 
+                    order by target_date desc, name;
+                    '''.format(ROW_COLUMNS["debt"]), (user_id,)
+                ),
             )
         except Exception as e:
-            print("Failed to get debt: {}".format(e))
+            log.error("failed to get debt: %s", e)
             raise BadRequest(e)
             
-        result = c.fetchall()
-        c.close()
-        self.conn.commit()
         return (result, total)
 
     ########################################
     ## Income management                  ##
     ########################################
 
-    def addincome(self, username, request):
+    def addincome(self, user_id, username, form):
         # validate that all required info is here
-        name = request.form['name'].capitalize()
-        amount = request.form['amount']
-        owner = request.form['owner']
-        type = request.form['type'].lower()
+        name = form['name'].capitalize()
+        amount = form['amount']
+        owner = form.get('owner', '')
+        type = form.get('type', '').lower()
         if not owner:
             owner = username
-        idate = request.form['date']
-        if not idate:
-            idate = date.today().strftime("%Y-%m-%d")
         
-        # get active user
-        c = self.conn.cursor()
-        c.execute("select user_id from users where username = %s", (username,))
-        user_id = c.fetchone()[0]
-
         try:
-            c.execute("insert into income (name,amount,date,type,owner,user_id) values (%s,%s,%s,%s,%s,%s)", (name,amount,idate,type,owner,user_id))
+            idate = parse_date(form.get('date', ''), required=False) or date.today()
+            amount = parse_amount(amount)
+            with self.transaction() as c:
+                c.execute("insert into income (name,amount,date,type,owner,user_id) values (%s,%s,%s,%s,%s,%s) returning income_id", (name,amount,idate,type,owner,user_id))
+                rid = c.fetchone()[0]
+                self._rollup(c, "income", [rid])
+                self._touch(c, user_id)
         except Exception as e:
-            print("Failed to add income: {}".format(e))
+            log.warning("failed to add income: %s", e)
             raise BadRequest(e)
             
-        c.close()
-        self.conn.commit()
-        return '{"message":"new income inserted"}'
+        return rid
     
-    def myincome(self, username, target_date):
-        # get active user
-        c = self.conn.cursor()
+    def myincome(self, user_id, target_date, after=None, limit=None):
+        '''
+            one page of a month's income, newest first, and the month's total.
+            paged like myspending, returns (rows, total, next)
+        '''
         target_month = date(target_date.year, target_date.month, 1).strftime("%Y-%m-%d")
         if target_date.month == 12:
             next_month = date(target_date.year+1, 1, 1).strftime("%Y-%m-%d")
         else: 
             next_month = date(target_date.year, target_date.month+1, 1).strftime("%Y-%m-%d")
 
-        try: 
-            c.execute("select user_id from users where username = %s", (username,))
-            user_id = c.fetchone()[0]
-        except Exception as e:
-            raise Exception("no user_id")
         try:
-            c.execute("select sum(amount) from income where user_id = %s and date >= %s and date < %s", (user_id,target_month,next_month))
-            total = c.fetchone()[0]
-            c.execute(
-                '''
-                select income_id,to_char(date, 'MM/DD/YY'),name,amount,type,owner from income 
-                where user_id = %s and date >= %s and date < %s
-                order by date desc, name;
-                ''', (user_id,target_month,next_month)
+            (total, (result, next_page)) = self.gather(
+                lambda c: self._total(c, user_id, "income", target_month),
+                lambda c: self._page(c, "income", "date", user_id, target_month, next_month, after, limit),
             )
         except Exception as e:
-            print("Failed to get income: {}".format(e))
+            log.error("failed to get income: %s", e)
             raise BadRequest(e)
             
-        result = c.fetchall()
-        c.close()
-        self.conn.commit()
-        return (result, total)
+        return (result, total, next_page)
+
+
+    ########################################
+    ## Dashboard                          ##
+    ########################################
+
+    def dashboard(self, user_id, start, end):
+        '''
+            income, spending, expected expenses and spending per category for
+            every month from start up to but not including end (first days of
+            months). One grouped query per table, the rows are added up in a
+            single pass. returns a dict with "months", "categories" and "totals"
+        '''
+        months = []
+        month = start
+        while month < end:
+            months.append(month.strftime("%Y-%m"))
+            month = (month + timedelta(days=32)).replace(day=1)
+        if not months:
+            raise BadRequest("the range needs at least one month")
+        if len(months) > DASHBOARD_MAX_MONTHS:
+            raise BadRequest("the range can be at most {} months".format(DASHBOARD_MAX_MONTHS))
+        index = {m: i for (i, m) in enumerate(months)}
+        sums = {name: [0] * len(months) for name in ("income", "spending", "expected")}
+        categories = {}
+
+        try:
+            (rollups, spending, expenses) = self.gather(
+                # income and spending are already summed per month by the rollup
+                lambda c: self._fetchall(c,
+                    '''
+                    select table_name, month, sum(total)::bigint from monthly_totals
+                    where user_id = %s and table_name in ('income', 'spending') and month >= %s and month < %s
+                    group by table_name, month;
+                    ''', (user_id, start, end)
+                ),
+                lambda c: self._fetchall(c,
+                    '''
+                    select date_trunc('month', date)::date, coalesce(category, ''), sum(amount)::bigint from spending
+                    where user_id = %s and date >= %s and date < %s
+                    group by 1, 2;
+                    ''', (user_id, start, end)
+                ),
+                lambda c: self._fetchall(c,
+                    '''
+                    select due_date, repeat_type, repeat_interval, last_due, expected from expenses
+                    where user_id = %s and last_due >= %s and due_date < %s;
+                    ''', (user_id, start, end)
+                ),
+            )
+        except Exception as e:
+            log.error("failed to get dashboard: %s", e)
+            raise BadRequest(e)
+
+        for (table_name, month, total) in rollups:
+            sums[table_name][index[str(month)[:7]]] += total
+        for (month, category, total) in spending:
+            categories.setdefault(category, [0] * len(months))[index[str(month)[:7]]] += total
+        # each expense is expanded over the whole range once, see recurrence.py
+        expected = sums["expected"]
+        for (due_date, unit, interval, last, amount) in expenses:
+            for day in occurrences(due_date, unit, interval, last, start, end):
+                expected[index[day.strftime("%Y-%m")]] += amount
+
+        return {
+            "months": [
+                {"month": m, "income": sums["income"][i], "spending": sums["spending"][i],
+                 "expected": expected[i], "net": sums["income"][i] - sums["spending"][i]}
+                for (i, m) in enumerate(months)
+            ],
+            "categories": sorted(
+                ({"category": name, "total": sum(totals), "months": totals} for (name, totals) in categories.items()),
+                key=lambda row: -row["total"]
+            ),
+            "totals": {
+                "income": sum(sums["income"]),
+                "spending": sum(sums["spending"]),
+                "expected": sum(expected),
+                "net": sum(sums["income"]) - sum(sums["spending"]),
+            },
+        }
+
+
+    ########################################
+    ## Search                             ##
+    ########################################
+
+    def search(self, user_id, text, tablename=None, page=1, limit=PAGE_SIZE):
+        '''
+            the user's records with a word starting with each word of text, best
+            match first, from every table or only tablename. One page of limit
+            results, returns ([(tablename, row in ROW_COLUMNS order, rank)], more)
+        '''
+        words = re.findall(r"\w+", text.lower())[:MAX_SEARCH_WORDS]
+        if tablename is not None and tablename not in SEARCH_COLUMNS:
+            raise BadRequest("need a valid tablename")
+        if not words:
+            return ([], False)
+        tables = {t: (ID_COLUMNS[t], columns) for (t, columns) in SEARCH_COLUMNS.items() if tablename in (None, t)}
+        c = self.conn.cursor()
+        try:
+            # one more than asked for tells whether there is another page
+            hits = backend_for(self.conn).search(c, tables, user_id, words, limit + 1, (page - 1) * limit)
+            more = len(hits) > limit
+            hits = hits[:limit]
+            ids = {}
+            for (t, rid, _) in hits:
+                ids.setdefault(t, []).append(rid)
+            rows = {}
+            for (t, rids) in ids.items():
+                c.execute(
+                    "select {} from {} where user_id = %s and {} = any(%s)".format(ROW_COLUMNS[t], t, ID_COLUMNS[t]),
+                    (user_id, rids)
+                )
+                for row in c.fetchall():
+                    rows[(t, row[0])] = row
+        except Exception as e:
+            log.error("search failed: %s", e)
+            raise BadRequest(e)
+        finally:
+            c.close()
+        return ([(t, rows[(t, rid)], rank) for (t, rid, rank) in hits if (t, rid) in rows], more)
@@ -0,0 +1,10 @@
+# gunicorn picks this file up from the working directory on start up
+
+# every worker gets its own database connection pool after it is forked,
+# connections must never be shared between processes. Likewise the log
+# writer thread, which does not survive the fork
+def post_fork(server, worker):
+    from logs import setup_logging
+    from pool import reset_pool
+    setup_logging()
+    reset_pool()
@@ -0,0 +1,101 @@
+import os
+import hashlib
+import hmac
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from instrument import timed
+
+# PBKDF2 parameters for new hashes. Stored hashes carry their own round
+# count, so raising this only affects new passwords and rehashes on login
+HASH_ALGORITHM = "pbkdf2_sha256"
+HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", 100000))
+SALT_BYTES = 32
+# hashes made before parameters were stored: hex(salt + key), 100000 rounds
+LEGACY_ITERATIONS = 100000
+
+# at most HASH_WORKERS hashes run at once and HASH_QUEUE_DEPTH more may wait,
+# anything beyond that is turned away with HashingBusy
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", 2))
+HASH_QUEUE_DEPTH = int(os.environ.get("HASH_QUEUE_DEPTH", 8))
+HASH_TIMEOUT = float(os.environ.get("HASH_TIMEOUT", 10))
+
+
+# Error class for when too many passwords are already being hashed
+class HashingBusy(Exception):
+    def __init__(self, message=None):
+        Exception.__init__(self)
+        if message:
+            self.message = message
+        else:
+            self.message = "Too many login attempts in progress. Please try again shortly"
+
+    def to_dict(self):
+        rv = dict()
+        rv["message"] = self.message
+        return rv
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+_executor = None
+_executor_pid = None
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_DEPTH)
+_lock = threading.Lock()
+
+# the process pool is created on first use in each process, a pool
+# inherited across fork() belongs to the parent
+def get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+# run pbkdf2 in the hashing pool, raises HashingBusy when the pool is saturated
+# or the hash is not done within HASH_TIMEOUT
+def pbkdf2(password, salt, iterations):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = get_executor().submit(_pbkdf2, password, salt, iterations)
+    except BaseException:
+        _slots.release()
+        raise
+    # a hash we stopped waiting for still keeps its worker busy, so its slot is
+    # only given back once it is done
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        with timed("hash"):
+            return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise HashingBusy()
+
+# hash a new password, returns "pbkdf2_sha256$<iterations>$<salt hex>$<key hex>"
+def hash_password(password):
+    salt = os.urandom(SALT_BYTES) # A new salt for this user
+    key = pbkdf2(password, salt, HASH_ITERATIONS)
+    return "{}${}${}${}".format(HASH_ALGORITHM, HASH_ITERATIONS, salt.hex(), key.hex())
+
+def _decode(stored):
+    stored = stored.strip()
+    if "$" not in stored:
+        hashed_password = bytes.fromhex(stored)
+        return (LEGACY_ITERATIONS, hashed_password[:SALT_BYTES], hashed_password[SALT_BYTES:])
+    (algorithm, iterations, salt, key) = stored.split("$")
+    if algorithm != HASH_ALGORITHM:
+        raise ValueError("unknown password hash algorithm {}".format(algorithm))
+    return (int(iterations), bytes.fromhex(salt), bytes.fromhex(key))
+
+def verify_password(password, stored):
+    '''
+        check a password against a stored hash.
+        returns (matches, needs_rehash) where needs_rehash is True when the
+        stored hash was made with other parameters than the current ones
+    '''
+    (iterations, salt, key) = _decode(stored)
+    if not hmac.compare_digest(pbkdf2(password, salt, iterations), key):
+        return (False, False)
+    return (True, "$" not in stored or iterations != HASH_ITERATIONS)
@@ -0,0 +1,354 @@
+"""
+Opt-in request and query instrumentation, turned on with INSTRUMENT=1.
+
+Every query run through a request's connection is timed and counted under a
+fingerprint of its SQL (literals and parameter lists folded away), and each
+request adds up the time it spent in the database, rendering templates and
+hashing passwords. Reads the fan-out runs on other threads (asyncdb.py) are
+added to their request. That ends up in three places:
+
+- a Server-Timing header on every response, which browser dev tools show
+- a log line for requests slower than SLOW_REQUEST_MS (default 500), kept
+  for a SLOW_REQUEST_SAMPLE fraction of them (default 0.25)
+- /metrics, the process's totals in Prometheus text format
+
+The work per query is a dict lookup and a few additions, so it can stay on.
+The body of a streamed response (the exports) runs after the request is
+accounted and is not included.
+"""
+import os
+import re
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from flask import g, request, has_request_context, Response
+from jinja2 import Template
+from backends import execute_values
+
+ENABLED = os.environ.get("INSTRUMENT", "0").lower() in ("1", "true", "yes", "on")
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 500))
+SLOW_REQUEST_SAMPLE = float(os.environ.get("SLOW_REQUEST_SAMPLE", 0.25))
+
+# request latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# fingerprints beyond this many are counted under "other"
+MAX_FINGERPRINTS = 500
+# queries a request remembers for the slow log
+MAX_REQUEST_QUERIES = 50
+# longer fingerprints (schema scripts) are cut off
+MAX_FINGERPRINT_LENGTH = 300
+
+log = logging.getLogger(__name__)
+
+
+# the shape of a statement without its values:
+# "select * from t where id = %s and name = 'x' and n in (1,2)" -> "select * from t where id = ? and name = ? and n in (?)"
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    sql = re.sub(r"--[^\n]*", "", sql)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"%s|\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", sql)
+    sql = " ".join(sql.split())
+    if len(sql) > MAX_FINGERPRINT_LENGTH:
+        sql = sql[:MAX_FINGERPRINT_LENGTH] + "..."
+    return sql
+
+
+"""
+Process wide totals, read by /metrics. Every method takes the lock, the
+request path only ever adds to a handful of counters.
+"""
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = {} # fingerprint -> [count, seconds, rows]
+        self.requests = {} # (endpoint, method, status) -> count
+        self.latency = {} # endpoint -> [bucket counts..., count, sum]
+        self.phases = {} # (endpoint, phase) -> seconds
+
+    # calls=0 adds fetching time and rows to a query that was already counted
+    def query(self, sql, seconds, rows, calls=1):
+        with self._lock:
+            stats = self.queries.get(sql)
+            if stats is None:
+                if len(self.queries) >= MAX_FINGERPRINTS:
+                    sql = "other"
+                stats = self.queries.setdefault(sql, [0, 0.0, 0])
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] += rows
+
+    def request(self, endpoint, method, status, seconds, timings):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.setdefault(endpoint, [0] * len(BUCKETS) + [0, 0.0])
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += 1
+            hist[-1] += seconds
+            for phase, spent in timings.items():
+                self.phases[(endpoint, phase)] = self.phases.get((endpoint, phase), 0.0) + spent
+
+    def prometheus(self):
+        with self._lock:
+            lines = [
+                "# HELP mft_requests_total Requests answered, by endpoint, method and status.",
+                "# TYPE mft_requests_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('mft_requests_total{{endpoint="{}",method="{}",status="{}"}} {}'.format(
+                    _label(endpoint), method, status, count))
+            lines += [
+                "# HELP mft_request_duration_seconds Time to answer a request, excluding streamed bodies.",
+                "# TYPE mft_request_duration_seconds histogram",
+            ]
+            for endpoint, hist in sorted(self.latency.items()):
+                for bound, count in zip(BUCKETS, hist):
+                    lines.append('mft_request_duration_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(_label(endpoint), bound, count))
+                lines.append('mft_request_duration_seconds_bucket{{endpoint="{}",le="+Inf"}} {}'.format(_label(endpoint), hist[-2]))
+                lines.append('mft_request_duration_seconds_count{{endpoint="{}"}} {}'.format(_label(endpoint), hist[-2]))
+                lines.append('mft_request_duration_seconds_sum{{endpoint="{}"}} {:.6f}'.format(_label(endpoint), hist[-1]))
+            lines += [
+                "# HELP mft_request_phase_seconds_total Time requests spent in the database, rendering and hashing.",
+                "# TYPE mft_request_phase_seconds_total counter",
+            ]
+            for (endpoint, phase), spent in sorted(self.phases.items()):
+                lines.append('mft_request_phase_seconds_total{{endpoint="{}",phase="{}"}} {:.6f}'.format(_label(endpoint), phase, spent))
+            for (name, index, kind, text) in (
+                ("mft_db_queries_total", 0, "counter", "Queries run, by fingerprint."),
+                ("mft_db_query_seconds_total", 1, "counter", "Time spent running and fetching queries, by fingerprint."),
+                ("mft_db_query_rows_total", 2, "counter", "Rows returned or changed, by fingerprint."),
+            ):
+                lines += ["# HELP {} {}".format(name, text), "# TYPE {} {}".format(name, kind)]
+                for sql, stats in sorted(self.queries.items()):
+                    value = "{:.6f}".format(stats[index]) if index == 1 else stats[index]
+                    lines.append('{}{{query="{}"}} {}'.format(name, _label(sql), value))
+        return lines
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+metrics = Metrics()
+
+
+########################################
+## Per request accounting             ##
+########################################
+
+def _add(phase, seconds):
+    if has_request_context():
+        timings = getattr(g, "_timings", None)
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+# time a block of work as part of the current request's phase, e.g. "hash"
+@contextmanager
+def timed(phase):
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(phase, time.perf_counter() - start)
+
+"""
+Jinja template class that adds its rendering time to the request. Only the
+top level render() call is timed, extended layouts render inside it.
+"""
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            _add("render", time.perf_counter() - start)
+
+
+"""
+The database time and queries of a request's reads that run on other threads
+(asyncdb.py), where flask.g can not be reached. merge() adds them to the
+request on its own thread once the reads are joined.
+"""
+class Tally:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_log = []
+
+    def query(self, sql, seconds):
+        self.seconds += seconds
+        self.queries += 1
+        if len(self.query_log) < MAX_REQUEST_QUERIES:
+            self.query_log.append((sql, seconds))
+
+    def merge(self):
+        _add("db", self.seconds)
+        if has_request_context() and getattr(g, "_timings", None) is not None:
+            g._queries += self.queries
+            g._query_log += self.query_log[:max(0, MAX_REQUEST_QUERIES - len(g._query_log))]
+
+
+"""
+Wraps a connection so every query its cursors run is timed, counted and
+attributed to the current request, or to tally when one is given.
+"""
+class InstrumentedConnection:
+    def __init__(self, connection, tally=None):
+        self.conn = connection
+        self.tally = tally
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.conn.cursor(*args, **kwargs), self.tally)
+
+    @property
+    def autocommit(self):
+        return self.conn.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self.conn.autocommit = value
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class InstrumentedCursor:
+    def __init__(self, cursor, tally=None):
+        self.cursor = cursor
+        self.tally = tally
+        self._sql = None
+        self._count_fetched = False
+
+    def _record(self, sql, seconds, rows):
+        metrics.query(sql, seconds, rows)
+        if self.tally is not None:
+            self.tally.query(sql, seconds)
+        elif has_request_context():
+            timings = getattr(g, "_timings", None)
+            if timings is not None:
+                timings["db"] = timings.get("db", 0.0) + seconds
+                g._queries += 1
+                if len(g._query_log) < MAX_REQUEST_QUERIES:
+                    g._query_log.append((sql, seconds))
+
+    def execute(self, query, params=None):
+        self._sql = fingerprint(query)
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(query, params)
+        finally:
+            # statements that return rows are counted as they are fetched, SQLite
+            # only knows how many a select returns once it has stepped through them
+            self._count_fetched = self.cursor.description is not None
+            rows = 0 if self._count_fetched else max(self.cursor.rowcount or 0, 0)
+            self._record(self._sql, time.perf_counter() - start, rows)
+
+    def execute_values(self, sql, argslist, page_size=100, fetch=False):
+        self._sql = fingerprint(sql)
+        self._count_fetched = False
+        start = time.perf_counter()
+        try:
+            return execute_values(self.cursor, sql, argslist, page_size, fetch)
+        finally:
+            self._record(self._sql, time.perf_counter() - start, len(argslist))
+
+    # fetching is part of a query's time, SQLite does most of its work here
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        seconds = time.perf_counter() - start
+        if self.tally is not None:
+            self.tally.seconds += seconds
+        else:
+            _add("db", seconds)
+        if self._sql is not None:
+            rows = 0
+            if self._count_fetched:
+                rows = len(result) if isinstance(result, list) else int(result is not None)
+            metrics.query(self._sql, seconds, rows, calls=0)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self.cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self.cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self.cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __setattr__(self, name, value):
+        # settings like itersize belong to the wrapped cursor
+        if name in ("cursor", "tally", "_sql", "_count_fetched"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.cursor, name, value)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+# wrap a connection checked out for a request, or hand it back as it is.
+# The queries of a connection used on another thread go to tally
+def instrumented(conn, tally=None):
+    return InstrumentedConnection(conn, tally) if ENABLED else conn
+
+
+def _start_request():
+    g._started = time.perf_counter()
+    g._timings = {}
+    g._queries = 0
+    g._query_log = []
+
+def _finish_request(response):
+    started = getattr(g, "_started", None)
+    if started is None:
+        return response
+    total = time.perf_counter() - started
+    timings = g._timings
+    endpoint = request.endpoint or "unknown"
+    metrics.request(endpoint, request.method, response.status_code, total, timings)
+
+    parts = ['db;dur={:.2f};desc="{} queries"'.format(timings.get("db", 0.0) * 1000, g._queries)]
+    for phase in ("render", "hash"):
+        if phase in timings:
+            parts.append("{};dur={:.2f}".format(phase, timings[phase] * 1000))
+    parts.append("total;dur={:.2f}".format(total * 1000))
+    response.headers["Server-Timing"] = ", ".join(parts)
+
+    if total * 1000 >= SLOW_REQUEST_MS and random.random() < SLOW_REQUEST_SAMPLE:
+        slowest = sorted(g._query_log, key=lambda q: q[1], reverse=True)[:3]
+        log.warning(
+            "slow request %s %s %s: %.1fms total, db %.1fms in %d queries, render %.1fms, hash %.1fms; slowest queries: %s",
+            request.method, request.full_path.rstrip("?"), response.status_code, total * 1000,
+            timings.get("db", 0.0) * 1000, g._queries, timings.get("render", 0.0) * 1000,
+            timings.get("hash", 0.0) * 1000,
+            "; ".join("{:.1f}ms {}".format(seconds * 1000, sql) for sql, seconds in slowest),
+        )
+    return response
+
+# hook the accounting into an app. extra_metrics returns more Prometheus
+# lines for /metrics, such as the pool and cache gauges
+def init_app(app, extra_metrics=None):
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        if not ENABLED:
+            return Response("instrumentation is off, set INSTRUMENT=1\n", status=404, mimetype="text/plain")
+        lines = metrics.prometheus()
+        if extra_metrics:
+            lines += extra_metrics()
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    if ENABLED:
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
@@ -0,0 +1,441 @@
+"""
+Multi-user load test against a running deployment, for example
+`gunicorn app:app` on a local database.
+
+Every simulated user plays sessions the way a person would. A session logs
+in, pages back through a few months, adds spending through the form and the
+API, imports a csv file, deletes rows and logs out, with some think time
+between requests. Each concurrency level runs for --duration seconds, one
+level after another, and reports throughput, p50/p95/p99 latency and error
+rate, overall and per kind of request. Results are written as JSON like
+benchmark.py's. Usage:
+
+    python loadtest.py --url http://localhost:8000 --levels 1,5,10,25
+    python loadtest.py ... --record trace.jsonl       also save what was played
+    python loadtest.py ... --replay trace.jsonl       play a recorded trace instead
+
+A trace has one request per line, grouped into sessions:
+
+    {"session": 3, "at": 1.52, "name": "POST /addspending", "method": "POST",
+     "path": "/addspending", "form": {"name": "Coffee", ...}}
+
+"at" is when the request started, in seconds since its session did. A body
+is given as "form", "json" or "files" plus "form" for a csv upload. "headers"
+holds any extra request headers. "save" names a variable that takes the id of
+the first row of a JSON answer, and a later path can use it as {name}. A
+request can also give the status it "expect"s. In a replay each simulated
+user plays its share of the sessions in order, waiting until each request's
+"at" (scaled by --speed, 0 for no waiting). Users log in with the username
+recorded in the session.
+
+Accounts are created before the first level, with the password given by
+--password. Requests that fail with a status of 400 or more, that end up at
+the login page when they should not, or that do not answer at all count as
+errors.
+"""
+import argparse
+import csv
+import http.client
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import date, datetime, timedelta
+from http.cookies import SimpleCookie
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load test a running deployment with simulated users.")
+    parser.add_argument("--url", default="http://localhost:8000", help="where the app runs (default http://localhost:8000)")
+    parser.add_argument("--levels", default="1,5,10,25", help="concurrent users per level, comma separated (default 1,5,10,25)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each level runs (default 30)")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds a user waits between requests (default 0.5, 0 for none)")
+    parser.add_argument("--months", type=int, default=3, help="months a session pages back through (default 3)")
+    parser.add_argument("--import-rows", type=int, default=50, help="rows in each session's csv import (default 50)")
+    parser.add_argument("--user-prefix", default="loadtest", help="usernames are <prefix>-<n> (default loadtest)")
+    parser.add_argument("--password", default="loadtest", help="password of the load test accounts (default loadtest)")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for an answer (default 30)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the sessions (default 1)")
+    parser.add_argument("--record", help="write every session played to this trace file")
+    parser.add_argument("--replay", help="play the sessions of this trace file instead of generated ones")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 2 is twice as fast, 0 is no waiting (default 1)")
+    parser.add_argument("--output", help="where to write the results (default loadtest-<time>.json)")
+    return parser.parse_args(argv)
+
+
+########################################
+## HTTP                               ##
+########################################
+
+"""
+One simulated browser: a kept-alive connection to the app and the cookies it
+was given. Redirects are not followed, each request is timed on its own. The
+session cookie is marked Secure, which http.cookiejar would not send over
+plain http, so cookies are kept by hand.
+"""
+class Client:
+    def __init__(self, url, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.conn = None
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        '''
+            send one request, returns (status, location, body bytes)
+        '''
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join("{}={}".format(name, value) for (name, value) in self.cookies.items())
+        if self.conn is None:
+            self.conn = self.connection_class(self.host, timeout=self.timeout)
+        try:
+            self.conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except Exception:
+            self.close()
+            raise
+        for header in response.msg.get_all("Set-Cookie") or []:
+            cookie = SimpleCookie()
+            cookie.load(header)
+            for (name, morsel) in cookie.items():
+                # flask clears a cookie by setting it empty and expired
+                if morsel.value:
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        return (response.status, response.getheader("Location"), data)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+# the body and content type of a trace request
+def encode_body(req):
+    if "files" in req:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for (name, value) in req.get("form", {}).items():
+            parts.append('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(boundary, name, value))
+        for (name, upload) in req["files"].items():
+            parts.append('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\nContent-Type: text/csv\r\n\r\n{}\r\n'.format(
+                boundary, name, upload["filename"], upload["content"]))
+        parts.append("--{}--\r\n".format(boundary))
+        return ("".join(parts).encode("utf-8"), "multipart/form-data; boundary=" + boundary)
+    if "json" in req:
+        return (json.dumps(req["json"]).encode("utf-8"), "application/json")
+    if "form" in req:
+        return (urllib.parse.urlencode(req["form"]).encode("utf-8"), "application/x-www-form-urlencoded")
+    return (None, None)
+
+# whether an answer counts as an error
+def failed(req, status, location):
+    if "expect" in req:
+        return status != req["expect"]
+    if status >= 400:
+        return True
+    # the session was lost and the app sent the user back to log in
+    return bool(location) and location.rstrip("/").endswith("/login") and req["path"] != "/logout"
+
+
+########################################
+## Sessions                           ##
+########################################
+
+# the first day of this month and the months before it, newest first
+def recent_months(count):
+    month = date.today().replace(day=1)
+    months = []
+    for _ in range(count):
+        months.append(month)
+        month = (month - timedelta(days=1)).replace(day=1)
+    return months
+
+def import_csv(rows, month, rng):
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    out.writerow(["name", "amount", "date", "category", "owner", "expense_name"])
+    for i in range(rows):
+        out.writerow(["Imported {}".format(i), "{:.2f}".format(rng.randint(100, 20000) / 100),
+            month.replace(day=rng.randint(1, 28)).isoformat(), rng.choice(["food", "fun", "bills"]), "", ""])
+    return buf.getvalue()
+
+def session_requests(username, password, args, rng):
+    '''
+        one user's visit as a list of trace requests, without "session" and "at":
+        log in, page through the months, add spending, import a csv, delete
+        rows and log out
+    '''
+    months = recent_months(args.months)
+    this_month = months[0].strftime("%Y-%m")
+    requests = [
+        {"name": "POST /login", "method": "POST", "path": "/login",
+         "form": {"username": username, "password": password}, "expect": 302},
+        {"name": "GET /myexpenses", "method": "GET", "path": "/myexpenses/"},
+    ]
+    for month in months:
+        for page in ("myexpenses", "myspending", "myincome"):
+            requests.append({"name": "GET /" + page, "method": "GET", "path": "/{}/{}".format(page, month.isoformat())})
+    requests.append({"name": "GET /dashboard", "method": "GET",
+        "path": "/dashboard?from={}&to={}".format(months[-1].strftime("%Y-%m"), this_month)})
+    for _ in range(rng.randint(1, 3)):
+        requests.append({"name": "POST /addspending", "method": "POST", "path": "/addspending", "form": {
+            "name": rng.choice(["Coffee", "Groceries", "Gas", "Lunch", "Movie"]),
+            "amount": "{:.2f}".format(rng.randint(100, 10000) / 100),
+            "date": months[0].replace(day=rng.randint(1, 28)).isoformat(),
+            "category": rng.choice(["food", "fun", "bills"]),
+            "linkedExpense": "",
+        }})
+    requests += [
+        {"name": "POST /api/spending", "method": "POST", "path": "/api/spending?month=" + this_month,
+         "json": {"name": "Snack", "amount": "3.50", "date": months[0].isoformat()}, "save": "added"},
+        {"name": "DELETE /api/spending", "method": "DELETE", "path": "/api/spending?month={}&id={{added}}".format(this_month)},
+        {"name": "POST /importcsv", "method": "POST", "path": "/importcsv", "headers": {"Accept": "application/json"},
+         "form": {"tablename": "spending"},
+         "files": {"csvfile": {"filename": "import.csv", "content": import_csv(args.import_rows, months[0], rng)}}},
+        {"name": "GET /api/spending", "method": "GET", "path": "/api/spending?month=" + this_month, "save": "newest"},
+        {"name": "DELETE /api/spending", "method": "DELETE", "path": "/api/spending?month={}&id={{newest}}".format(this_month)},
+        {"name": "GET /logout", "method": "GET", "path": "/logout"},
+    ]
+    return requests
+
+# sessions of a trace file as lists of requests, in the order they first appear
+def read_trace(path):
+    sessions = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                req = json.loads(line)
+                sessions.setdefault(req["session"], []).append(req)
+    return list(sessions.values())
+
+# the usernames the sessions of a trace log in with
+def trace_usernames(sessions):
+    return sorted({req["form"]["username"] for session in sessions for req in session
+        if req["path"] == "/login" and "username" in req.get("form", {})})
+
+
+########################################
+## Running                            ##
+########################################
+
+"""
+What one level measured, filled in by every user thread.
+"""
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {} # request name -> [seconds]
+        self.errors = {} # request name -> count
+        self.skipped = 0
+        self.sessions = 0
+        self.samples = [] # a few error descriptions
+
+    def add(self, name, seconds, error=None):
+        with self._lock:
+            self.timings.setdefault(name, []).append(seconds)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                if len(self.samples) < 10:
+                    self.samples.append("{}: {}".format(name, error))
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+# nearest rank percentile of an already sorted list
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def summarize(timings, errors, seconds):
+    timings = sorted(timings)
+    if not timings:
+        return {"requests": 0, "errors": 0}
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "error_rate": round(errors / len(timings), 4),
+        "throughput": round(len(timings) / seconds, 2),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 2),
+        "p50_ms": round(percentile(timings, 50) * 1000, 2),
+        "p95_ms": round(percentile(timings, 95) * 1000, 2),
+        "p99_ms": round(percentile(timings, 99) * 1000, 2),
+        "max_ms": round(timings[-1] * 1000, 2),
+    }
+
+"""
+Writes the sessions played to a trace file, one request per line.
+"""
+class Recorder:
+    def __init__(self, path):
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def new_session(self):
+        with self._lock:
+            self._next += 1
+            return self._next
+
+    def write(self, session, at, req):
+        line = json.dumps(dict(req, session=session, at=round(at, 3)))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+def play(client, session, results, deadline, args, rng, recorder=None):
+    '''
+        send the requests of one session in order, stopping at the deadline.
+        Recorded sessions wait for their "at", generated ones for a random
+        think time. returns False when the deadline cut the session short
+    '''
+    started = time.perf_counter()
+    saved = {}
+    number = recorder.new_session() if recorder else None
+    for (i, req) in enumerate(session):
+        if "at" in req:
+            if args.speed > 0:
+                time.sleep(max(0, started + req["at"] / args.speed - time.perf_counter()))
+        elif i and args.think > 0:
+            time.sleep(rng.uniform(0, 2 * args.think))
+        if time.perf_counter() >= deadline:
+            return False
+        if recorder:
+            recorder.write(number, time.perf_counter() - started, req)
+        try:
+            path = req["path"].format_map(saved) if "{" in req["path"] else req["path"]
+        except KeyError:
+            # the answer the id was meant to come from had none
+            results.count("skipped")
+            continue
+        (body, content_type) = encode_body(req)
+        headers = dict(req.get("headers", {}))
+        if content_type:
+            headers["Content-Type"] = content_type
+        start = time.perf_counter()
+        try:
+            (status, location, data) = client.request(req["method"], path, body, headers)
+        except Exception as e:
+            results.add(req["name"], time.perf_counter() - start, "{}: {}".format(type(e).__name__, e))
+            continue
+        seconds = time.perf_counter() - start
+        results.add(req["name"], seconds, "answered {}".format(status) if failed(req, status, location) else None)
+        if "save" in req:
+            try:
+                saved[req["save"]] = json.loads(data)["rows"][0]["id"]
+            except (ValueError, KeyError, IndexError, TypeError):
+                saved.pop(req["save"], None)
+    results.count("sessions")
+    return True
+
+# make sure every account exists, sign ups that find the name taken are fine
+def create_users(url, usernames, password, timeout):
+    client = Client(url, timeout)
+    for username in usernames:
+        while True:
+            (status, _, _) = client.request("POST", "/newuser", urllib.parse.urlencode(
+                {"username": username, "password": password}).encode(), {"Content-Type": "application/x-www-form-urlencoded"})
+            if status != 429:
+                break
+            # too many passwords being hashed at once
+            time.sleep(1)
+        client.cookies.clear()
+    client.close()
+
+def run_level(users, args, sessions=None, recorder=None):
+    '''
+        run users simulated users for args.duration seconds. With sessions
+        (a replay), user n plays sessions n, n + users, ... over and over,
+        otherwise each user plays generated sessions as <prefix>-<n>
+    '''
+    results = Results()
+    deadline = time.perf_counter() + args.duration
+
+    def user(n):
+        rng = random.Random("{}-{}-{}".format(args.seed, users, n))
+        client = Client(args.url, args.timeout)
+        mine = sessions[n % len(sessions)::users] if sessions else None
+        played = 0
+        try:
+            while time.perf_counter() < deadline:
+                if mine:
+                    session = mine[played % len(mine)]
+                else:
+                    session = session_requests("{}-{}".format(args.user_prefix, n), args.password, args, rng)
+                play(client, session, results, deadline, args, rng, recorder)
+                played += 1
+        finally:
+            client.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    all_timings = [t for timings in results.timings.values() for t in timings]
+    summary = summarize(all_timings, sum(results.errors.values()), seconds)
+    summary.update({
+        "users": users,
+        "seconds": round(seconds, 2),
+        "sessions": results.sessions,
+        "skipped": results.skipped,
+        "error_samples": results.samples,
+        "requests_by_name": {
+            name: summarize(timings, results.errors.get(name, 0), seconds)
+            for (name, timings) in sorted(results.timings.items())
+        },
+    })
+    print("{:>4} users  {:>8.1f} req/s  p50 {:>8.1f}ms  p95 {:>8.1f}ms  p99 {:>8.1f}ms  errors {:>6.2%}  ({} requests, {} sessions)".format(
+        users, summary.get("throughput", 0), summary.get("p50_ms", 0), summary.get("p95_ms", 0), summary.get("p99_ms", 0),
+        summary.get("error_rate", 0), summary["requests"], results.sessions), file=sys.stderr)
+    for sample in results.samples[:3]:
+        print("      {}".format(sample), file=sys.stderr)
+    return summary
+
+def run(args):
+    levels = [int(level) for level in args.levels.split(",")]
+    sessions = read_trace(args.replay) if args.replay else None
+    if sessions is not None and not sessions:
+        sys.exit("{} holds no requests".format(args.replay))
+    usernames = trace_usernames(sessions) if sessions else ["{}-{}".format(args.user_prefix, n) for n in range(max(levels))]
+    print("creating {} accounts".format(len(usernames)), file=sys.stderr)
+    try:
+        create_users(args.url, usernames, args.password, args.timeout)
+    except OSError as e:
+        sys.exit("can not reach {}: {}".format(args.url, e))
+
+    recorder = Recorder(args.record) if args.record else None
+    try:
+        results = [run_level(users, args, sessions, recorder) for users in levels]
+    finally:
+        if recorder:
+            recorder.close()
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for (key, value) in vars(args).items() if key not in ("output", "password")},
+        "levels": results,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    report = run(args)
+    output = args.output or "loadtest-{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S"))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to {}".format(output), file=sys.stderr)
@@ -0,0 +1,103 @@
+"""
+Logging setup for the app. Call setup_logging() once per process, before the
+Flask app is created, and log through logging.getLogger(__name__).
+
+Records are put on a queue by the thread that logs them and written to stderr
+by a background thread, so a request never waits on the terminal or a log
+collector. When the writer falls behind and the queue is full, records are
+dropped and counted instead of blocking. Configured with:
+
+    LOG_LEVEL   level for everything, default INFO
+    LOG_LEVELS  per-module levels, e.g. "db=DEBUG,instrument=WARNING"
+    LOG_FORMAT  logging format string
+
+Pass arguments to the logger instead of formatting the message yourself
+(log.debug("inserted %s", record)), then a record below the level costs a
+level check and nothing else.
+"""
+import os
+import sys
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+# records waiting for the writer thread, beyond this they are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+
+"""
+QueueHandler that drops records instead of blocking when the queue is full.
+"""
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        QueueHandler.__init__(self, log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+_pid = None
+_lock = threading.Lock()
+
+# parse "db=DEBUG,instrument=WARNING" into {"db": "DEBUG", "instrument": "WARNING"}
+def parse_levels(value):
+    levels = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        (name, _, level) = item.partition("=")
+        if not level.strip():
+            raise ValueError("LOG_LEVELS entry {!r} is not module=LEVEL".format(item))
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+# route the root logger through the queue and start the writer thread. Safe to
+# call again, a forked worker gets a writer of its own
+def setup_logging():
+    global _handler, _listener, _pid
+    with _lock:
+        if _pid == os.getpid():
+            return _handler
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler = DroppingQueueHandler(log_queue)
+
+        root = logging.getLogger()
+        if _handler is not None:
+            root.removeHandler(_handler)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        for (name, level) in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        # a listener inherited through fork has no thread behind it, only start ours
+        listener = QueueListener(log_queue, output, respect_handler_level=True)
+        listener.start()
+        if _pid is None:
+            atexit.register(stop_logging)
+        (_handler, _listener, _pid) = (handler, listener, os.getpid())
+        return handler
+
+# write out whatever is still queued, called at exit
+def stop_logging():
+    global _listener
+    with _lock:
+        if _listener is not None and _pid == os.getpid():
+            _listener.stop()
+        _listener = None
+
+# records dropped because the queue was full, for /metrics
+def dropped():
+    return _handler.dropped if _handler is not None else 0
@@ -0,0 +1,206 @@
+"""
+Versioned schema migrations.
+
+Every file in migrations/ named <version>_<name>.sql is applied once, in
+version order, each in its own transaction, and recorded in the
+schema_migrations table. On SQLite a <version>_<name>.sqlite.sql file next
+to it is run instead when there is one. Usage:
+
+    python migrate.py                  apply every pending migration
+    python migrate.py status           list applied and pending migrations
+    python migrate.py explain <user>   EXPLAIN the page queries for a user
+"""
+import os
+import re
+import sys
+import datetime
+from backends import (backend_for, execute_values, SQLiteBackend)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+# (version, name, path) for every migration file, oldest first
+def available_migrations():
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r"^(\d+)_(\w+)\.sql$", filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+def ensure_migrations_table(conn):
+    c = conn.cursor()
+    c.execute(
+        '''
+        create table if not exists schema_migrations (
+            version INT PRIMARY KEY NOT NULL,
+            name varchar(100) NOT NULL,
+            applied_at timestamp DEFAULT CURRENT_TIMESTAMP
+        );
+        '''
+    )
+    c.close()
+    conn.commit()
+
+def applied_versions(conn):
+    ensure_migrations_table(conn)
+    c = conn.cursor()
+    c.execute("select version from schema_migrations")
+    versions = {row[0] for row in c.fetchall()}
+    c.close()
+    return versions
+
+# the file to run for a migration on conn's backend
+def migration_file(conn, path):
+    if backend_for(conn).name == SQLiteBackend.name:
+        variant = path[:-len(".sql")] + ".sqlite.sql"
+        if os.path.exists(variant):
+            return variant
+    return path
+
+# apply every migration that has not run yet, returns the versions applied
+def migrate(conn):
+    done = applied_versions(conn)
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    applied = []
+    try:
+        for version, name, path in available_migrations():
+            if version in done:
+                continue
+            with open(migration_file(conn, path), "r") as f:
+                sql = f.read()
+            c = conn.cursor()
+            try:
+                c.execute(sql)
+                c.execute("insert into schema_migrations (version, name) values (%s, %s)", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                c.close()
+            print("applied migration {} {}".format(version, name))
+            applied.append(version)
+    finally:
+        conn.autocommit = autocommit
+    return applied
+
+# mark every migration as applied without running it. schema.sql always
+# describes the latest schema, so a freshly created database is stamped
+def stamp(conn):
+    ensure_migrations_table(conn)
+    c = conn.cursor()
+    for version, name, _ in available_migrations():
+        c.execute(
+            "insert into schema_migrations (version, name) values (%s, %s) on conflict (version) do nothing",
+            (version, name)
+        )
+    c.close()
+    conn.commit()
+
+
+########################################
+## Query plans                        ##
+########################################
+
+"""
+Wraps a connection and remembers every statement run through its cursors,
+so the page queries can be EXPLAINed exactly as DB issues them.
+"""
+class RecordingConnection:
+    def __init__(self, connection):
+        self.conn = connection
+        self.statements = []
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self, self.conn.cursor(*args, **kwargs))
+
+    # DB.transaction switches autocommit, which has to reach the real connection
+    @property
+    def autocommit(self):
+        return self.conn.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self.conn.autocommit = value
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class RecordingCursor:
+    def __init__(self, recorder, cursor):
+        self.recorder = recorder
+        self.cursor = cursor
+
+    def execute(self, query, params=None):
+        self.recorder.statements.append((query, params))
+        return self.cursor.execute(query, params)
+
+    def execute_values(self, sql, argslist, page_size=100, fetch=False):
+        # one statement per page of rows
+        self.recorder.statements += [(sql, None)] * max(1, -(-len(argslist) // page_size))
+        return execute_values(self.cursor, sql, argslist, page_size, fetch)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+# run every my* page for a user and EXPLAIN each select it issued with the
+# backend's planner. Returns [(page, query, plan, uses_index)]
+def explain_pages(conn, user_id, target_date=None):
+    from db import DB
+    if target_date is None:
+        target_date = datetime.date.today()
+    pages = [
+        ("myexpenses", lambda db: db.myexpenses(user_id, target_date)),
+        ("myspending", lambda db: db.myspending(user_id, target_date)),
+        ("myincome", lambda db: db.myincome(user_id, target_date)),
+        ("mygoals", lambda db: db.mygoals(user_id)),
+        ("mydebt", lambda db: db.mydebt(user_id)),
+        ("search", lambda db: db.search(user_id, "a")),
+    ]
+    backend = backend_for(conn)
+    report = []
+    c = conn.cursor()
+    for page, run in pages:
+        recorder = RecordingConnection(conn)
+        run(DB(recorder))
+        for query, params in recorder.statements:
+            if not query.lstrip().lower().startswith("select"):
+                continue
+            (plan, uses_index) = backend.explain(c, query, params)
+            report.append((page, " ".join(query.split()), plan, uses_index))
+    c.close()
+    return report
+
+
+if __name__ == "__main__":
+    from pool import get_pool
+    conn = get_pool().getconn()
+    try:
+        command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+        if command == "migrate":
+            if not migrate(conn):
+                print("database is up to date")
+        elif command == "status":
+            done = applied_versions(conn)
+            for version, name, _ in available_migrations():
+                print("{:>4} {:<40} {}".format(version, name, "applied" if version in done else "pending"))
+        elif command == "explain":
+            from db import DB
+            user_id = DB(conn).get_user_id(sys.argv[2])
+            failed = 0
+            for page, query, plan, uses_index in explain_pages(conn, user_id):
+                print("{} {}: {}".format("ok  " if uses_index else "SCAN", page, query))
+                if not uses_index:
+                    failed += 1
+                    print(plan)
+            sys.exit(1 if failed else 0)
+        else:
+            print(__doc__)
+            sys.exit(2)
+    finally:
+        get_pool().putconn(conn)
@@ -0,0 +1,8 @@
+-- Indexes for the per user, per date range lookups every page makes
+CREATE INDEX IF NOT EXISTS spending_user_date_idx ON spending (user_id, date);
+CREATE INDEX IF NOT EXISTS spending_user_expense_date_idx ON spending (user_id, expense_name, date);
+CREATE INDEX IF NOT EXISTS income_user_date_idx ON income (user_id, date);
+CREATE INDEX IF NOT EXISTS expenses_user_due_date_idx ON expenses (user_id, due_date);
+CREATE INDEX IF NOT EXISTS goals_user_target_date_idx ON goals (user_id, target_date);
+CREATE INDEX IF NOT EXISTS debt_user_target_date_idx ON debt (user_id, target_date);
+CREATE INDEX IF NOT EXISTS users_username_idx ON users (username);
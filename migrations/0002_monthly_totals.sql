@@ -0,0 +1,27 @@
+-- Per user, per month totals for every table, kept up to date by the write paths
+CREATE TABLE monthly_totals (
+    user_id INT NOT NULL,
+    table_name varchar(25) NOT NULL,
+    month DATE NOT NULL,
+    name varchar(100) NOT NULL DEFAULT '',
+    total NUMERIC(14,2) NOT NULL DEFAULT 0,
+    row_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, table_name, month, name),
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+INSERT INTO monthly_totals (user_id, table_name, month, name, total, row_count)
+SELECT user_id, 'spending', date_trunc('month', date)::date, coalesce(expense_name, ''), sum(amount::numeric), count(*)
+FROM spending GROUP BY 1, 2, 3, 4;
+INSERT INTO monthly_totals (user_id, table_name, month, name, total, row_count)
+SELECT user_id, 'expenses', date_trunc('month', due_date)::date, '', sum(expected::numeric), count(*)
+FROM expenses GROUP BY 1, 2, 3, 4;
+INSERT INTO monthly_totals (user_id, table_name, month, name, total, row_count)
+SELECT user_id, 'income', date_trunc('month', date)::date, '', sum(amount::numeric), count(*)
+FROM income GROUP BY 1, 2, 3, 4;
+INSERT INTO monthly_totals (user_id, table_name, month, name, total, row_count)
+SELECT user_id, 'goals', date_trunc('month', coalesce(target_date, date '1900-01-01'))::date, '', sum(target::numeric), count(*)
+FROM goals GROUP BY 1, 2, 3, 4;
+INSERT INTO monthly_totals (user_id, table_name, month, name, total, row_count)
+SELECT user_id, 'debt', date_trunc('month', coalesce(target_date, date '1900-01-01'))::date, '', sum(amount::numeric), count(*)
+FROM debt GROUP BY 1, 2, 3, 4;
@@ -0,0 +1,2 @@
+-- Bumped by every write to the user's records, pages use it as their ETag
+ALTER TABLE users ADD COLUMN data_version BIGINT NOT NULL DEFAULT 0;
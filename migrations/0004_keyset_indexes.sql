@@ -0,0 +1,6 @@
+-- The spending and income lists page on (date, id), these indexes serve
+-- that order directly and cover every lookup the (user_id, date) ones did
+CREATE INDEX IF NOT EXISTS spending_user_date_id_idx ON spending (user_id, date, spending_id);
+DROP INDEX IF EXISTS spending_user_date_idx;
+CREATE INDEX IF NOT EXISTS income_user_date_id_idx ON income (user_id, date, income_id);
+DROP INDEX IF EXISTS income_user_date_idx;
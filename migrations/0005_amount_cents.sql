@@ -0,0 +1,10 @@
+-- Amounts are stored as integer cents instead of MONEY, whose text form and
+-- arithmetic depend on the server's lc_monetary setting
+ALTER TABLE expenses ALTER COLUMN expected TYPE BIGINT USING round(expected::numeric * 100)::bigint;
+ALTER TABLE goals
+    ALTER COLUMN target TYPE BIGINT USING round(target::numeric * 100)::bigint,
+    ALTER COLUMN amount TYPE BIGINT USING round(amount::numeric * 100)::bigint;
+ALTER TABLE debt ALTER COLUMN amount TYPE BIGINT USING round(amount::numeric * 100)::bigint;
+ALTER TABLE income ALTER COLUMN amount TYPE BIGINT USING round(amount::numeric * 100)::bigint;
+ALTER TABLE spending ALTER COLUMN amount TYPE BIGINT USING round(amount::numeric * 100)::bigint;
+ALTER TABLE monthly_totals ALTER COLUMN total TYPE BIGINT USING round(total * 100)::bigint;
@@ -0,0 +1,8 @@
+-- Amounts are stored as integer cents. SQLite cannot change a column's type,
+-- the MONEY columns of older files keep their declared type but hold integers
+UPDATE expenses SET expected = cast(round(expected * 100) as integer);
+UPDATE goals SET target = cast(round(target * 100) as integer), amount = cast(round(amount * 100) as integer);
+UPDATE debt SET amount = cast(round(amount * 100) as integer);
+UPDATE income SET amount = cast(round(amount * 100) as integer);
+UPDATE spending SET amount = cast(round(amount * 100) as integer);
+UPDATE monthly_totals SET total = cast(round(total * 100) as integer);
@@ -0,0 +1,11 @@
+-- Recurring expenses repeat every repeat_interval days, weeks, months or years
+-- (repeat_type) up to last_due, see recurrence.py. One time expenses have
+-- last_due = due_date, so a date range is one index range for every expense
+ALTER TABLE expenses ADD COLUMN repeat_interval INT NOT NULL DEFAULT 1;
+ALTER TABLE expenses ADD COLUMN last_due DATE NOT NULL DEFAULT '9999-12-31';
+UPDATE expenses SET repeat_type = lower(trim(repeat_type));
+UPDATE expenses SET repeat_type = 'weekly', repeat_interval = 2 WHERE repeat_type = 'biweekly';
+UPDATE expenses SET repeat_type = 'monthly', repeat_interval = 3 WHERE repeat_type = 'quarterly';
+UPDATE expenses SET repeat_type = 'onetime' WHERE repeat_type NOT IN ('daily', 'weekly', 'monthly', 'yearly');
+UPDATE expenses SET last_due = due_date WHERE repeat_type = 'onetime';
+CREATE INDEX IF NOT EXISTS expenses_user_last_due_idx ON expenses (user_id, last_due, due_date);
@@ -0,0 +1,12 @@
+-- Full text search over every record's names, categories, owners and notes,
+-- DB.search matches these expressions (backends.search_vector) word by word
+CREATE INDEX IF NOT EXISTS spending_search_idx ON spending USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(category, '') || ' ' || coalesce(expense_name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX IF NOT EXISTS income_search_idx ON income USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(type, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX IF NOT EXISTS expenses_search_idx ON expenses USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX IF NOT EXISTS goals_search_idx ON goals USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX IF NOT EXISTS debt_search_idx ON debt USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
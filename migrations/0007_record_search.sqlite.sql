@@ -0,0 +1,63 @@
+-- Full text search over every record's names, categories, owners and notes.
+-- record_search holds one row per record under rowid <record id> * 8 + <table
+-- code>, kept up to date by triggers, see SQLiteBackend.search
+CREATE VIRTUAL TABLE IF NOT EXISTS record_search USING fts5(
+    name, category, expense_name, owner, notes,
+    user_id UNINDEXED, table_name UNINDEXED, record_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+CREATE TRIGGER IF NOT EXISTS spending_search_insert AFTER INSERT ON spending BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.spending_id * 8 + 1, new.name, new.category, new.expense_name, new.owner, new.notes, new.user_id, 'spending', new.spending_id);
+END;
+CREATE TRIGGER IF NOT EXISTS spending_search_update AFTER UPDATE ON spending BEGIN
+    DELETE FROM record_search WHERE rowid = old.spending_id * 8 + 1;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.spending_id * 8 + 1, new.name, new.category, new.expense_name, new.owner, new.notes, new.user_id, 'spending', new.spending_id);
+END;
+CREATE TRIGGER IF NOT EXISTS spending_search_delete AFTER DELETE ON spending BEGIN
+    DELETE FROM record_search WHERE rowid = old.spending_id * 8 + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS income_search_insert AFTER INSERT ON income BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.income_id * 8 + 2, new.name, new.type, NULL, new.owner, new.notes, new.user_id, 'income', new.income_id);
+END;
+CREATE TRIGGER IF NOT EXISTS income_search_update AFTER UPDATE ON income BEGIN
+    DELETE FROM record_search WHERE rowid = old.income_id * 8 + 2;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.income_id * 8 + 2, new.name, new.type, NULL, new.owner, new.notes, new.user_id, 'income', new.income_id);
+END;
+CREATE TRIGGER IF NOT EXISTS income_search_delete AFTER DELETE ON income BEGIN
+    DELETE FROM record_search WHERE rowid = old.income_id * 8 + 2;
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_search_insert AFTER INSERT ON expenses BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.expense_id * 8 + 3, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'expenses', new.expense_id);
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_search_update AFTER UPDATE ON expenses BEGIN
+    DELETE FROM record_search WHERE rowid = old.expense_id * 8 + 3;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.expense_id * 8 + 3, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'expenses', new.expense_id);
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_search_delete AFTER DELETE ON expenses BEGIN
+    DELETE FROM record_search WHERE rowid = old.expense_id * 8 + 3;
+END;
+CREATE TRIGGER IF NOT EXISTS goals_search_insert AFTER INSERT ON goals BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.goal_id * 8 + 4, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'goals', new.goal_id);
+END;
+CREATE TRIGGER IF NOT EXISTS goals_search_update AFTER UPDATE ON goals BEGIN
+    DELETE FROM record_search WHERE rowid = old.goal_id * 8 + 4;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.goal_id * 8 + 4, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'goals', new.goal_id);
+END;
+CREATE TRIGGER IF NOT EXISTS goals_search_delete AFTER DELETE ON goals BEGIN
+    DELETE FROM record_search WHERE rowid = old.goal_id * 8 + 4;
+END;
+CREATE TRIGGER IF NOT EXISTS debt_search_insert AFTER INSERT ON debt BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.debt_id * 8 + 5, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'debt', new.debt_id);
+END;
+CREATE TRIGGER IF NOT EXISTS debt_search_update AFTER UPDATE ON debt BEGIN
+    DELETE FROM record_search WHERE rowid = old.debt_id * 8 + 5;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.debt_id * 8 + 5, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'debt', new.debt_id);
+END;
+CREATE TRIGGER IF NOT EXISTS debt_search_delete AFTER DELETE ON debt BEGIN
+    DELETE FROM record_search WHERE rowid = old.debt_id * 8 + 5;
+END;
+INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) SELECT spending_id * 8 + 1, name, category, expense_name, owner, notes, user_id, 'spending', spending_id FROM spending;
+INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) SELECT income_id * 8 + 2, name, type, NULL, owner, notes, user_id, 'income', income_id FROM income;
+INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) SELECT expense_id * 8 + 3, name, NULL, NULL, owner, notes, user_id, 'expenses', expense_id FROM expenses;
+INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) SELECT goal_id * 8 + 4, name, NULL, NULL, owner, notes, user_id, 'goals', goal_id FROM goals;
+INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) SELECT debt_id * 8 + 5, name, NULL, NULL, owner, notes, user_id, 'debt', debt_id FROM debt;
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from backends import (backend_from_url, TRANSACTION_STATUS_IDLE)
+
+
+# Error class for when no connection could be checked out in time
+class PoolExhausted(Exception):
+    def __init__(self, message=None):
+        Exception.__init__(self)
+        if message:
+            self.message = message
+        else:
+            self.message = "No database connection available"
+
+    def to_dict(self):
+        rv = dict()
+        rv["message"] = self.message
+        return rv
+
+
+"""
+A bounded, thread safe pool of database connections for one process.
+Connections are opened lazily up to maxconn, checked for health when they
+are handed out and returned to the pool at the end of each request.
+"""
+class ConnectionPool:
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=10.0, check_after=30.0, backend=None):
+        self.connect = connect
+        self.backend = backend
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        # connections idle for longer than this are pinged before reuse
+        self.check_after = check_after
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = [] # (connection, time it was returned)
+        self._in_use = 0
+        self._closed = False
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._discarded = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.monotonic()))
+
+    # both run outside the lock in getconn, the counters are still only
+    # touched under it. the condition's lock is reentrant, putconn and
+    # closeall already hold it when they discard
+    def _open(self):
+        conn = self.connect()
+        with self._cond:
+            self._created += 1
+        return conn
+
+    # a connection is healthy if it is still open, and if it sat
+    # idle for a while, it also has to answer a trivial query
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_after:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("select 1")
+            c.close()
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # with wait=False, returns None at once instead of waiting for a connection
+    def getconn(self, wait=True):
+        start = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolExhausted("connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.maxconn:
+                    # reserve the slot now and open the connection below
+                    self._in_use += 1
+                    conn = None
+                    break
+                if not wait:
+                    return None
+                if start is None:
+                    start = time.monotonic()
+                    self._waits += 1
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    self._wait_time += time.monotonic() - start
+                    raise PoolExhausted("timed out waiting for a database connection")
+            if start is not None:
+                self._wait_time += time.monotonic() - start
+
+        try:
+            if conn is not None and not self._healthy(conn, idle_since):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        # never hand a connection in the middle of a transaction to the next request
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pid": self.pid,
+                "backend": self.backend.name if self.backend else None,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max": self.maxconn,
+                "created": self._created,
+                "discarded": self._discarded,
+                "waits": self._waits,
+                "wait_time": round(self._wait_time, 6),
+            }
+
+
+########################################
+## Process wide pool                  ##
+########################################
+
+# connection settings come from the environment. DATABASE_URL is what heroku
+# sets and picks the backend, see backends.py
+def pool_from_env():
+    backend = backend_from_url(os.environ.get("DATABASE_URL", ""))
+    return ConnectionPool(
+        backend.connect,
+        backend=backend,
+        minconn=int(os.environ.get("DB_POOL_MIN", 0)),
+        maxconn=int(os.environ.get("DB_POOL_MAX", 5)),
+        timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        check_after=float(os.environ.get("DB_POOL_CHECK_AFTER", 30)),
+    )
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# returns the pool for the current process. A pool inherited from a parent
+# process across fork() is never used, its sockets belong to the parent
+def get_pool():
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = pool_from_env()
+        return _pool
+
+# throw away whatever pool was inherited and build a new one, called from
+# the gunicorn post_fork hook so every worker starts with its own connections
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+    return get_pool()
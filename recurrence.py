@@ -0,0 +1,111 @@
+"""
+Recurring expenses. An expense is stored once with its first due date, a
+repeat unit (onetime, daily, weekly, monthly or yearly), an interval (every
+2 weeks is weekly with interval 2) and last_due, the last day it can fall on:
+the due date itself for one time expenses, FOREVER when it never stops.
+
+Occurrences in a date range are worked out here instead of being stored, so
+the only rows a month view reads are those with due_date < end and
+last_due >= start, which the (user_id, last_due, due_date) index finds.
+Monthly and yearly occurrences keep the first due date's day and fall on the
+last day of shorter months (the 31st becomes the 30th in April and the 28th
+or 29th in February), without drifting in the months after.
+"""
+import calendar
+from datetime import date, timedelta
+from functools import lru_cache
+
+REPEAT_UNITS = ("onetime", "daily", "weekly", "monthly", "yearly")
+# names the forms and csv files use for common intervals, as (unit, interval)
+REPEAT_ALIASES = {
+    "": ("onetime", 1),
+    "none": ("onetime", 1),
+    "once": ("onetime", 1),
+    "biweekly": ("weekly", 2),
+    "quarterly": ("monthly", 3),
+    "annually": ("yearly", 1),
+    "annual": ("yearly", 1),
+}
+# last_due of an expense that repeats without end
+FOREVER = date(9999, 12, 31)
+# expansions kept by occurrences(), they are small tuples of dates
+SCHEDULE_CACHE_SIZE = 4096
+
+
+# normalize a repeat type and interval from a form or csv row into (unit, interval),
+# "biweekly" becomes ("weekly", 2). Raises ValueError for anything else
+def parse_repeat(repeat_type, interval=None):
+    repeat_type = (repeat_type or "").strip().lower()
+    if repeat_type in REPEAT_ALIASES:
+        (unit, every) = REPEAT_ALIASES[repeat_type]
+    elif repeat_type in REPEAT_UNITS:
+        (unit, every) = (repeat_type, 1)
+    else:
+        raise ValueError("unknown repeat type {!r}".format(repeat_type))
+    interval = str(interval or "").strip()
+    if interval:
+        if not interval.isdigit() or int(interval) < 1:
+            raise ValueError("repeat interval must be a whole number of at least 1")
+        every *= int(interval)
+    if unit == "onetime":
+        every = 1
+    return (unit, every)
+
+# how a schedule is shown, the alias when there is one: ("weekly", 2) is "biweekly"
+def repeat_label(unit, interval):
+    if interval == 1 or unit == "onetime":
+        return unit
+    for (alias, schedule) in REPEAT_ALIASES.items():
+        if schedule == (unit, interval) and alias.endswith("ly"):
+            return alias
+    return "every {} {}".format(interval, {"daily": "days", "weekly": "weeks", "monthly": "months", "yearly": "years"}[unit])
+
+# the last_due column for an expense first due on due_date, until is the
+# optional date it stops repeating on
+def last_due(due_date, unit, until=None):
+    if unit == "onetime":
+        return due_date
+    if until is None:
+        return FOREVER
+    if until < due_date:
+        raise ValueError("an expense can not stop repeating before it is first due")
+    return until
+
+# the day months after year/month, on day or the month's last day when it is shorter
+def add_months(year, month, months, day):
+    (year, month) = divmod(year * 12 + month - 1 + months, 12)
+    month += 1
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+# the dates an expense falls on from start up to but not including end, as a tuple.
+# Memoized, every argument is part of the key so nothing ever has to be invalidated
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def occurrences(due_date, unit, interval, last, start, end):
+    if last < end:
+        end = last + timedelta(days=1)
+    if due_date >= end:
+        return ()
+    if unit == "onetime":
+        return (due_date,) if due_date >= start else ()
+    if unit in ("daily", "weekly"):
+        step = interval * (7 if unit == "weekly" else 1)
+        # the first step on or after start
+        skip = max(0, -(-(start - due_date).days // step))
+        day = due_date + timedelta(days=skip * step)
+        dates = []
+        while day < end:
+            dates.append(day)
+            day += timedelta(days=step)
+        return tuple(dates)
+    months = interval * (12 if unit == "yearly" else 1)
+    # the last step in or before start's month, earlier ones end before start
+    elapsed = (start.year - due_date.year) * 12 + start.month - due_date.month
+    k = max(0, elapsed // months)
+    dates = []
+    while True:
+        day = add_months(due_date.year, due_date.month, k * months, due_date.day)
+        if day >= end:
+            return tuple(dates)
+        if day >= start:
+            dates.append(day)
+        k += 1
@@ -0,0 +1,30 @@
+"""
+Maintenance for the monthly_totals rollup. Usage:
+
+    python rollup.py rebuild [username]   recompute the totals from the raw rows
+    python rollup.py check [username]     list totals that disagree with the raw rows
+"""
+import sys
+from db import DB
+from pool import get_pool
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "check"):
+        print(__doc__)
+        sys.exit(2)
+    conn = get_pool().getconn()
+    try:
+        db = DB(conn)
+        user_id = db.get_user_id(sys.argv[2]) if len(sys.argv) > 2 else None
+        if sys.argv[1] == "rebuild":
+            db.rebuild_rollups(user_id)
+            print("monthly totals rebuilt")
+        else:
+            mismatches = db.check_rollups(user_id)
+            for (uid, table_name, month, name, total, actual, count, actual_count) in mismatches:
+                print("user {} {} {} {!r}: rollup {} ({} rows), actual {} ({} rows)".format(
+                    uid, table_name, month, name, total, count, actual, actual_count))
+            print("{} mismatched totals".format(len(mismatches)))
+            sys.exit(1 if mismatches else 0)
+    finally:
+        get_pool().putconn(conn)
@@ -56,6 +56,10 @@ $(document).ready(function () {
         "click",
         show_add_buttons
     );
+    $(".btn-more").on(
+        "click",
+        show_more
+    );
     $(".tablenav").on(
         "click",
         setactivetable
@@ -115,6 +119,132 @@ const request = ( url, params = {}, method = 'GET' ) => {
 const get = ( url, params ) => request( url, params, 'GET' );
 const post = ( url, params ) => request( url, params, 'POST' );
 
+// JSON API logic, patches the page in place instead of reloading it
+// cells shown for each table's rows, in the order the templates render them
+const table_cells = {
+    spending: ["id", "date", "name", "amount", "expense_name", "category", "owner"],
+    income: ["id", "date", "name", "amount", "type", "owner"],
+    goals: ["id", "date", "name", "target", "owner"],
+    debt: ["id", "date", "name", "amount", "owner"],
+};
+// cells holding amounts, which the API sends as integer cents
+const money_cells = new Set(["amount", "expected", "target", "spent"]);
+const form_tables = {
+    addspending: "spending",
+    addexpense: "expenses",
+    addgoal: "goals",
+    adddebt: "debt",
+    addincome: "income",
+};
+
+// the month being viewed as YYYY-MM, taken from the url like the month buttons do
+function current_month() {
+    let thedate = window.location.href.split('/').pop().split('-');
+    let current_date = thedate[1] ? new Date(thedate[0], thedate[1]-1, 1) : new Date();
+    return `${current_date.getFullYear()}-${current_date.getMonth()+1}`;
+}
+
+// integer cents as the templates show them, 123456 -> "$1,234.56"
+function money(cents) {
+    if (cents === null || cents === undefined) {
+        return "";
+    }
+    let dollars = (Math.abs(cents) / 100).toLocaleString("en-US", { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+    return `${cents < 0 ? "-" : ""}$${dollars}`;
+}
+
+const api = ( tablename, method, body, params = {} ) => {
+    params.month = current_month();
+    let url = `/api/${tablename}?` + ( new URLSearchParams( params ) ).toString();
+    return fetch( url, { method, body, headers: { 'Accept': 'application/json' } } )
+        .then( response => response.json().then( data => {
+            if ( !response.ok ) {
+                throw new Error( data.message );
+            }
+            return data;
+        } ) );
+};
+
+function update_totals(tablename, totals) {
+    if (tablename === "expenses") {
+        $(".tr-total td:nth-child(3)").text(money(totals.expected));
+        $(".tr-total td:nth-child(4)").text(money(totals.spent));
+    } else {
+        $(".tr-total td:nth-child(3)").text(money(totals.total));
+    }
+}
+
+// true when a row's MM/DD/YY date falls in the month being viewed
+function in_current_month(row) {
+    if (!row.date) {
+        return false;
+    }
+    let [year, month] = current_month().split('-');
+    let [m, d, y] = row.date.split('/');
+    return parseInt(m) === parseInt(month) && 2000 + parseInt(y) === parseInt(year);
+}
+
+function make_row(tablename, row, rowclass = "tr-data") {
+    let tr = $(`<tr class="${rowclass}"></tr>`);
+    table_cells[tablename].forEach((cell, i) => {
+        let value = money_cells.has(cell) ? money(row[cell]) : row[cell];
+        let td = $('<td></td>').text(value === null ? "" : value);
+        if (i === 0) {
+            td.addClass("rid").css("display", "none");
+        }
+        tr.append(td);
+    });
+    tr.on("contextmenu", row_rightclick);
+    return tr;
+}
+
+function insert_row(tablename, row) {
+    $("main table .tr-headers").first().after(make_row(tablename, row));
+}
+
+function delete_row(tr) {
+    let tablename = document.querySelector(".tablename").innerHTML;
+    let rid = tr.cells[0].innerHTML;
+    let linked_spending = tr.classList.contains("str-data");
+    api(linked_spending ? "spending" : tablename, "DELETE", null, { id: rid })
+        .then(data => {
+            if (linked_spending) {
+                // the spent column of the expense changed as well
+                location.reload();
+                return;
+            }
+            $(`.stc-${rid}`).remove();
+            $(tr).remove();
+            update_totals(tablename, data.totals);
+        })
+        .catch(error => alert(error.message));
+}
+
+function submit_form(event) {
+    event.preventDefault();
+    let form = event.target;
+    let ftype = event.data.type;
+    let tablename = form_tables[ftype];
+    let shown = document.querySelector(".tablename").innerHTML;
+    api(tablename, "POST", new FormData(form))
+        .then(data => {
+            $(".btn-form").attr("disabled", false);
+            $(form).remove();
+            if (tablename !== shown || tablename === "expenses") {
+                // other pages' numbers depend on this record, render them again
+                location.reload();
+                return;
+            }
+            data.rows.forEach(row => {
+                if (tablename === "goals" || tablename === "debt" || in_current_month(row)) {
+                    insert_row(tablename, row);
+                }
+            });
+            update_totals(tablename, data.totals);
+        })
+        .catch(error => alert(error.message));
+}
+
 function setactivetable(event) {
     console.log(event.target);
     event.target.classList.add("tablenav-active");
@@ -135,13 +265,12 @@ function row_rightclick(event) {
             $(this).remove();
         }
     );
-    let rid = event.target.parentElement.cells[0].innerHTML;
+    let row = event.target.parentElement;
     // Delete the row
-    let tablename = document.querySelector(".tablename").innerHTML;
     $(`.rowedit__deleterow`).on(
         "click",
         function() {
-            post("/deleterow", { "rid": rid, "tablename": tablename});
+            delete_row(row);
             $('.rowedit-buttons').remove();
         }
     );
@@ -154,8 +283,13 @@ let rowedit_buttons = `
 function show_spending(event) {
     event.preventDefault();
     let rid = event.target.parentElement.cells[0].innerHTML;
+    let container = $(`.stc-${rid}`);
+    if (container.attr("data-lazy")) {
+        container.removeAttr("data-lazy");
+        load_spending(container);
+    }
 
-    $(`.stc-${rid}`).css("display", "table-cell");
+    container.css("display", "table-cell");
 
     $(".e-data").on(
         "click",
@@ -163,6 +297,58 @@ function show_spending(event) {
     );
 }
 
+// fetch the spending linked to an expense the first time it is opened
+function load_spending(container) {
+    api("spending", "GET", null, { expense: container.attr("data-expense") })
+        .then(data => {
+            if (!data.rows.length) {
+                return;
+            }
+            let table = $(`<table class="tr-even">
+                <tr class="str str-headers">
+                    <th>Date</th>
+                    <th>Name</th>
+                    <th>Amount</th>
+                    <th>Linked Expense</th>
+                    <th>Category</th>
+                    <th>Owner</th>
+                </tr>
+            </table>`);
+            data.rows.forEach(row => {
+                table.append(make_row("spending", row, "str str-data"));
+            });
+            container.append(table);
+        })
+        .catch(error => {
+            container.attr("data-lazy", "true");
+            alert(error.message);
+        });
+}
+
+// append the next page of the spending or income list
+function show_more(event) {
+    let button = $(event.target);
+    let tablename = document.querySelector(".tablename").innerHTML;
+    api(tablename, "GET", null, { after: button.attr("data-after") })
+        .then(data => {
+            data.rows.forEach(row => {
+                let tr = make_row(tablename, row);
+                let total = $("main table .tr-total");
+                if (total.length) {
+                    total.before(tr);
+                } else {
+                    $("main table").first().append(tr);
+                }
+            });
+            if (data.next) {
+                button.attr("data-after", data.next);
+            } else {
+                button.remove();
+            }
+        })
+        .catch(error => alert(error.message));
+}
+
 function hide_spending(event) {
     event.preventDefault();
     let rid = event.target.parentElement.cells[0].innerHTML;
@@ -204,6 +390,9 @@ function append_form(params) {
     $(".btn-form").attr("disabled", true);
     $("body").append(params.data.html);
     $(`.form-${ftype} #name`).focus();
+    if (ftype in form_tables) {
+        $(`.form-${ftype}`).on("submit", { type: ftype }, submit_form);
+    }
     $(`.cancel-${ftype}`).on("click", function() {
         $(".btn-form").attr("disabled", false);
         $(`.form-${ftype}`).remove();
@@ -270,10 +459,16 @@ let form_addexpense = `
             <label for="repeat">Repeats</label>
             <select id="repeat" name="repeat" required>
                 <option value="onetime">One time</option>
+                <option value="weekly">Weekly</option>
                 <option value="biweekly">Biweekly</option>
                 <option value="monthly">Monthly</option>
+                <option value="quarterly">Quarterly</option>
                 <option value="yearly">Yearly</option>
             </select>
+            <label for="interval">Every</label>
+            <input type="number" id="interval" name="interval" min="1" step="1" placeholder="1">
+            <label for="until">Until</label>
+            <input type="date" id="until" name="until">
             <label for="date">Due Date</label>
             <input type="date" id="date" name="date">
             <label for="owner">Owner</label>
@@ -1,4 +1,7 @@
+-- The complete, current schema. Running it wipes the database, existing
+-- databases are brought up to date with migrate.py instead
 -- Clear any existing tables
+DROP TABLE IF EXISTS monthly_totals;
 DROP TABLE IF EXISTS spending;
 DROP TABLE IF EXISTS income;
 DROP TABLE IF EXISTS debt;
@@ -6,20 +9,25 @@ DROP TABLE IF EXISTS goals;
 DROP TABLE IF EXISTS expenses;
 DROP TABLE IF EXISTS users;
 
--- Creating new tables
+-- Creating new tables. Amounts (expected, target, amount, total) are integer cents
 CREATE TABLE users (
     user_id SERIAL PRIMARY KEY NOT NULL,
     username varchar(25) NOT NULL,
     password char(200) NOT NULL,
-    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    -- bumped by every write to the user's records
+    data_version BIGINT NOT NULL DEFAULT 0
 );
 
 CREATE TABLE expenses (
     expense_id SERIAL PRIMARY KEY NOT NULL,
     name varchar(100) NOT NULL,
-    expected MONEY NOT NULL,
+    expected BIGINT NOT NULL,
     due_date DATE NOT NULL,
     repeat_type varchar(25) NOT NULL,
+    -- every repeat_interval days/weeks/months/years up to last_due, see recurrence.py
+    repeat_interval INT NOT NULL DEFAULT 1,
+    last_due DATE NOT NULL DEFAULT '9999-12-31',
     owner varchar(25),
     notes varchar(255),
     created_at timestamp DEFAULT CURRENT_TIMESTAMP,
@@ -31,8 +39,8 @@ CREATE TABLE expenses (
 CREATE TABLE goals (
     goal_id SERIAL PRIMARY KEY NOT NULL,
     name varchar(100) NOT NULL,
-    target MONEY NOT NULL,
-    amount MONEY NOT NULL,
+    target BIGINT NOT NULL,
+    amount BIGINT NOT NULL,
     target_date DATE,
     owner varchar(50),
     notes varchar(255),
@@ -44,7 +52,7 @@ CREATE TABLE goals (
 CREATE TABLE debt (
     debt_id SERIAL PRIMARY KEY NOT NULL,
     name varchar(100) NOT NULL,
-    amount MONEY NOT NULL,
+    amount BIGINT NOT NULL,
     target_date DATE,
     owner varchar(50),
     notes varchar(255),
@@ -56,7 +64,7 @@ CREATE TABLE debt (
 CREATE TABLE income (
     income_id SERIAL PRIMARY KEY NOT NULL,
     name varchar(100) NOT NULL,
-    amount MONEY NOT NULL,
+    amount BIGINT NOT NULL,
     date DATE NOT NULL,
     type varchar(10) NOT NULL,
     owner varchar(50),
@@ -69,7 +77,7 @@ CREATE TABLE income (
 CREATE TABLE spending (
     spending_id SERIAL PRIMARY KEY NOT NULL,
     name varchar(100) NOT NULL,
-    amount MONEY NOT NULL,
+    amount BIGINT NOT NULL,
     date DATE not NULL,
     category varchar(50),
     expense_name varchar(50),
@@ -82,3 +90,39 @@ CREATE TABLE spending (
     FOREIGN KEY(goal_id) REFERENCES goals(goal_id),
     FOREIGN KEY(expense_name) REFERENCES expenses(name)
 );
+
+-- Per user, per month totals for every table, kept up to date by the write paths.
+-- name is the linked expense for spending and empty for the other tables,
+-- goals and debt without a target date are kept under 1900-01-01
+CREATE TABLE monthly_totals (
+    user_id INT NOT NULL,
+    table_name varchar(25) NOT NULL,
+    month DATE NOT NULL,
+    name varchar(100) NOT NULL DEFAULT '',
+    total BIGINT NOT NULL DEFAULT 0,
+    row_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, table_name, month, name),
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+-- Indexes for the per user, per date range lookups every page makes
+CREATE INDEX spending_user_date_id_idx ON spending (user_id, date, spending_id);
+CREATE INDEX spending_user_expense_date_idx ON spending (user_id, expense_name, date);
+CREATE INDEX income_user_date_id_idx ON income (user_id, date, income_id);
+CREATE INDEX expenses_user_due_date_idx ON expenses (user_id, due_date);
+CREATE INDEX expenses_user_last_due_idx ON expenses (user_id, last_due, due_date);
+CREATE INDEX goals_user_target_date_idx ON goals (user_id, target_date);
+CREATE INDEX debt_user_target_date_idx ON debt (user_id, target_date);
+CREATE INDEX users_username_idx ON users (username);
+
+-- Full text search, DB.search matches these expressions (backends.search_vector)
+CREATE INDEX spending_search_idx ON spending USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(category, '') || ' ' || coalesce(expense_name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX income_search_idx ON income USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(type, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX expenses_search_idx ON expenses USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX goals_search_idx ON goals USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
+CREATE INDEX debt_search_idx ON debt USING gin (to_tsvector('simple',
+    coalesce(name, '') || ' ' || coalesce(owner, '') || ' ' || coalesce(notes, '')));
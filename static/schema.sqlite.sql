@@ -0,0 +1,177 @@
+-- The complete, current schema for the SQLite backend, kept in step with
+-- schema.sql. Running it wipes the database, existing databases are brought
+-- up to date with migrate.py instead. DATE and timestamp are declared so the
+-- backend's converters return date objects like Postgres
+-- Clear any existing tables
+DROP TABLE IF EXISTS record_search;
+DROP TABLE IF EXISTS monthly_totals;
+DROP TABLE IF EXISTS spending;
+DROP TABLE IF EXISTS income;
+DROP TABLE IF EXISTS debt;
+DROP TABLE IF EXISTS goals;
+DROP TABLE IF EXISTS expenses;
+DROP TABLE IF EXISTS users;
+
+-- Creating new tables. Amounts (expected, target, amount, total) are integer cents
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY NOT NULL,
+    username varchar(25) NOT NULL,
+    password char(200) NOT NULL,
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    -- bumped by every write to the user's records
+    data_version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE expenses (
+    expense_id INTEGER PRIMARY KEY NOT NULL,
+    name varchar(100) NOT NULL,
+    expected BIGINT NOT NULL,
+    due_date DATE NOT NULL,
+    repeat_type varchar(25) NOT NULL,
+    -- every repeat_interval days/weeks/months/years up to last_due, see recurrence.py
+    repeat_interval INT NOT NULL DEFAULT 1,
+    last_due DATE NOT NULL DEFAULT '9999-12-31',
+    owner varchar(25),
+    notes varchar(255),
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    user_id INT NOT NULL,
+    unique(name),
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+CREATE TABLE goals (
+    goal_id INTEGER PRIMARY KEY NOT NULL,
+    name varchar(100) NOT NULL,
+    target BIGINT NOT NULL,
+    amount BIGINT NOT NULL,
+    target_date DATE,
+    owner varchar(50),
+    notes varchar(255),
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    user_id INT NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+CREATE TABLE debt (
+    debt_id INTEGER PRIMARY KEY NOT NULL,
+    name varchar(100) NOT NULL,
+    amount BIGINT NOT NULL,
+    target_date DATE,
+    owner varchar(50),
+    notes varchar(255),
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    user_id INT NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+CREATE TABLE income (
+    income_id INTEGER PRIMARY KEY NOT NULL,
+    name varchar(100) NOT NULL,
+    amount BIGINT NOT NULL,
+    date DATE NOT NULL,
+    type varchar(10) NOT NULL,
+    owner varchar(50),
+    notes varchar(255),
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    user_id INT NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+CREATE TABLE spending (
+    spending_id INTEGER PRIMARY KEY NOT NULL,
+    name varchar(100) NOT NULL,
+    amount BIGINT NOT NULL,
+    date DATE not NULL,
+    category varchar(50),
+    expense_name varchar(50),
+    owner varchar(50),
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    notes varchar(255),
+    user_id INT NOT NULL,
+    goal_id INT,
+    FOREIGN KEY(user_id) REFERENCES users(user_id),
+    FOREIGN KEY(goal_id) REFERENCES goals(goal_id),
+    FOREIGN KEY(expense_name) REFERENCES expenses(name)
+);
+
+-- Per user, per month totals for every table, kept up to date by the write paths.
+-- name is the linked expense for spending and empty for the other tables,
+-- goals and debt without a target date are kept under 1900-01-01
+CREATE TABLE monthly_totals (
+    user_id INT NOT NULL,
+    table_name varchar(25) NOT NULL,
+    month DATE NOT NULL,
+    name varchar(100) NOT NULL DEFAULT '',
+    total BIGINT NOT NULL DEFAULT 0,
+    row_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, table_name, month, name),
+    FOREIGN KEY(user_id) REFERENCES users(user_id)
+);
+
+-- Indexes for the per user, per date range lookups every page makes
+CREATE INDEX spending_user_date_id_idx ON spending (user_id, date, spending_id);
+CREATE INDEX spending_user_expense_date_idx ON spending (user_id, expense_name, date);
+CREATE INDEX income_user_date_id_idx ON income (user_id, date, income_id);
+CREATE INDEX expenses_user_due_date_idx ON expenses (user_id, due_date);
+CREATE INDEX expenses_user_last_due_idx ON expenses (user_id, last_due, due_date);
+CREATE INDEX goals_user_target_date_idx ON goals (user_id, target_date);
+CREATE INDEX debt_user_target_date_idx ON debt (user_id, target_date);
+CREATE INDEX users_username_idx ON users (username);
+
+-- Full text search, one row per record kept up to date by triggers.
+-- rowid is <record id> * 8 + <table code>, see SQLiteBackend.search
+CREATE VIRTUAL TABLE record_search USING fts5(
+    name, category, expense_name, owner, notes,
+    user_id UNINDEXED, table_name UNINDEXED, record_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+CREATE TRIGGER spending_search_insert AFTER INSERT ON spending BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.spending_id * 8 + 1, new.name, new.category, new.expense_name, new.owner, new.notes, new.user_id, 'spending', new.spending_id);
+END;
+CREATE TRIGGER spending_search_update AFTER UPDATE ON spending BEGIN
+    DELETE FROM record_search WHERE rowid = old.spending_id * 8 + 1;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.spending_id * 8 + 1, new.name, new.category, new.expense_name, new.owner, new.notes, new.user_id, 'spending', new.spending_id);
+END;
+CREATE TRIGGER spending_search_delete AFTER DELETE ON spending BEGIN
+    DELETE FROM record_search WHERE rowid = old.spending_id * 8 + 1;
+END;
+CREATE TRIGGER income_search_insert AFTER INSERT ON income BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.income_id * 8 + 2, new.name, new.type, NULL, new.owner, new.notes, new.user_id, 'income', new.income_id);
+END;
+CREATE TRIGGER income_search_update AFTER UPDATE ON income BEGIN
+    DELETE FROM record_search WHERE rowid = old.income_id * 8 + 2;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.income_id * 8 + 2, new.name, new.type, NULL, new.owner, new.notes, new.user_id, 'income', new.income_id);
+END;
+CREATE TRIGGER income_search_delete AFTER DELETE ON income BEGIN
+    DELETE FROM record_search WHERE rowid = old.income_id * 8 + 2;
+END;
+CREATE TRIGGER expenses_search_insert AFTER INSERT ON expenses BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.expense_id * 8 + 3, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'expenses', new.expense_id);
+END;
+CREATE TRIGGER expenses_search_update AFTER UPDATE ON expenses BEGIN
+    DELETE FROM record_search WHERE rowid = old.expense_id * 8 + 3;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.expense_id * 8 + 3, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'expenses', new.expense_id);
+END;
+CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses BEGIN
+    DELETE FROM record_search WHERE rowid = old.expense_id * 8 + 3;
+END;
+CREATE TRIGGER goals_search_insert AFTER INSERT ON goals BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.goal_id * 8 + 4, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'goals', new.goal_id);
+END;
+CREATE TRIGGER goals_search_update AFTER UPDATE ON goals BEGIN
+    DELETE FROM record_search WHERE rowid = old.goal_id * 8 + 4;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.goal_id * 8 + 4, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'goals', new.goal_id);
+END;
+CREATE TRIGGER goals_search_delete AFTER DELETE ON goals BEGIN
+    DELETE FROM record_search WHERE rowid = old.goal_id * 8 + 4;
+END;
+CREATE TRIGGER debt_search_insert AFTER INSERT ON debt BEGIN
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.debt_id * 8 + 5, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'debt', new.debt_id);
+END;
+CREATE TRIGGER debt_search_update AFTER UPDATE ON debt BEGIN
+    DELETE FROM record_search WHERE rowid = old.debt_id * 8 + 5;
+    INSERT INTO record_search (rowid, name, category, expense_name, owner, notes, user_id, table_name, record_id) VALUES (new.debt_id * 8 + 5, new.name, NULL, NULL, new.owner, new.notes, new.user_id, 'debt', new.debt_id);
+END;
+CREATE TRIGGER debt_search_delete AFTER DELETE ON debt BEGIN
+    DELETE FROM record_search WHERE rowid = old.debt_id * 8 + 5;
+END;
@@ -0,0 +1,73 @@
+"""
+Fixtures for the test suite. Every test gets its own SQLite database with the
+latest schema, served to the app by a pool of counted connections, so a test
+can assert on how many statements a request ran.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import random
+from types import SimpleNamespace
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# read when the modules are imported: a fresh render on every request, query
+# accounting in the Server-Timing header and cheap password hashes
+os.environ["PAGE_CACHE_SIZE"] = "0"
+os.environ["INSTRUMENT"] = "1"
+os.environ["PASSWORD_HASH_ITERATIONS"] = "1000"
+
+import db
+import pool
+from app import app, init_db
+from backends import backend_from_url
+from benchmark import QueryCounter, generate, month_starts
+from hashing import hash_password
+
+PASSWORD = "secret"
+
+
+@pytest.fixture
+def counter(tmp_path, monkeypatch):
+    backend = backend_from_url("sqlite:///" + str(tmp_path / "test.db"))
+    counter = QueryCounter(backend.connect)
+    monkeypatch.setattr(pool, "_pool", pool.ConnectionPool(counter.connect, minconn=0, maxconn=4, backend=backend))
+    monkeypatch.setattr(db, "user_ids", db.UserIdCache())
+    init_db()
+    yield counter
+    pool.get_pool().closeall()
+
+@pytest.fixture
+def database(counter):
+    conn = pool.get_pool().getconn()
+    yield db.DB(conn)
+    pool.get_pool().putconn(conn)
+
+# seed(months, rows) fills the database with one user and months of their
+# history, rows expenses, spending and income a month. Every user's password is
+# PASSWORD. returns the first user as (user_id, username, [expense names of the
+# latest month])
+@pytest.fixture
+def seed(database):
+    def seed(months=3, rows=5, users=1):
+        args = SimpleNamespace(users=users, months=months, expenses=rows, spending=rows, income=rows)
+        return generate(database, args, random.Random(1), hash_password(PASSWORD))[0]
+    return seed
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+# login(client, user) puts the user in the client's session
+@pytest.fixture
+def login():
+    def login(client, user):
+        with client.session_transaction() as session:
+            session["user_id"] = user[0]
+            session["username"] = user[1]
+    return login
+
+@pytest.fixture
+def this_month():
+    return month_starts(1)[0]
@@ -0,0 +1,103 @@
+"""
+Adding and deleting single records through /api/<table>.
+"""
+import pytest
+
+
+def spending_ids(database, user_id):
+    c = database.conn.cursor()
+    c.execute("select spending_id from spending where user_id = %s order by spending_id", (user_id,))
+    rids = [row[0] for row in c.fetchall()]
+    c.close()
+    return rids
+
+
+def test_add(client, seed, login, this_month):
+    login(client, seed(months=1, rows=1))
+    response = client.post("/api/spending", json={"name": "lunch", "amount": 12.5, "date": this_month.isoformat(), "category": "Food"})
+    assert response.status_code == 201
+    [row] = response.get_json()["rows"]
+    assert (row["name"], row["amount"], row["category"]) == ("Lunch", 1250, "food")
+
+
+@pytest.mark.parametrize("body,message", [
+    ({"name": None, "amount": "5"}, "missing or invalid field 'name'"),
+    ({"name": ["lunch"], "amount": "5"}, "name must be a string"),
+    ({"name": "lunch", "amount": True}, "amount must be a string"),
+    ({"name": "lunch", "amount": "5", "category": {"a": 1}}, "category must be a string"),
+    (["lunch", "5"], "the body must be a json object"),
+])
+def test_add_rejects_bad_fields(body, message, database, client, seed, login):
+    user = seed(months=1, rows=1)
+    login(client, user)
+    before = spending_ids(database, user[0])
+    response = client.post("/api/spending", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message
+    assert spending_ids(database, user[0]) == before
+
+
+def test_delete(database, client, seed, login):
+    user = seed(months=1, rows=3)
+    login(client, user)
+    rid = spending_ids(database, user[0])[0]
+    response = client.delete("/api/spending?id={}".format(rid))
+    assert response.status_code == 200
+    assert response.get_json()["deleted"] == [str(rid)]
+    assert rid not in spending_ids(database, user[0])
+    assert database.check_rollups(user[0]) == []
+
+
+def test_delete_missing_or_foreign_record(database, client, seed, login):
+    user = seed(months=1, rows=3, users=2)
+    login(client, user)
+    c = database.conn.cursor()
+    c.execute("select spending_id from spending where user_id != %s", (user[0],))
+    foreign = c.fetchone()[0]
+    c.execute("select max(spending_id) from spending")
+    missing = c.fetchone()[0] + 1
+    c.close()
+    for rid in (foreign, missing):
+        response = client.delete("/api/spending?id={}".format(rid))
+        assert response.status_code == 404
+        assert response.get_json()["message"] == "no spending record {}".format(rid)
+    c = database.conn.cursor()
+    c.execute("select count(*) from spending where spending_id = %s", (foreign,))
+    assert c.fetchone()[0] == 1
+    c.close()
+    response = client.delete("/api/spending?id=abc")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("tablename,body", [
+    ("spending", {"name": "Lunch", "amount": "5"}),
+    ("income", {"name": "Pay", "amount": "5"}),
+    ("expenses", {"name": "Rent", "expected": "5"}),
+    ("goals", {"name": "Car", "target": "5"}),
+    ("debt", {"name": "Loan", "amount": "5"}),
+])
+@pytest.mark.parametrize("day,message", [
+    ("2021-02-30", "day is out of range for month"),
+    ("next tuesday", "time data 'next tuesday' does not match format '%Y-%m-%d'"),
+])
+def test_add_refuses_bad_dates(tablename, body, day, message, database, client, seed, login):
+    user = seed(months=1, rows=1)
+    login(client, user)
+    c = database.conn.cursor()
+    c.execute("select count(*) from {} where user_id = %s".format(tablename), (user[0],))
+    before = c.fetchone()[0]
+    response = client.post("/api/" + tablename, json=dict(body, date=day))
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message
+    c.execute("select count(*) from {} where user_id = %s".format(tablename), (user[0],))
+    assert c.fetchone()[0] == before
+    c.close()
+
+
+def test_form_with_a_bad_date_leaves_the_month_readable(database, client, seed, login):
+    user = seed(months=1, rows=1)
+    login(client, user)
+    response = client.post("/addspending", data={"name": "Lunch", "amount": "5", "date": "2021-02-30"})
+    assert response.status_code == 302
+    assert client.get("/myspending/2021-02-01").status_code == 200
+    assert client.get("/api/spending?month=2021-02").get_json()["rows"] == []
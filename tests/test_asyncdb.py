@@ -0,0 +1,28 @@
+"""
+With the fan-out on, a page's reads run on several connections at once and
+still add up to the same queries and results in the request's accounting.
+"""
+import re
+import pytest
+import asyncdb
+
+
+def server_timing(response):
+    match = re.search(r'db;dur=([0-9.]+);desc="(\d+) queries"', response.headers["Server-Timing"])
+    return (float(match.group(1)), int(match.group(2)))
+
+
+@pytest.mark.parametrize("view", ["/myexpenses/", "/myspending/", "/myincome/", "/dashboard"])
+def test_fanout_is_accounted(view, counter, seed, client, login, monkeypatch):
+    login(client, seed(months=3, rows=10))
+    pages = {}
+    for fanout in (False, True):
+        monkeypatch.setattr(asyncdb, "ENABLED", fanout)
+        before = counter.count()
+        response = client.get(view)
+        assert response.status_code == 200
+        (seconds, queries) = server_timing(response)
+        assert queries == counter.count() - before
+        assert seconds > 0
+        pages[fanout] = (queries, response.data)
+    assert pages[True] == pages[False]
@@ -0,0 +1,85 @@
+"""
+Quick entry through /api/batch: every record is added in one transaction, or
+none is and each bad record gets its own error.
+"""
+
+
+def count(database, tablename, user_id):
+    c = database.conn.cursor()
+    c.execute("select count(*) from {} where user_id = %s".format(tablename), (user_id,))
+    total = c.fetchone()[0]
+    c.close()
+    return total
+
+
+def counts(database, user_id):
+    return [count(database, t, user_id) for t in ("spending", "income", "expenses")]
+
+
+def test_batch(database, client, seed, login, this_month):
+    user = seed(months=1, rows=2)
+    login(client, user)
+    day = this_month.isoformat()
+    before = counts(database, user[0])
+    response = client.post("/api/batch", json={"records": [
+        {"table": "spending", "name": "Costco", "amount": "54.20", "date": day, "category": "food"},
+        {"table": "income", "name": "Paycheck", "amount": 1500, "date": day},
+        {"table": "expenses", "name": "New phone", "expected": "300", "date": day},
+        {"table": "spending", "name": "Coffee", "amount": "3", "date": day, "expense_name": None},
+    ]})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [(r["index"], r["table"]) for r in body["results"]] == [(0, "spending"), (1, "income"), (2, "expenses"), (3, "spending")]
+    assert sorted(body["totals"]) == ["expenses", "income", "spending"]
+    assert counts(database, user[0]) == [before[0] + 2, before[1] + 1, before[2] + 1]
+    assert database.check_rollups(user[0]) == []
+
+
+def test_batch_is_all_or_nothing(database, client, seed, login, this_month):
+    user = seed(months=1, rows=2)
+    login(client, user)
+    before = counts(database, user[0])
+    response = client.post("/api/batch", json={"records": [
+        {"table": "spending", "name": "Costco", "amount": "54.20", "date": this_month.isoformat()},
+        {"table": "spending", "name": "Costco", "amount": "lots"},
+        {"table": "savings", "name": "Costco", "amount": "1"},
+        {"table": "income", "amount": "1"},
+    ]})
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body["message"] == "no records were added"
+    assert [r["index"] for r in body["results"] if "error" in r] == [1, 2, 3]
+    assert body["results"][3]["error"] == "missing field 'name'"
+    assert counts(database, user[0]) == before
+
+
+def test_batch_expense_names_are_unique(database, client, seed, login, this_month):
+    (user_id, username, _) = seed(months=3, rows=2, users=2)
+    login(client, (user_id, username))
+    # the name of an expense from two months ago, and one of the other user's
+    c = database.conn.cursor()
+    c.execute("select name from expenses where user_id = %s and due_date < %s limit 1", (user_id, this_month))
+    old_name = c.fetchone()[0]
+    c.execute("select name from expenses where user_id != %s limit 1", (user_id,))
+    other_name = c.fetchone()[0]
+    c.close()
+    before = counts(database, user_id)
+    day = this_month.isoformat()
+    response = client.post("/api/batch", json={"records": [
+        {"table": "expenses", "name": old_name, "expected": "10", "date": day},
+        {"table": "expenses", "name": other_name, "expected": "10", "date": day},
+        {"table": "expenses", "name": "Gym", "expected": "10", "date": day},
+        {"table": "expenses", "name": "gym", "expected": "10", "date": day},
+    ]})
+    assert response.status_code == 400
+    assert response.get_json()["results"] == [
+        {"index": 0, "error": "Expense name already exists"},
+        {"index": 1, "error": "Expense name already exists"},
+        {"index": 2, "table": "expenses"},
+        {"index": 3, "error": "Expense name already exists"},
+    ]
+    assert counts(database, user_id) == before
+    # adding one expense follows the same rule
+    response = client.post("/api/expenses", json={"name": old_name, "expected": "10", "date": day})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Expense name already exists"
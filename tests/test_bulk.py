@@ -0,0 +1,86 @@
+"""
+Bulk edits and deletes through /api/<table>/bulk: they change every record
+picked or none of them, and bad input is a 400 before any sql runs.
+"""
+import pytest
+import db
+
+
+def spending(database, user_id):
+    c = database.conn.cursor()
+    c.execute("select spending_id, category, expense_name from spending where user_id = %s order by spending_id", (user_id,))
+    rows = c.fetchall()
+    c.close()
+    return rows
+
+
+def test_bulk_edit(database, seed, client, login):
+    user = seed(months=2, rows=4)
+    login(client, user)
+    rids = [row[0] for row in spending(database, user[0])[:3]]
+    response = client.patch("/api/spending/bulk", json={"ids": rids, "set": {"category": " Rent ", "expense_name": ""}})
+    assert response.status_code == 200
+    assert response.get_json()["updated"] == rids
+    changed = [row for row in spending(database, user[0]) if row[0] in rids]
+    assert changed == [(rid, "rent", None) for rid in rids]
+    assert database.check_rollups(user[0]) == []
+
+
+def test_bulk_delete_by_filter(database, seed, client, login):
+    user = seed(months=2, rows=4)
+    login(client, user)
+    food = [row[0] for row in spending(database, user[0]) if row[1] == "food"]
+    assert food
+    response = client.delete("/api/spending/bulk", json={"filter": {"category": "food"}})
+    assert response.status_code == 200
+    assert response.get_json()["deleted"] == food
+    assert [row for row in spending(database, user[0]) if row[1] == "food"] == []
+    assert database.check_rollups(user[0]) == []
+
+
+def test_bulk_is_all_or_nothing(database, seed, client, login, monkeypatch):
+    user = seed(months=2, rows=4)
+    login(client, user)
+    before = spending(database, user[0])
+    monkeypatch.setattr(db, "BULK_MAX_ROWS", 2)
+    response = client.delete("/api/spending/bulk", json={"filter": {"from": "2000-01-01"}})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "more than 2 records match, narrow the filter"
+    assert spending(database, user[0]) == before
+
+
+@pytest.mark.parametrize("method,body,message", [
+    ("delete", [1, 2], "the body must be a json object"),
+    ("patch", {"ids": [1], "set": {"category": None}}, "category must be a string"),
+    ("patch", {"ids": [1], "set": {"owner": 7}}, "owner must be a string"),
+    ("patch", {"ids": [1], "set": ["category"]}, "spending can only set category, expense_name, owner"),
+    ("patch", {"filter": {"category": 3}, "set": {"owner": "me"}}, "category must be a string"),
+    ("delete", {"filter": {"from": 20240101}}, "from must be a date as YYYY-MM-DD"),
+    ("delete", {"filter": ["category"]}, "filter must be an object of fields and values"),
+    ("delete", {"ids": ["one"]}, "ids must be a list of record ids"),
+    ("delete", {"ids": [None]}, "ids must be a list of record ids"),
+    ("delete", {}, "give the ids or a filter of the records to change"),
+])
+def test_bulk_rejects_bad_input(method, body, message, counter, seed, client, login):
+    login(client, seed(months=1, rows=2))
+    before = counter.count()
+    response = getattr(client, method)("/api/spending/bulk", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message
+    assert counter.count() == before
+
+
+@pytest.mark.parametrize("unlinked", ["", None])
+def test_filter_on_no_linked_expense(unlinked, database, seed, client, login):
+    user = seed(months=2, rows=4)
+    login(client, user)
+    rows = spending(database, user[0])
+    loose = [row[0] for row in rows if row[2] is None]
+    assert loose and len(loose) < len(rows)
+    response = client.patch("/api/spending/bulk", json={"filter": {"expense_name": unlinked}, "set": {"category": "misc"}})
+    assert response.status_code == 200
+    assert response.get_json()["updated"] == loose
+    assert [row[0] for row in spending(database, user[0]) if row[1] == "misc"] == loose
+    response = client.delete("/api/spending/bulk", json={"filter": {"expense_name": unlinked}})
+    assert response.get_json()["deleted"] == loose
+    assert all(row[2] is not None for row in spending(database, user[0]))
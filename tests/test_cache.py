@@ -0,0 +1,23 @@
+"""
+PageCache hit and miss counters stay exact when many threads read at once.
+"""
+import threading
+from cache import PageCache, LocalLRUBackend
+
+
+def test_counters_under_contention():
+    cache = PageCache(LocalLRUBackend(8))
+    cache.set(1, "myspending", "2021-04", "page")
+
+    def read():
+        for _ in range(1000):
+            cache.get(1, "myspending", "2021-04")
+            cache.get(1, "myspending", "2021-05")
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (8000, 8000, 1)
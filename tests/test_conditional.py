@@ -0,0 +1,46 @@
+"""
+Month views carry an ETag that changes with every write of the user, and an
+unchanged page is answered with an empty 304.
+"""
+import pytest
+
+VIEWS = ["myexpenses", "myspending", "myincome"]
+
+
+@pytest.mark.parametrize("view", VIEWS)
+def test_unchanged_page_is_304(view, client, seed, login, this_month):
+    login(client, seed(months=2, rows=3))
+    url = "/{}/{}".format(view, this_month.isoformat())
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    etag = first.headers["ETag"]
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+
+@pytest.mark.parametrize("view", VIEWS)
+def test_write_changes_the_etag(view, client, seed, login, this_month):
+    login(client, seed(months=2, rows=3))
+    url = "/{}/{}".format(view, this_month.isoformat())
+    etag = client.get(url).headers["ETag"]
+    response = client.post("/api/spending", json={"name": "Lunch", "amount": "9", "date": this_month.isoformat()})
+    assert response.status_code == 201
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert client.get(url, headers={"If-None-Match": changed.headers["ETag"]}).status_code == 304
+
+
+def test_etags_differ_between_months_and_users(client, seed, login, this_month):
+    (user_id, username, _) = seed(months=2, rows=3, users=2)
+    login(client, (user_id, username))
+    url = "/myspending/{}".format(this_month.isoformat())
+    etag = client.get(url).headers["ETag"]
+    assert client.get("/myspending/2001-01-01").headers["ETag"] != etag
+    other = client.application.test_client()
+    login(other, (user_id + 1, "bench1"))
+    response = other.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
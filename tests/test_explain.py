@@ -0,0 +1,15 @@
+"""
+Every query behind the pages is answered from an index, as
+`python migrate.py explain <username>` reports it.
+"""
+from migrate import explain_pages
+
+PAGES = {"myexpenses", "myspending", "myincome", "mygoals", "mydebt", "search"}
+
+
+def test_page_queries_use_indexes(database, seed, this_month):
+    (user_id, _, _) = seed(months=3, rows=20, users=2)
+    report = explain_pages(database.conn, user_id, this_month)
+    assert {page for (page, _, _, _) in report} == PAGES
+    full_scans = [(page, query, plan) for (page, query, plan, uses_index) in report if not uses_index]
+    assert full_scans == []
@@ -0,0 +1,57 @@
+"""
+The html add forms: optional fields can be left out, and a write drops the
+cached pages of the month it touched.
+"""
+import pytest
+import app as application
+from cache import PageCache, LocalLRUBackend
+
+
+@pytest.fixture
+def page_cache(monkeypatch):
+    cache = PageCache(LocalLRUBackend(64))
+    monkeypatch.setattr(application, "page_cache", cache)
+    return cache
+
+
+def count(database, tablename, user_id):
+    c = database.conn.cursor()
+    c.execute("select count(*) from {} where user_id = %s".format(tablename), (user_id,))
+    total = c.fetchone()[0]
+    c.close()
+    return total
+
+
+@pytest.mark.parametrize("url,tablename,view,form", [
+    ("/addspending", "spending", "/myspending/", {"name": "Lunch", "amount": "5"}),
+    ("/addincome", "income", "/myincome/", {"name": "Pay", "amount": "5"}),
+    ("/addexpense", "expenses", "/myexpenses/", {"name": "Rent", "expected": "5"}),
+])
+def test_add_without_date_or_repeat(url, tablename, view, form, database, client, seed, login, page_cache):
+    user = seed(months=1, rows=1)
+    login(client, user)
+    assert client.get(view).status_code == 200
+    assert len(page_cache.backend) == 1
+    before = count(database, tablename, user[0])
+    response = client.post(url, data=form)
+    assert response.status_code == 302
+    assert count(database, tablename, user[0]) == before + 1
+    # today's month was dropped
+    assert len(page_cache.backend) == 0
+
+
+def test_add_to_another_month_keeps_this_months_page(client, seed, login, page_cache):
+    login(client, seed(months=1, rows=1))
+    client.get("/myspending/")
+    response = client.post("/addspending", data={"name": "Lunch", "amount": "5", "date": "2001-01-05"})
+    assert response.status_code == 302
+    assert len(page_cache.backend) == 1
+
+
+def test_repeating_expense_drops_every_month(client, seed, login, page_cache):
+    login(client, seed(months=1, rows=1))
+    client.get("/myexpenses/")
+    client.get("/myexpenses/2001-01-01")
+    response = client.post("/addexpense", data={"name": "Rent", "expected": "5", "date": "2001-01-05", "repeat": "monthly"})
+    assert response.status_code == 302
+    assert len(page_cache.backend) == 0
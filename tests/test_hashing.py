@@ -0,0 +1,51 @@
+"""
+Password hashing in the process pool: a hash that takes too long is a
+HashingBusy, and keeps its slot until its worker is done with it.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import hashing
+from conftest import PASSWORD
+
+
+# hashes that run until done is set, on threads so they see the patched _pbkdf2
+@pytest.fixture
+def done(monkeypatch):
+    done = threading.Event()
+    executor = ThreadPoolExecutor(hashing.HASH_WORKERS)
+    monkeypatch.setattr(hashing, "get_executor", lambda: executor)
+    monkeypatch.setattr(hashing, "_pbkdf2", lambda password, salt, iterations: done.wait(10) and b"key")
+    monkeypatch.setattr(hashing, "HASH_TIMEOUT", 0.05)
+    yield done
+    done.set()
+    executor.shutdown()
+
+
+def test_hash_and_verify():
+    stored = hashing.hash_password(PASSWORD)
+    assert hashing.verify_password(PASSWORD, stored) == (True, False)
+    assert hashing.verify_password("wrong", stored) == (False, False)
+
+
+def test_timeout_keeps_the_slot_until_the_hash_is_done(done, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(hashing, "_slots", slots)
+    with pytest.raises(hashing.HashingBusy):
+        hashing.pbkdf2(PASSWORD, b"salt", 1)
+    # the hash still runs and holds the only slot
+    with pytest.raises(hashing.HashingBusy):
+        hashing.pbkdf2(PASSWORD, b"salt", 1)
+    done.set()
+    monkeypatch.setattr(hashing, "HASH_TIMEOUT", 10)
+    assert slots.acquire(timeout=10)
+    slots.release()
+    assert hashing.pbkdf2(PASSWORD, b"salt", 1) == b"key"
+
+
+def test_login_answers_429_when_hashing_times_out(client, seed, request):
+    (_, username, _) = seed(months=1, rows=1)
+    request.getfixturevalue("done")
+    response = client.post("/login", data={"username": username, "password": PASSWORD})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
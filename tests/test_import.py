@@ -0,0 +1,70 @@
+"""
+CSV imports through /importcsv: good lines are added in batches, bad ones
+are skipped and reported by line number.
+"""
+import io
+import db
+
+
+def upload(client, tablename, text):
+    return client.post(
+        "/importcsv",
+        data={"tablename": tablename, "csvfile": (io.BytesIO(text.encode("utf-8")), "import.csv")},
+        headers={"Accept": "application/json"},
+    )
+
+
+def names(database, tablename, user_id):
+    c = database.conn.cursor()
+    c.execute("select name from {} where user_id = %s".format(tablename), (user_id,))
+    rows = sorted(row[0] for row in c.fetchall())
+    c.close()
+    return rows
+
+
+def test_import_reports_bad_lines(database, client, seed, login, monkeypatch):
+    user = seed(months=1, rows=1)
+    login(client, user)
+    monkeypatch.setattr(db, "IMPORT_BATCH_SIZE", 2)
+    response = upload(client, "spending", "\n".join([
+        "name,amount,date,category,owner,expense_name",
+        "Bread,3.50,2021-04-01,Food,,",
+        "Milk,lots,2021-04-02,food,,",
+        "Cheese,7,,food,,",
+        "Eggs,2.25,2021-04-03,food,me,",
+        "Jam,1,April 4,food,,",
+        "Tea,4.10,2021-04-05,food,,",
+    ]) + "\n")
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert (summary["accepted"], summary["rejected"]) == (3, 3)
+    assert [e["line"] for e in summary["errors"]] == [3, 4, 6]
+    assert summary["errors"][1]["error"] == "date is required"
+    assert [n for n in names(database, "spending", user[0]) if n in ("Bread", "Eggs", "Tea", "Milk", "Cheese", "Jam")] == ["Bread", "Eggs", "Tea"]
+    assert database.check_rollups(user[0]) == []
+
+
+def test_import_skips_lines_the_database_refuses(database, client, seed, login, monkeypatch):
+    (user_id, username, existing) = seed(months=1, rows=2)
+    login(client, (user_id, username))
+    monkeypatch.setattr(db, "IMPORT_BATCH_SIZE", 10)
+    # expense names are unique, the batch is retried line by line to find the clash
+    response = upload(client, "expenses", "\n".join([
+        "name,expected,due_date,repeat_type,repeat_interval,last_due,owner",
+        "Rent,900,2021-04-01,monthly,1,,",
+        "{},10,2021-04-02,onetime,1,,".format(existing[0]),
+        "Phone,40,2021-04-03,onetime,1,,",
+    ]) + "\n")
+    summary = response.get_json()
+    assert (summary["accepted"], summary["rejected"]) == (2, 1)
+    assert summary["errors"][0]["line"] == 3
+    assert {"Rent", "Phone"} <= set(names(database, "expenses", user_id))
+    assert database.check_rollups(user_id) == []
+
+
+def test_import_of_a_missing_column(client, seed, login):
+    login(client, seed(months=1, rows=1))
+    response = upload(client, "income", "name,amount\nSalary,100\n")
+    summary = response.get_json()
+    assert (summary["accepted"], summary["rejected"]) == (0, 1)
+    assert summary["errors"][0] == {"line": 2, "error": "missing column 'date'"}
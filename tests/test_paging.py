@@ -0,0 +1,56 @@
+"""
+Spending and income are listed a page at a time, newest first, each page
+starting after the "next" of the one before.
+"""
+import pytest
+
+
+def month_ids(database, tablename, user_id, month):
+    idcol = {"spending": "spending_id", "income": "income_id"}[tablename]
+    c = database.conn.cursor()
+    c.execute("select {0} from {1} where user_id = %s and date >= %s order by date desc, {0} desc".format(idcol, tablename), (user_id, month))
+    rids = [row[0] for row in c.fetchall()]
+    c.close()
+    return rids
+
+
+@pytest.mark.parametrize("tablename", ["spending", "income"])
+def test_pages_cover_the_month(tablename, database, client, seed, login, this_month):
+    user = seed(months=2, rows=25)
+    login(client, user)
+    month = this_month.strftime("%Y-%m")
+    (rids, after, pages) = ([], None, 0)
+    while True:
+        url = "/api/{}?month={}&limit=10".format(tablename, month)
+        response = client.get(url + ("&after=" + after if after else ""))
+        assert response.status_code == 200
+        body = response.get_json()
+        assert len(body["rows"]) <= 10
+        rids += [row["id"] for row in body["rows"]]
+        pages += 1
+        after = body["next"]
+        if not after:
+            break
+    assert pages == 3
+    assert rids == month_ids(database, tablename, user[0], this_month)
+
+
+@pytest.mark.parametrize("limit,rows", [("0", 1), ("-5", 1), ("3", 3), ("100000", 25)])
+def test_limit_is_clamped(limit, rows, client, seed, login):
+    login(client, seed(months=1, rows=25))
+    response = client.get("/api/spending?limit=" + limit)
+    assert response.status_code == 200
+    assert len(response.get_json()["rows"]) == rows
+
+
+@pytest.mark.parametrize("query,message", [
+    ("limit=ten", "limit must be a whole number"),
+    ("limit=", "limit must be a whole number"),
+    ("after=2021-01-01", "after must be the next of an earlier page"),
+    ("after=yesterday,4", "after must be the next of an earlier page"),
+])
+def test_bad_paging_arguments(query, message, client, seed, login):
+    login(client, seed(months=1, rows=2))
+    response = client.get("/api/spending?" + query)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message
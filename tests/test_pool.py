@@ -0,0 +1,25 @@
+"""
+Pool counters stay exact when many threads open and discard connections.
+"""
+import threading
+import pool
+from backends import backend_from_url
+
+
+def test_counters_under_contention(tmp_path):
+    backend = backend_from_url("sqlite:///" + str(tmp_path / "pool.db"))
+    p = pool.ConnectionPool(backend.connect, minconn=0, maxconn=8, backend=backend)
+
+    def churn():
+        for _ in range(50):
+            p.putconn(p.getconn(), close=True)
+
+    threads = [threading.Thread(target=churn) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = p.stats()
+    assert stats["created"] == stats["discarded"] == 400
+    assert (stats["in_use"], stats["idle"]) == (0, 0)
+    p.closeall()
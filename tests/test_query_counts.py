@@ -0,0 +1,22 @@
+"""
+The month views run a fixed number of statements however much data the user
+has. A count that grows with the rows means a query crept back into a loop.
+"""
+import pytest
+
+# statements per view: the data_version for the ETag, then the page's reads
+QUERIES = {
+    "myexpenses": 4,
+    "myspending": 3,
+    "myincome": 3,
+}
+
+
+@pytest.mark.parametrize("months,rows", [(1, 1), (3, 10), (12, 60)])
+@pytest.mark.parametrize("view", sorted(QUERIES))
+def test_month_view_queries(view, months, rows, counter, seed, client, login, this_month):
+    login(client, seed(months=months, rows=rows))
+    before = counter.count()
+    response = client.get("/{}/{}".format(view, this_month.isoformat()))
+    assert response.status_code == 200
+    assert counter.count() - before == QUERIES[view]
@@ -0,0 +1,95 @@
+"""
+Expanding recurring expenses into their dates, see recurrence.py.
+"""
+from datetime import date
+import pytest
+from recurrence import FOREVER, parse_repeat, repeat_label, last_due, add_months, occurrences
+
+
+@pytest.mark.parametrize("repeat_type,interval,expected", [
+    ("", None, ("onetime", 1)),
+    ("Once", "4", ("onetime", 1)),
+    (" MONTHLY ", "", ("monthly", 1)),
+    ("biweekly", None, ("weekly", 2)),
+    ("biweekly", "2", ("weekly", 4)),
+    ("quarterly", None, ("monthly", 3)),
+    ("annually", None, ("yearly", 1)),
+    ("daily", 3, ("daily", 3)),
+])
+def test_parse_repeat(repeat_type, interval, expected):
+    assert parse_repeat(repeat_type, interval) == expected
+
+
+@pytest.mark.parametrize("repeat_type,interval", [("fortnightly", None), ("weekly", "0"), ("weekly", "-1"), ("weekly", "two")])
+def test_parse_repeat_refuses(repeat_type, interval):
+    with pytest.raises(ValueError):
+        parse_repeat(repeat_type, interval)
+
+
+def test_repeat_label():
+    assert repeat_label("weekly", 2) == "biweekly"
+    assert repeat_label("monthly", 3) == "quarterly"
+    assert repeat_label("monthly", 1) == "monthly"
+    assert repeat_label("daily", 10) == "every 10 days"
+    assert repeat_label("onetime", 5) == "onetime"
+
+
+def test_last_due():
+    due = date(2021, 3, 15)
+    assert last_due(due, "onetime", date(2022, 1, 1)) == due
+    assert last_due(due, "monthly") == FOREVER
+    assert last_due(due, "monthly", due) == due
+    with pytest.raises(ValueError):
+        last_due(due, "weekly", date(2021, 3, 14))
+
+
+@pytest.mark.parametrize("year,month,months,day,expected", [
+    (2021, 1, 1, 31, date(2021, 2, 28)),
+    (2024, 1, 1, 31, date(2024, 2, 29)),
+    (2021, 1, 3, 31, date(2021, 4, 30)),
+    (2021, 11, 2, 15, date(2022, 1, 15)),
+    (2021, 1, -1, 31, date(2020, 12, 31)),
+    (2021, 3, -13, 30, date(2020, 2, 29)),
+])
+def test_add_months(year, month, months, day, expected):
+    assert add_months(year, month, months, day) == expected
+
+
+def test_onetime():
+    due = date(2021, 5, 10)
+    assert occurrences(due, "onetime", 1, due, date(2021, 5, 1), date(2021, 6, 1)) == (due,)
+    assert occurrences(due, "onetime", 1, due, date(2021, 6, 1), date(2021, 7, 1)) == ()
+    assert occurrences(due, "onetime", 1, due, date(2021, 4, 1), date(2021, 5, 10)) == ()
+
+
+def test_weekly_keeps_its_step_across_the_range_start():
+    # every other friday from 2021-01-01
+    dates = occurrences(date(2021, 1, 1), "weekly", 2, FOREVER, date(2021, 3, 1), date(2021, 4, 1))
+    assert dates == (date(2021, 3, 12), date(2021, 3, 26))
+
+
+def test_daily_until_last_due():
+    dates = occurrences(date(2021, 1, 30), "daily", 1, date(2021, 2, 2), date(2021, 2, 1), date(2021, 3, 1))
+    assert dates == (date(2021, 2, 1), date(2021, 2, 2))
+
+
+def test_monthly_on_the_31st_does_not_drift():
+    dates = occurrences(date(2021, 1, 31), "monthly", 1, FOREVER, date(2021, 1, 1), date(2021, 6, 1))
+    assert dates == (date(2021, 1, 31), date(2021, 2, 28), date(2021, 3, 31), date(2021, 4, 30), date(2021, 5, 31))
+
+
+def test_quarterly_from_before_the_range():
+    dates = occurrences(date(2020, 11, 15), "monthly", 3, FOREVER, date(2021, 1, 1), date(2022, 1, 1))
+    assert dates == (date(2021, 2, 15), date(2021, 5, 15), date(2021, 8, 15), date(2021, 11, 15))
+
+
+def test_yearly_on_leap_day():
+    dates = occurrences(date(2020, 2, 29), "yearly", 1, FOREVER, date(2020, 1, 1), date(2025, 1, 1))
+    assert dates == (date(2020, 2, 29), date(2021, 2, 28), date(2022, 2, 28), date(2023, 2, 28), date(2024, 2, 29))
+
+
+def test_nothing_before_the_first_due_date_or_after_the_last():
+    assert occurrences(date(2021, 6, 1), "monthly", 1, FOREVER, date(2021, 1, 1), date(2021, 6, 1)) == ()
+    assert occurrences(date(2020, 1, 1), "monthly", 1, date(2020, 12, 31), date(2021, 1, 1), date(2021, 2, 1)) == ()
+    # last_due is the last day it can fall on, inclusive
+    assert occurrences(date(2021, 1, 5), "monthly", 1, date(2021, 3, 5), date(2021, 3, 1), date(2021, 4, 1)) == (date(2021, 3, 5),)
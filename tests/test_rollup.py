@@ -0,0 +1,54 @@
+"""
+monthly_totals agrees with the raw rows after every kind of write, and
+`python rollup.py check` / `rebuild` find and repair any drift.
+"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rollup(tmp_path, *args):
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + str(tmp_path / "test.db"))
+    return subprocess.run([sys.executable, "rollup.py"] + list(args), cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_writes_keep_totals_consistent(database, client, seed, login, this_month):
+    (user_id, username, names) = seed(months=3, rows=5)
+    login(client, (user_id, username))
+    day = this_month.isoformat()
+    responses = [
+        client.post("/api/spending", json={"name": "Lunch", "amount": "12.30", "date": day, "linkedExpense": names[0]}),
+        client.post("/api/income", json={"name": "Bonus", "amount": "500", "date": day}),
+        client.post("/api/batch", json={"records": [
+            {"table": "spending", "name": "Taxi", "amount": "20", "date": day, "expense_name": names[1]},
+            {"table": "expenses", "name": "Gym", "expected": "30", "date": day},
+        ]}),
+        client.patch("/api/spending/bulk", json={"filter": {"category": "fun"}, "set": {"expense_name": names[0]}}),
+        client.delete("/api/spending/bulk", json={"filter": {"category": "travel"}}),
+    ]
+    assert [r.status_code for r in responses] == [201, 201, 201, 200, 200]
+    c = database.conn.cursor()
+    c.execute("select income_id from income where user_id = %s limit 1", (user_id,))
+    assert client.delete("/api/income?id={}".format(c.fetchone()[0])).status_code == 200
+    c.execute("select sum(amount) from spending where user_id = %s and date >= %s", (user_id, this_month))
+    spent = c.fetchone()[0]
+    c.close()
+    assert database.check_rollups(user_id) == []
+    assert client.get("/api/spending?month=" + day[:7]).get_json()["totals"] == {"total": spent}
+
+
+def test_check_and_rebuild(tmp_path, database, seed):
+    (user_id, username, _) = seed(months=2, rows=3)
+    result = rollup(tmp_path, "check")
+    assert result.returncode == 0
+    assert result.stdout.strip() == "0 mismatched totals"
+    with database.transaction() as c:
+        c.execute("update monthly_totals set total = total + 100 where user_id = %s and table_name = 'income'", (user_id,))
+    result = rollup(tmp_path, "check", username)
+    assert result.returncode == 1
+    assert result.stdout.splitlines()[-1] == "2 mismatched totals"
+    assert rollup(tmp_path, "rebuild", username).returncode == 0
+    assert rollup(tmp_path, "check").returncode == 0
+    assert database.check_rollups() == []
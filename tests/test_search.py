@@ -0,0 +1,90 @@
+"""
+Full text search over a user's records through /search: prefix matches,
+only the user's own records, kept current by every write, paged with next,
+and any text is taken as plain words.
+"""
+import pytest
+
+
+def search(client, q, **args):
+    response = client.get("/search", query_string=dict(args, q=q, format="json"))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def found(client, q, **args):
+    return {(row["table"], row["id"]) for row in search(client, q, **args)["rows"]}
+
+
+def test_prefix_matches(client, seed, login, this_month):
+    login(client, seed(months=1, rows=3))
+    day = this_month.isoformat()
+    rid = client.post("/api/spending", json={"name": "Costco run", "amount": "54", "date": day, "category": "groceries"}).get_json()["rows"][0]["id"]
+    for q in ("cost", "COSTCO", "costco ru", "groc", "cost groc"):
+        assert found(client, q) == {("spending", rid)}
+    assert found(client, "costcos") == set()
+    assert found(client, "cost", table="income") == set()
+    names = {row["name"] for row in search(client, "spend")["rows"]}
+    assert names and all(name.startswith("Spending") for name in names)
+
+
+def test_only_the_users_own_records(client, seed, login):
+    (user_id, username, _) = seed(months=1, rows=3, users=2)
+    login(client, (user_id, username))
+    mine = search(client, "spending")["rows"]
+    assert mine and all(row["owner"] == username for row in mine)
+    assert search(client, "bench1")["rows"] == []
+
+
+def test_results_follow_writes(database, client, seed, login, this_month):
+    user = seed(months=1, rows=3)
+    login(client, user)
+    day = this_month.isoformat()
+    rid = client.post("/api/spending", json={"name": "Zeppelin ride", "amount": "9", "date": day}).get_json()["rows"][0]["id"]
+    assert found(client, "zeppelin") == {("spending", rid)}
+    # a bulk edit changes what a record is found by
+    response = client.patch("/api/spending/bulk", json={"ids": [rid], "set": {"category": "Aviation"}})
+    assert response.status_code == 200
+    assert found(client, "aviation") == {("spending", rid)}
+    response = client.patch("/api/spending/bulk", json={"ids": [rid], "set": {"category": "travel"}})
+    assert found(client, "aviation") == set()
+    # deleted records are gone, one at a time or in bulk
+    assert client.delete("/api/spending?id={}".format(rid)).status_code == 200
+    assert found(client, "zeppelin") == set()
+    income = found(client, "income")
+    assert income
+    response = client.delete("/api/income/bulk", json={"ids": [i for (_, i) in income]})
+    assert response.status_code == 200
+    assert found(client, "income") == set()
+
+
+def test_pages(client, seed, login):
+    (user_id, username, _) = seed(months=2, rows=20)
+    login(client, (user_id, username))
+    (seen, page) = ([], 1)
+    while page:
+        body = search(client, username, page=page)
+        seen += [(row["table"], row["id"]) for row in body["rows"]]
+        assert len(body["rows"]) <= 100
+        ranks = [row["rank"] for row in body["rows"]]
+        assert ranks == sorted(ranks, reverse=True)
+        page = body["next"]
+    assert len(seen) == len(set(seen)) > 100
+    assert client.get("/search?q=x&page=two").status_code == 400
+
+
+@pytest.mark.parametrize("q", ['"', '""', "OR", "NEAR", "NOT", "AND", "a OR b", "NEAR(a b)", "*", "-spending", "spending*", "(", "name:spending", "'; drop table spending; --"])
+def test_query_syntax_is_taken_as_words(q, client, seed, login):
+    login(client, seed(months=1, rows=3))
+    search(client, q)
+    response = client.get("/search", query_string={"q": q})
+    assert response.status_code == 200
+    # punctuation is dropped, the words still match
+    assert {row["name"] for row in search(client, "spending*")["rows"]} == {row["name"] for row in search(client, "spending")["rows"]}
+
+
+def test_unknown_table(client, seed, login):
+    login(client, seed(months=1, rows=1))
+    response = client.get("/search", query_string={"q": "x", "table": "users", "format": "json"})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "need a valid tablename"
@@ -0,0 +1,47 @@
+"""
+Totals of tables and months without any records are 0, never null.
+"""
+import json
+import pytest
+
+
+def walk(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from walk(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from walk(item)
+    else:
+        yield value
+
+
+@pytest.fixture
+def newcomer(database, client, login):
+    with database.transaction() as c:
+        c.execute("insert into users (username,password) values (%s,%s) returning user_id", ("newcomer", "-"))
+        user = (c.fetchone()[0], "newcomer")
+    login(client, user)
+    return user
+
+
+@pytest.mark.parametrize("tablename,totals", [
+    ("expenses", {"expected": 0, "spent": 0}),
+    ("spending", {"total": 0}),
+    ("income", {"total": 0}),
+    ("goals", {"total": 0}),
+    ("debt", {"total": 0}),
+])
+def test_empty_api_totals(tablename, totals, newcomer, client):
+    response = client.get("/api/{}?month=2001-02".format(tablename))
+    assert response.status_code == 200
+    assert response.get_json() == dict(rows=[], totals=totals, **({"next": None} if tablename in ("spending", "income") else {}))
+
+
+def test_empty_dashboard(newcomer, client):
+    response = client.get("/dashboard?format=json&from=2001-01&to=2001-12")
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data["months"]) == 12
+    assert data["totals"] == {"income": 0, "spending": 0, "expected": 0, "net": 0}
+    assert None not in list(walk(data))